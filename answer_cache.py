@@ -0,0 +1,79 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize(question: str):
+    # Case, punctuation and spacing do not change the answer
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+class AnswerCache:
+    """LRU + TTL cache of chatbot answers.
+
+    Looked up first by the normalized question, then by cosine similarity of
+    the question embedding against every live entry, so "how do I call
+    campus security" and "how can I call the campus security?" share an
+    answer.
+    """
+
+    def __init__(self, maxsize=512, ttl=3600.0, similarity=0.97):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        # key -> (answer, expires_at, unit vector or None)
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        for key in [k for k, (_, expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def get_similar(self, vector):
+        with self._lock:
+            self._expire(time.monotonic())
+            keys = [k for k, entry in self._entries.items() if entry[2] is not None]
+            if not keys:
+                return None
+            matrix = np.stack([self._entries[k][2] for k in keys])
+            scores = matrix @ _unit(vector)
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                return None
+            self._entries.move_to_end(keys[best])
+            return self._entries[keys[best]][0]
+
+    def put(self, key: str, answer: str, vector=None):
+        with self._lock:
+            unit = _unit(vector) if vector is not None else None
+            self._entries[key] = (answer, time.monotonic() + self.ttl, unit)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
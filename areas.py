@@ -0,0 +1,103 @@
+import threading
+import uuid
+
+from clustering import ClusterPyramid
+
+# Map zoom levels clustered ahead of time. MAX_ZOOM shows the groups of the
+# base threshold, and zooms outside the range get the nearest level.
+MIN_ZOOM = 3
+MAX_ZOOM = 16
+
+# Most points in one published batch of additions, which keeps a batch well
+# under the 8000-byte Postgres NOTIFY limit of the broadcast backplane
+PUBLISH_BATCH = 100
+
+
+class HotAreas:
+    """In-memory cluster state behind /areas/.
+
+    Built once from every SOS and report coordinate, then kept current by
+    ``add`` as new rows are committed. Every change bumps ``version``, which is
+    also what the ETag is made of. Holds one clustering per zoom level, see
+    ``clustering.ClusterPyramid``.
+
+    With ``publish`` set, additions are not applied here but handed to it,
+    and whatever receives them calls ``apply`` on every worker's instance.
+    Without it they are applied straight away, to this process only.
+    """
+
+    def __init__(self, threshold=0.2, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+        self.threshold = threshold
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.version = 0
+        self.ready = False
+        # Distinguishes ETags handed out by different processes / restarts
+        self._boot = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._pyramid = ClusterPyramid(threshold, min_zoom, max_zoom)
+        # Markers of whole levels by zoom, for the current version
+        self._snapshots = {}
+        # Called with lists of (lat, lon), at most PUBLISH_BATCH at a time
+        self.publish = None
+
+    def rebuild(self, coords):
+        pyramid = ClusterPyramid(self.threshold, self.min_zoom, self.max_zoom)
+        pyramid.extend(coords)
+        with self._lock:
+            self._pyramid = pyramid
+            self.version += 1
+            self.ready = True
+            self._snapshots = {}
+
+    def add(self, lat, lon):
+        self.add_many([(lat, lon)])
+
+    def add_many(self, points):
+        points = [(float(lat), float(lon)) for lat, lon in points]
+        if self.publish is None:
+            self.apply(points)
+            return
+        for start in range(0, len(points), PUBLISH_BATCH):
+            self.publish(points[start : start + PUBLISH_BATCH])
+
+    def apply(self, points):
+        with self._lock:
+            # Until the first rebuild there is nothing to keep in sync
+            if not self.ready:
+                return
+            for lat, lon in points:
+                self._pyramid.add(lat, lon)
+            self.version += 1
+            self._snapshots = {}
+
+    @property
+    def etag(self):
+        return f'W/"{self._boot}-{self.version}"'
+
+    def snapshot(self, zoom=None):
+        # Returns (etag, markers) of a zoom level, the finest by default;
+        # markers are built once per version
+        zoom = self.max_zoom if zoom is None else min(max(zoom, self.min_zoom), self.max_zoom)
+        with self._lock:
+            if zoom not in self._snapshots:
+                self._snapshots[zoom] = (self.etag, self._pyramid.level(zoom).markers())
+            return self._snapshots[zoom]
+
+    def view(self, box, zoom=None):
+        # (etag, markers) of the groups with their center inside
+        # box = (min_lat, min_lon, max_lat, max_lon)
+        zoom = self.max_zoom if zoom is None else zoom
+        with self._lock:
+            level = self._pyramid.level(zoom)
+            return self.etag, level.markers(level.within(*box))
+
+    def cluster(self, coords, zoom=None):
+        # Markers for coords alone, clustered like the zoom level would be
+        zoom = self.max_zoom if zoom is None else min(max(zoom, self.min_zoom), self.max_zoom)
+        pyramid = ClusterPyramid(self.threshold, zoom, self.max_zoom)
+        pyramid.extend(coords)
+        return pyramid.level(zoom).markers()
+
+
+hot_areas = HotAreas()
@@ -0,0 +1,315 @@
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models, risk, schemas
+from areas import hot_areas
+from crud import (
+    MESSAGE_COLUMNS,
+    RISK_UPSERT,
+    SOS_COLUMNS,
+    risk_params,
+    ticket_messages_query,
+)
+from database import (
+    SOS_MAX_OVERFLOW,
+    SOS_POOL_SIZE,
+    AsyncSessionLocal,
+    AsyncSosSessionLocal,
+    SessionLocal,
+    SosSessionLocal,
+)
+
+logger = logging.getLogger(__name__)
+
+# Async versions of the crud functions the async endpoints use, for the
+# asyncpg engine. Call them through `call` so the endpoints work whether or
+# not DATABASE_ASYNC is enabled.
+
+
+async def call(fn, *args, **kwargs):
+    # Runs crud `fn` (or its async twin below) in its own short-lived session
+    # without blocking the event loop
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            return await globals()[fn.__name__](db, *args, **kwargs)
+
+    def run():
+        with SessionLocal() as db:
+            return fn(db, *args, **kwargs)
+
+    return await run_in_threadpool(run)
+
+
+# Threads for the SOS lane only; the shared threadpool can be full of
+# sync endpoints waiting on the main pool
+_sos_executor = ThreadPoolExecutor(
+    max_workers=SOS_POOL_SIZE + SOS_MAX_OVERFLOW, thread_name_prefix="sos"
+)
+
+
+async def call_sos(fn, *args, **kwargs):
+    # Same as `call`, on the connections and threads reserved for SOS
+    if AsyncSosSessionLocal is not None:
+        async with AsyncSosSessionLocal() as db:
+            return await globals()[fn.__name__](db, *args, **kwargs)
+
+    def run():
+        with SosSessionLocal() as db:
+            return fn(db, *args, **kwargs)
+
+    # copy_context, like the shared threadpool, so per-request query counts
+    # include the SOS lane
+    context = contextvars.copy_context()
+    return await asyncio.wrap_future(_sos_executor.submit(context.run, run))
+
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return (
+        await db.execute(select(models.User).where(models.User.email == email))
+    ).scalar_one_or_none()
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
+    try:
+        db_user = models.User(
+            email=user.email,
+            name=user.name,
+            hashed_password=hashed_password,
+            phone_number=user.phone_number,
+        )
+        db.add(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        return db_user
+    except Exception as exc:
+        # Handle any other unexpected errors
+        await db.rollback()
+        print(exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)
+        )
+
+
+async def get_ticket(db: AsyncSession, ticket_id: int):
+    return await db.get(models.Ticket, ticket_id)
+
+
+async def get_ticket_messages(
+    db: AsyncSession,
+    ticket_id: int,
+    before: int | None = None,
+    after: int | None = None,
+    limit: int = 100,
+):
+    rows = (await db.execute(ticket_messages_query(ticket_id, before, after, limit))).all()
+    return rows if after is not None else rows[::-1]
+
+
+async def create_community_chat_message(
+    db: AsyncSession, message: schemas.CommunityChatMessageCreate
+):
+    try:
+        chat_message = models.CommunityChatMessage(
+            message_text=message.message_text, user_id=message.user_id
+        )
+
+        db.add(chat_message)
+        await db.commit()
+        await db.refresh(chat_message)
+
+        user = (
+            await db.execute(
+                select(models.User).where(models.User.user_id == chat_message.user_id)
+            )
+        ).scalar_one()
+
+        return chat_message, user
+    except Exception as exc:
+        # Handle any other unexpected errors
+        await db.rollback()
+        print(exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)
+        )
+
+
+async def create_ticket_message(
+    db: AsyncSession, message: schemas.TicketChatMessageCreate
+):
+    try:
+        ticket_message = models.TicketChatMessage(
+            ticket_id=message.ticket_id,
+            message_text=message.message_text,
+            user_id=message.user_id,
+        )
+        db.add(ticket_message)
+        await db.commit()
+        await db.refresh(ticket_message)
+
+        user = (
+            await db.execute(
+                select(models.User).where(
+                    models.User.user_id == ticket_message.user_id
+                )
+            )
+        ).scalar_one()
+
+        return ticket_message, user
+    except Exception as exc:
+        # Handle any other unexpected errors
+        await db.rollback()
+        print(exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)
+        )
+
+
+async def reserve_message_ids(db: AsyncSession, table: str, count: int):
+    ids = (
+        await db.execute(
+            text(
+                "SELECT nextval(pg_get_serial_sequence(:table, 'message_id')) "
+                "FROM generate_series(1, :count)"
+            ),
+            {"table": table, "count": count},
+        )
+    ).scalars().all()
+    await db.commit()
+    return sorted(ids)
+
+
+async def create_chat_messages(
+    db: AsyncSession, community: list[dict], ticket: list[dict]
+):
+    try:
+        if community:
+            await db.execute(
+                pg_insert(models.CommunityChatMessage).on_conflict_do_nothing(),
+                community,
+            )
+        if ticket:
+            await db.execute(
+                pg_insert(models.TicketChatMessage).on_conflict_do_nothing(), ticket
+            )
+        await db.commit()
+    except Exception as exc:
+        # Handle any other unexpected errors
+        await db.rollback()
+        print(exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)
+        )
+
+
+async def create_sos_alert(db: AsyncSession, sos: schemas.SOSRequest, message_text):
+    user = (
+        await db.execute(
+            select(models.User.user_id, models.User.name, models.User.phone_number)
+            .where(models.User.user_id == sos.user_id)
+        )
+    ).one_or_none()
+    if user is None:
+        return None
+
+    try:
+        sos_row = (
+            await db.execute(
+                insert(models.SOS)
+                .values(user_id=sos.user_id, lat=sos.lat, long=sos.long, is_open=True)
+                .returning(*SOS_COLUMNS)
+            )
+        ).one()
+        message = (
+            await db.execute(
+                insert(models.CommunityChatMessage)
+                .values(message_text=message_text(user), user_id=sos.user_id)
+                .returning(*MESSAGE_COLUMNS)
+            )
+        ).one()
+        await record_risk(db, [(sos.lat, sos.long)], "sos")
+        await db.commit()
+
+        hot_areas.add(sos.lat, sos.long)
+        return sos_row, message, user
+    except Exception as exc:
+        # Handle any other unexpected errors
+        await db.rollback()
+        print(exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)
+        )
+
+
+async def record_risk(db: AsyncSession, points, kind: str):
+    # crud.record_risk: a failed heatmap update never rolls back the SOS
+    try:
+        async with db.begin_nested():
+            await db.execute(RISK_UPSERT, risk_params(points, kind))
+    except Exception:
+        logger.exception("risk heatmap update failed")
+
+
+async def get_open_sos(db: AsyncSession, sos_id: int):
+    return (
+        await db.execute(
+            select(models.SOS)
+            .where(models.SOS.sos_id == sos_id)
+            .where(models.SOS.is_open == True)
+        )
+    ).scalar_one_or_none()
+
+
+async def get_sos(db: AsyncSession):
+    return (
+        await db.execute(select(models.SOS).where(models.SOS.is_open == True))
+    ).scalars().all()
+
+
+async def create_sos_locations(db: AsyncSession, locations: list[dict]):
+    try:
+        await db.execute(insert(models.SOSLocation), locations)
+        await db.commit()
+    except Exception as exc:
+        # Handle any other unexpected errors
+        await db.rollback()
+        print(exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)
+        )
+
+
+async def get_sos_locations(db: AsyncSession, sos_id: int, limit: int = 100):
+    rows = (
+        await db.execute(
+            select(
+                models.SOSLocation.lat,
+                models.SOSLocation.long,
+                models.SOSLocation.recorded_at,
+            )
+            .where(models.SOSLocation.sos_id == sos_id)
+            .order_by(models.SOSLocation.recorded_at.desc())
+            .limit(limit)
+        )
+    ).all()
+    return rows[::-1]
+
+
+async def prune_risk_hours(db: AsyncSession):
+    await db.execute(
+        delete(models.RiskCellHour).where(
+            models.RiskCellHour.hour < func.localtimestamp() - risk.HOURS_KEPT
+        )
+    )
+    await db.commit()
@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+CHANNEL = "safeher_broadcast"
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+PG_NOTIFY_LIMIT = 7999
+
+
+def encode(room: str, text: str | None, close=False):
+    # Compact and not ASCII-escaped, so non-Latin chat text stays small enough
+    # for PG_NOTIFY_LIMIT
+    return json.dumps(
+        {"room": room, "text": text, "close": close},
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+
+def decode(payload):
+    envelope = json.loads(payload)
+    return envelope["room"], envelope["text"], envelope["close"]
+
+
+class InProcessBackplane:
+    """Backplane for a single worker, or several hubs in one process.
+
+    Every hub started on the same instance sees every message, which makes
+    it a local stand-in for the networked backplanes below.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+
+    async def start(self, deliver):
+        self.subscribers.append(deliver)
+
+    async def publish(self, payload: str):
+        for deliver in list(self.subscribers):
+            deliver(payload)
+
+    async def stop(self):
+        self.subscribers.clear()
+
+
+class RedisBackplane:
+    def __init__(self, url: str):
+        self.url = url
+        self.redis = None
+        self.pubsub = None
+        self.reader = None
+
+    async def start(self, deliver):
+        # Only needed when a redis:// backplane is configured
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(self.url)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(CHANNEL)
+        self.reader = asyncio.create_task(self._read(deliver))
+
+    async def _read(self, deliver):
+        async for message in self.pubsub.listen():
+            deliver(message["data"])
+
+    async def publish(self, payload: str):
+        await self.redis.publish(CHANNEL, payload)
+
+    async def stop(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+        if self.redis is not None:
+            await self.redis.aclose()
+
+
+class PostgresBackplane:
+    """LISTEN/NOTIFY on the application database, no extra service needed."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.listener = None
+        self.publisher = None
+
+    async def start(self, deliver):
+        import asyncpg
+
+        self.listener = await asyncpg.connect(self.url)
+        self.publisher = await asyncpg.connect(self.url)
+        await self.listener.add_listener(
+            CHANNEL, lambda _conn, _pid, _channel, payload: deliver(payload)
+        )
+
+    async def publish(self, payload: str):
+        if len(payload.encode("utf-8")) > PG_NOTIFY_LIMIT:
+            raise ValueError("message too large for Postgres NOTIFY")
+        await self.publisher.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+
+    async def stop(self):
+        for connection in (self.listener, self.publisher):
+            if connection is not None:
+                await connection.close()
+
+
+def create_backplane(url: str | None, database_url: str | None = None):
+    # BROADCAST_BACKPLANE: unset/"memory", "postgres" (the app database),
+    # or a redis:// / postgresql:// URL
+    if not url or url == "memory":
+        return InProcessBackplane()
+    if url == "postgres":
+        url = database_url
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackplane(url)
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresBackplane(url)
+    raise ValueError(f"unknown broadcast backplane: {url}")
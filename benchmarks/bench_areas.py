@@ -0,0 +1,92 @@
+"""/areas/ for a map viewport: whole-dataset clusters vs bbox + zoom level.
+
+    python -m benchmarks.bench_areas [--points 200000] [--campuses 20] \
+        [--database-url postgresql://localhost/safeher_bench]
+
+Points are scattered around --campuses campuses like benchmarks.seed. For
+each viewport it reports the markers returned, the JSON payload and the
+time to answer from the in-memory pyramid, next to the full marker list
+the endpoint used to return (built on every change, cached in between).
+With --database-url (seeded by benchmarks.seed) it also times reading
+every coordinate against reading only a campus-sized box through the
+(lat, long) indexes, which is what a box request costs before the pyramid
+is built.
+"""
+import argparse
+import json
+import random
+import time
+
+from areas import HotAreas
+from benchmarks import seed as seeding
+
+
+def campus_points(centers, count, rng):
+    points = []
+    for _ in range(count):
+        lat, lon = rng.choice(centers)
+        points.append({"latitude": lat + rng.gauss(0, 0.02), "longitude": lon + rng.gauss(0, 0.02)})
+    return points
+
+
+def timed(fn, repeat=20):
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=200_000)
+    parser.add_argument("--campuses", type=int, default=20)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    centers = seeding.campuses(rng, args.campuses)
+    points = campus_points(centers, args.points, rng)
+
+    areas = HotAreas()
+    started = time.perf_counter()
+    areas.rebuild(points)
+    print(f"pyramid for {args.points} points built in {time.perf_counter() - started:.2f} s")
+    added = campus_points(centers, 1000, rng)
+    started = time.perf_counter()
+    for point in added:
+        areas.add(point["latitude"], point["longitude"])
+    print(f"add: {(time.perf_counter() - started) / len(added) * 1e6:.1f} us per point, all levels\n")
+
+    lat, lon = centers[0]
+    viewports = [
+        ("everything (old /areas/)", (-90.0, -180.0, 90.0, 180.0), None),
+        ("country, zoom 5", (5.0, 65.0, 35.0, 92.0), 5),
+        ("region, zoom 9", (lat - 1, lon - 1, lat + 1, lon + 1), 9),
+        ("campus, zoom 14", (lat - 0.05, lon - 0.05, lat + 0.05, lon + 0.05), 14),
+        ("street, zoom 17", (lat - 0.005, lon - 0.005, lat + 0.005, lon + 0.005), 17),
+    ]
+    print(f"{'viewport':<26} {'markers':>8} {'bytes':>10} {'ms':>8}")
+    for name, box, zoom in viewports:
+        elapsed, (_, markers) = timed(lambda: areas.view(box, zoom))
+        size = len(json.dumps({"markers": markers}))
+        print(f"{name:<26} {len(markers):>8} {size:>10} {elapsed * 1e3:>8.3f}")
+
+    if args.database_url:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import Session
+
+        import crud
+
+        engine = create_engine(args.database_url)
+        box = (lat - 0.05, lon - 0.05, lat + 0.05, lon + 0.05)
+        with Session(engine) as db:
+            all_time, every = timed(lambda: crud.get_all_coords(db), 5)
+            box_time, inside = timed(lambda: crud.get_coords_in_box(db, *box), 5)
+        print(f"\n{'read':<26} {'rows':>8} {'ms':>10}")
+        print(f"{'get_all_coords':<26} {len(every):>8} {all_time * 1e3:>10.2f}")
+        print(f"{'get_coords_in_box campus':<26} {len(inside):>8} {box_time * 1e3:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Concurrency benchmark for chat message inserts from async handlers.
+
+    python -m benchmarks.bench_async_db \
+        --database-url postgresql://localhost/safeher_bench [--clients 200]
+
+Needs a scratch Postgres database (tables are dropped and recreated) and
+asyncpg installed. Each simulated client inserts --messages community chat
+messages back to back, the way community_chat_endpoint does, using:
+
+  blocking    sync crud called straight from the coroutine (the old handlers)
+  threadpool  sync crud in run_in_threadpool, each call with its own session
+  asyncpg     async_crud on an AsyncSession
+
+While that runs a ticker measures how late the event loop wakes it up, which
+is what every other request on the worker experiences.
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import async_crud, crud, models, schemas
+
+
+async def ticker(stop, lags, interval=0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(mode, args, sync_factory, async_factory):
+    message = schemas.CommunityChatMessageCreate(message_text="hello", user_id=1)
+
+    async def client():
+        if mode == "blocking":
+            with sync_factory() as db:
+                for _ in range(args.messages):
+                    crud.create_community_chat_message(db, message)
+        elif mode == "threadpool":
+
+            def insert_one():
+                with sync_factory() as db:
+                    return crud.create_community_chat_message(db, message)
+
+            for _ in range(args.messages):
+                await run_in_threadpool(insert_one)
+        else:
+            for _ in range(args.messages):
+                async with async_factory() as db:
+                    await async_crud.create_community_chat_message(db, message)
+
+    stop, lags = asyncio.Event(), []
+    tick = asyncio.create_task(ticker(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+
+    total = args.clients * args.messages
+    lags.sort()
+    p99 = lags[int(0.99 * (len(lags) - 1))] if lags else elapsed
+    worst = lags[-1] if lags else elapsed
+    print(
+        f"{mode:<11} {total / elapsed:>10.0f} {p99 * 1e3:>14.1f} {worst * 1e3:>14.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--pool-size", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        args.database_url, pool_size=args.pool_size, max_overflow=args.clients
+    )
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    sync_factory = sessionmaker(bind=engine, autoflush=False)
+    with sync_factory() as db:
+        db.execute(
+            insert(models.User),
+            [{"email": "a@b.c", "name": "A", "hashed_password": "x", "phone_number": "0"}],
+        )
+        db.commit()
+
+    async_engine = create_async_engine(
+        args.database_url.replace("postgresql://", "postgresql+asyncpg://", 1),
+        pool_size=args.pool_size,
+        max_overflow=args.clients,
+    )
+    async_factory = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False
+    )
+
+    print(f"{'mode':<11} {'messages/s':>10} {'loop lag p99':>14} {'loop lag max':>14}")
+    for mode in ("blocking", "threadpool", "asyncpg"):
+        asyncio.run(run(mode, args, sync_factory, async_factory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""End-to-end fan-out latency across workers sharing a broadcast backplane.
+
+    python -m benchmarks.bench_backplane [--backplane memory|redis://...|postgresql://...] \
+        [--workers 4] [--clients 500] [--messages 200]
+
+Every worker runs its own Hub with --clients fake sockets in the community
+room; worker 0 publishes --messages messages stamped with the send time and
+every worker records when each of its sockets got them. With the default
+"memory" backplane the workers are hubs inside one process; with a Redis or
+Postgres URL each worker is a separate process, like uvicorn --workers.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import statistics
+import time
+
+from backplane import InProcessBackplane, create_backplane
+from broadcast import COMMUNITY_ROOM, Hub
+
+
+class StampedSocket:
+    def __init__(self, latencies):
+        self.latencies = latencies
+
+    async def send_text(self, text):
+        sent = json.loads(text)["sent"]
+        self.latencies.append(time.time() - sent)
+
+    async def close(self):
+        pass
+
+
+async def run_worker(bus, index, args, latencies, ready, go):
+    hub = Hub(queue_size=args.messages + 1)
+    await hub.start(bus)
+    for _ in range(args.clients):
+        hub.join(COMMUNITY_ROOM, StampedSocket(latencies))
+    await ready(index)
+    await go()
+
+    if index == 0:
+        for i in range(args.messages):
+            hub.publish(COMMUNITY_ROOM, {"message_id": i, "sent": time.time()})
+            await asyncio.sleep(args.interval)
+
+    expected = args.clients * args.messages
+    deadline = time.time() + args.timeout
+    while len(latencies) < expected and time.time() < deadline:
+        await asyncio.sleep(0.05)
+    await hub.close_room(COMMUNITY_ROOM)
+    await hub.stop()
+
+
+def process_worker(url, index, args, results, barrier):
+    latencies = []
+
+    async def ready(_):
+        await asyncio.sleep(0.5)  # let the subscription settle
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+
+    async def go():
+        pass
+
+    asyncio.run(run_worker(create_backplane(url), index, args, latencies, ready, go))
+    results.put(latencies)
+
+
+async def in_process(args):
+    bus = InProcessBackplane()
+    started = asyncio.Event()
+    count = 0
+
+    async def ready(_):
+        nonlocal count
+        count += 1
+        if count == args.workers:
+            started.set()
+
+    per_worker = [[] for _ in range(args.workers)]
+    await asyncio.gather(
+        *(
+            run_worker(bus, i, args, per_worker[i], ready, started.wait)
+            for i in range(args.workers)
+        )
+    )
+    return per_worker
+
+
+def report(per_worker, args):
+    everything = sorted(value for latencies in per_worker for value in latencies)
+    expected = args.workers * args.clients * args.messages
+    print(f"backplane: {args.backplane}, workers: {args.workers}")
+    print(f"delivered {len(everything)}/{expected}")
+    if everything:
+        p99 = everything[int(0.99 * (len(everything) - 1))]
+        print(
+            f"latency p50/p99/max (ms): {statistics.median(everything) * 1e3:.2f} / "
+            f"{p99 * 1e3:.2f} / {everything[-1] * 1e3:.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backplane", default="memory")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.005)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    if args.backplane == "memory":
+        report(asyncio.run(in_process(args)), args)
+        return
+
+    results = multiprocessing.Queue()
+    barrier = multiprocessing.Barrier(args.workers)
+    workers = [
+        multiprocessing.Process(
+            target=process_worker, args=(args.backplane, i, args, results, barrier)
+        )
+        for i in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    per_worker = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    report(per_worker, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Fan-out load test for broadcast.Hub with simulated WebSocket clients.
+
+    python -m benchmarks.bench_broadcast [--clients 5000] [--messages 20] \
+        [--slow 0.01] [--dead 0.001]
+
+Clients are in-process fakes with a random per-send latency; a fraction are
+"slow" (one second per send) or "dead" (every send raises). Reports how long
+the publisher is blocked and how long the healthy clients wait for each
+message, next to the old serial ``await client.send_json`` loop.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from broadcast import Hub
+
+
+class FakeWebSocket:
+    def __init__(self, latency, dead=False):
+        self.latency = latency
+        self.dead = dead
+        self.received: list[float] = []
+        self.closed = False
+
+    async def send_text(self, text):
+        if self.dead:
+            raise RuntimeError("connection reset")
+        await asyncio.sleep(self.latency)
+        self.received.append(time.perf_counter())
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data, separators=(",", ":")))
+
+    async def close(self):
+        self.closed = True
+
+
+def make_clients(n, slow, dead, seed=0):
+    rng = random.Random(seed)
+    clients = []
+    for _ in range(n):
+        roll = rng.random()
+        if roll < dead:
+            clients.append(FakeWebSocket(0, dead=True))
+        elif roll < dead + slow:
+            clients.append(FakeWebSocket(1.0))
+        else:
+            clients.append(FakeWebSocket(rng.uniform(0.0005, 0.005)))
+    return clients
+
+
+def message(i):
+    return {
+        "user": {"user_id": "1", "name": "Load Test"},
+        "message_id": str(i),
+        "message_text": "x" * 200,
+        "created_at": "2026-01-01 00:00:00",
+    }
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_hub(args):
+    hub = Hub(queue_size=args.queue_size, send_timeout=args.send_timeout)
+    clients = make_clients(args.clients, args.slow, args.dead)
+    for client in clients:
+        hub.join("community", client)
+
+    publish_times, sent_at = [], []
+    for i in range(args.messages):
+        start = time.perf_counter()
+        hub.publish("community", message(i))
+        publish_times.append(time.perf_counter() - start)
+        sent_at.append(start)
+        await asyncio.sleep(args.interval)
+
+    # Let healthy clients drain
+    await asyncio.sleep(0.5)
+    healthy = [c for c in clients if not c.dead and c.latency < 1.0]
+    delays = [
+        received - sent_at[i]
+        for c in healthy
+        for i, received in enumerate(c.received[: len(sent_at)])
+    ]
+    delivered = sum(len(c.received) == args.messages for c in healthy)
+
+    print("hub")
+    print(f"  publish p50/p99 (ms): {statistics.median(publish_times) * 1e3:.2f} / {percentile(publish_times, 0.99) * 1e3:.2f}")
+    print(f"  delivery p50/p99 (ms): {statistics.median(delays) * 1e3:.2f} / {percentile(delays, 0.99) * 1e3:.2f}")
+    print(f"  healthy clients with every message: {delivered}/{len(healthy)}")
+    print(f"  disconnected: {hub.disconnected}, still connected: {hub.size('community')}")
+    for room in list(hub.rooms):
+        await hub.close_room(room)
+
+
+async def run_serial(args):
+    clients = make_clients(args.clients, args.slow, args.dead)
+    messages = min(args.messages, args.serial_messages)
+    elapsed = []
+    for i in range(messages):
+        start = time.perf_counter()
+        for client in clients:
+            try:
+                await client.send_json(message(i))
+            except Exception:
+                pass
+        elapsed.append(time.perf_counter() - start)
+    print("serial loop")
+    print(f"  per message (s): {statistics.mean(elapsed):.2f} over {messages} messages")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--slow", type=float, default=0.01)
+    parser.add_argument("--dead", type=float, default=0.001)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--send-timeout", type=float, default=2.0)
+    parser.add_argument("--serial-messages", type=int, default=1)
+    args = parser.parse_args()
+
+    asyncio.run(run_hub(args))
+    asyncio.run(run_serial(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Chat message throughput, per-message inserts against write-behind.
+
+    python -m benchmarks.bench_chat_writer \
+        --database-url postgresql://localhost/safeher_bench [--clients 100] \
+        [--messages 50] [--tickets 20]
+
+Needs a scratch Postgres database (tables are dropped and recreated). Each
+simulated client sends --messages chat messages back to back, half to the
+community chat and half to one of --tickets tickets, the way the chat
+WebSockets do:
+
+  per message   crud.create_*_message in the threadpool, as without
+                CHAT_WRITE_BEHIND
+  write-behind  ChatWriter.add, ids from reserved blocks, batched writes
+
+"msgs/s" counts messages ready to broadcast; "durable/s" counts them once
+they are committed, so for write-behind it includes the final flush.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+import crud, models, schemas
+from chat_writer import ChatWriter
+
+
+def setup(database_url, tickets, pool_size):
+    engine = create_engine(database_url, pool_size=pool_size, max_overflow=0)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    with factory() as db:
+        db.execute(
+            insert(models.User),
+            [
+                {
+                    "email": f"chat-{i}@example.com",
+                    "name": f"Chat {i}",
+                    "hashed_password": "x",
+                    "phone_number": "0000000000",
+                }
+                for i in range(2)
+            ],
+        )
+        db.execute(
+            insert(models.Ticket),
+            [{"user_id": 1, "teacher_id": 2, "is_open": True} for _ in range(tickets)],
+        )
+        db.commit()
+    return factory
+
+
+def count_rows(factory):
+    with factory() as db:
+        return db.execute(
+            text(
+                "SELECT (SELECT count(*) FROM community_chat_messages)"
+                " + (SELECT count(*) FROM ticket_chat_messages)"
+            )
+        ).scalar()
+
+
+async def per_message(args, factory):
+    def community(message):
+        with factory() as db:
+            return crud.create_community_chat_message(db, message)
+
+    def ticket(message):
+        with factory() as db:
+            return crud.create_ticket_message(db, message)
+
+    latencies = []
+
+    async def client(i):
+        for n in range(args.messages):
+            started = time.perf_counter()
+            if n % 2:
+                await run_in_threadpool(
+                    ticket,
+                    schemas.TicketChatMessageCreate(
+                        ticket_id=i % args.tickets + 1, message_text="hello", user_id=1
+                    ),
+                )
+            else:
+                await run_in_threadpool(
+                    community,
+                    schemas.CommunityChatMessageCreate(message_text="hello", user_id=1),
+                )
+            latencies.append(time.perf_counter() - started)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, latencies
+
+
+async def write_behind(args, factory):
+    writer = ChatWriter(
+        flush_interval=args.flush_interval,
+        batch_size=args.batch_size,
+        max_pending=args.max_pending,
+        id_block=args.id_block,
+    )
+
+    def save(community, ticket):
+        with factory() as db:
+            crud.create_chat_messages(db, community, ticket)
+
+    def reserve(table, count):
+        with factory() as db:
+            return crud.reserve_message_ids(db, table, count)
+
+    await writer.start(
+        lambda community, ticket: run_in_threadpool(save, community, ticket),
+        lambda table, count: run_in_threadpool(reserve, table, count),
+    )
+    latencies = []
+
+    async def client(i):
+        for n in range(args.messages):
+            started = time.perf_counter()
+            await writer.add(1, "hello", "Chat 0", ticket_id=i % args.tickets + 1 if n % 2 else None)
+            latencies.append(time.perf_counter() - started)
+            # A real socket yields between messages
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(args.clients)))
+    accepted = time.perf_counter() - start
+    await writer.stop()
+    return accepted, time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--tickets", type=int, default=20)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-pending", type=int, default=5000)
+    parser.add_argument("--id-block", type=int, default=100)
+    args = parser.parse_args()
+
+    total = args.clients * args.messages
+    print(f"{total} messages from {args.clients} clients")
+    print(f"{'path':<13} {'msgs/s':>10} {'durable/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, run in (("per message", per_message), ("write-behind", write_behind)):
+        factory = setup(args.database_url, args.tickets, args.pool_size)
+        accepted, durable, latencies = asyncio.run(run(args, factory))
+        stored = count_rows(factory)
+        latencies.sort()
+        p99 = latencies[int(0.99 * (len(latencies) - 1))]
+        print(
+            f"{name:<13} {total / accepted:>10.0f} {total / durable:>10.0f} "
+            f"{statistics.median(latencies) * 1e3:>8.2f} {p99 * 1e3:>8.2f}"
+            + ("" if stored == total else f"  ({stored} rows stored!)")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Scaling benchmark for /areas/ clustering.
+
+    python -m benchmarks.bench_clustering [--max-points 1000000]
+
+The original O(n*k) loop is only timed up to --baseline-limit points, past that
+it takes minutes per run.
+"""
+import argparse
+import random
+import time
+
+from clustering import ClusterIndex
+from utils import distance
+
+
+def legacy_group_points(points, threshold=0.2):
+    # utils.group_points as it was before the grid index
+    groups = []
+    for point in points:
+        for group in groups:
+            center = group["center"]
+            if (
+                distance(
+                    point["latitude"],
+                    point["longitude"],
+                    center["latitude"],
+                    center["longitude"],
+                )
+                <= threshold
+            ):
+                group["points"].append(point)
+                n = len(group["points"])
+                center["latitude"] = sum(p["latitude"] for p in group["points"]) / n
+                center["longitude"] = sum(p["longitude"] for p in group["points"]) / n
+                break
+        else:
+            groups.append({"center": point.copy(), "points": [point]})
+    return groups
+
+
+def campus_points(n, seed=0, campuses=20):
+    # Points scattered around a handful of campuses, roughly 5 km across each
+    rng = random.Random(seed)
+    centers = [(rng.uniform(8, 32), rng.uniform(70, 88)) for _ in range(campuses)]
+    points = []
+    for _ in range(n):
+        lat, lon = rng.choice(centers)
+        points.append(
+            {
+                "latitude": lat + rng.gauss(0, 0.02),
+                "longitude": lon + rng.gauss(0, 0.02),
+            }
+        )
+    return points
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-points", type=int, default=1_000_000)
+    parser.add_argument("--baseline-limit", type=int, default=10_000)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"{'points':>10} {'groups':>8} {'grid (s)':>10} {'legacy (s)':>11}")
+    n = 1_000
+    while n <= args.max_points:
+        points = campus_points(n)
+
+        def run():
+            index = ClusterIndex(args.threshold)
+            index.extend(points)
+            return index
+
+        grid_time, index = timed(run)
+        legacy = "-"
+        if n <= args.baseline_limit:
+            legacy_time, groups = timed(legacy_group_points, points, args.threshold)
+            assert len(groups) == len(index)
+            legacy = f"{legacy_time:.3f}"
+        print(f"{n:>10} {len(index):>8} {grid_time:>10.3f} {legacy:>11}")
+        n *= 10
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Community chat history: N+1 lookup vs joined keyset page.
+
+    python -m benchmarks.bench_community_history [--messages 100000] \
+        [--database-url postgresql://localhost/safeher_bench]
+
+Defaults to an in-memory SQLite database so it runs anywhere; point it at a
+scratch Postgres database for numbers that include network round trips.
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+
+import crud, models
+
+
+def legacy_get_community_chat_messages(db):
+    # crud.get_community_chat_messages before the join
+    resp = []
+    for chat in db.query(models.CommunityChatMessage).all():
+        user = db.query(models.User).filter(models.User.user_id == chat.user_id).one()
+        resp.append(
+            {
+                "user": {"user_id": str(chat.user_id), "name": str(user.name)},
+                "message_id": str(chat.message_id),
+                "message_text": str(chat.message_text),
+                "created_at": str(chat.created_at),
+            }
+        )
+    return resp
+
+
+def seed(session, users, messages):
+    session.execute(
+        insert(models.User),
+        [
+            {
+                "email": f"user{i}@example.com",
+                "name": f"User {i}",
+                "hashed_password": "x",
+                "phone_number": "0000000000",
+            }
+            for i in range(users)
+        ],
+    )
+    rng = random.Random(0)
+    batch = 10_000
+    for start in range(0, messages, batch):
+        session.execute(
+            insert(models.CommunityChatMessage),
+            [
+                {"user_id": rng.randint(1, users), "message_text": f"message {i}"}
+                for i in range(start, min(start + batch, messages))
+            ],
+        )
+    session.commit()
+
+
+def measure(engine, session_factory, fn):
+    statements = 0
+
+    def count(*_):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    db = session_factory()
+    try:
+        start = time.perf_counter()
+        rows = fn(db)
+        elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+        event.remove(engine, "before_cursor_execute", count)
+    return elapsed, statements, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        seed(session, args.users, args.messages)
+
+    with session_factory() as db:
+        newest = crud.get_community_chat_messages(db, limit=1)[0]["message_id"]
+    middle = int(newest) // 2
+
+    cases = [
+        ("joined, latest page", lambda db: crud.get_community_chat_messages(db)),
+        (
+            "joined, page before middle",
+            lambda db: crud.get_community_chat_messages(db, before=middle),
+        ),
+        (
+            "joined, full history",
+            lambda db: crud.get_community_chat_messages(db, limit=args.messages),
+        ),
+    ]
+    if not args.skip_legacy:
+        cases.append(("legacy N+1, full history", legacy_get_community_chat_messages))
+
+    print(f"{'case':<28} {'seconds':>9} {'queries':>8} {'rows':>8}")
+    for name, fn in cases:
+        elapsed, statements, rows = measure(engine, session_factory, fn)
+        print(f"{name:<28} {elapsed:>9.3f} {statements:>8} {rows:>8}")
+
+
+if __name__ == "__main__":
+    main()
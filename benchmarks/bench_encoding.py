@@ -0,0 +1,134 @@
+"""Payload size and serialization time of the bulk endpoints per encoding.
+
+    python -m benchmarks.bench_encoding [--rows 100000] [--repeat 5]
+
+Builds --rows synthetic rows for /areas/, /sos/ and /community_chat/messages/
+and encodes them the way the endpoint used to (Pydantic response model or
+jsonable_encoder, then the standard json module) and with each encoding
+main serves now (see encoding.py). Times are the median of --repeat runs
+and cover building the document from the rows plus serializing it; gzip is
+the size after `gzip -6`, for clients behind a compressing proxy.
+Without msgpack installed only the JSON rows are shown.
+"""
+import os
+
+os.environ.setdefault("CHATBOT_WARM", "0")
+
+import argparse
+import gzip
+import json
+import random
+import statistics
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+import crud, encoding, models, schemas
+from main import area_columns, community_chat_columns, sos_columns, sos_document
+
+SOSRow = namedtuple("SOSRow", "sos_id user_id lat long is_open created_at")
+ChatRow = namedtuple("ChatRow", "message_id user_id message_text created_at name")
+
+
+def starlette_json(content):
+    # starlette.responses.JSONResponse.render
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def response_model(model):
+    # What FastAPI did with a response_model: validate, dump to JSON types
+    adapter = TypeAdapter(model)
+    return lambda content: starlette_json(
+        adapter.dump_python(adapter.validate_python(content), mode="json")
+    )
+
+
+def cases(count, rng):
+    start = datetime(2024, 1, 1)
+    markers = [
+        {
+            "center": {"latitude": rng.uniform(8, 32), "longitude": rng.uniform(70, 88)},
+            "radius": rng.randint(2, 40),
+        }
+        for _ in range(count)
+    ]
+    sos_rows = [
+        SOSRow(
+            i, rng.randint(1, 5000), rng.uniform(8, 32), rng.uniform(70, 88), True, start + timedelta(seconds=i)
+        )
+        for i in range(1, count + 1)
+    ]
+    sos_objects = [models.SOS(**row._asdict()) for row in sos_rows]
+    chats = [
+        ChatRow(
+            i,
+            rng.randint(1, 5000),
+            f"Community message {i}, is anyone near the library?",
+            start + timedelta(seconds=30 * i),
+            f"User {i % 5000}",
+        )
+        for i in range(1, count + 1)
+    ]
+
+    markers_model = response_model(schemas.Markers)
+    chat_model = response_model(List[schemas.ChatMessageSchema])
+    return {
+        "/areas/": (
+            lambda: markers_model({"markers": markers}),
+            lambda: {"markers": markers},
+            lambda: area_columns(markers),
+        ),
+        "/sos/": (
+            lambda: starlette_json(jsonable_encoder(sos_objects)),
+            lambda: sos_document(sos_rows),
+            lambda: sos_columns(sos_rows),
+        ),
+        "/community_chat/messages/": (
+            lambda: chat_model([crud.community_chat_message(chat) for chat in chats]),
+            lambda: [crud.community_chat_message(chat) for chat in chats],
+            lambda: community_chat_columns(chats),
+        ),
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples), body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    media_types = [encoding.JSON]
+    if encoding.negotiate(encoding.MSGPACK) == encoding.MSGPACK:
+        media_types += [encoding.MSGPACK, encoding.COLUMNS]
+    else:
+        print("msgpack is not installed, only JSON is shown")
+
+    names = {encoding.JSON: "json", encoding.MSGPACK: "msgpack", encoding.COLUMNS: "columns"}
+    print(f"{'endpoint':<27} {'encoding':<14} {'bytes':>11} {'gzip':>10} {'ms':>9}")
+    for endpoint, (legacy, document, columns) in cases(args.rows, random.Random(0)).items():
+        runs = [("json (before)", legacy)]
+        for media_type in media_types:
+            runs.append((names[media_type], lambda m=media_type: encoding.encode(m, document, columns)))
+        for name, fn in runs:
+            elapsed, body = timed(fn, args.repeat)
+            compressed = len(gzip.compress(body, 6))
+            print(f"{endpoint:<27} {name:<14} {len(body):>11} {compressed:>10} {elapsed * 1e3:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
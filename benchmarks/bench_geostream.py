@@ -0,0 +1,80 @@
+"""Routing cost of the SOS geo-stream with many watching clients.
+
+    python -m benchmarks.bench_geostream [--subscribers 10000] [--events 2000] \
+        [--area-km 40] [--radius-km 5]
+
+Subscribers are spread uniformly over a square of --area-km around a campus,
+each watching a circle of up to --radius-km. Each event is an SOS opened and
+then closed at a random spot in the same square. Reports time per routed
+event for SOSFeed.route next to a scan that checks every subscriber, and
+how many clients each event reaches.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from geostream import SOSFeed
+from utils import distance
+
+CENTER = (28.7973, 77.5368)
+
+
+def random_point(area_km):
+    half = area_km / 2 / 111.32
+    return (
+        CENTER[0] + random.uniform(-half, half),
+        CENTER[1] + random.uniform(-half, half) / 0.876,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--area-km", type=float, default=40.0)
+    parser.add_argument("--radius-km", type=float, default=5.0)
+    args = parser.parse_args()
+    random.seed(1)
+
+    feed = SOSFeed()
+    members = {}
+    watchers = []
+    for i in range(args.subscribers):
+        lat, lon = random_point(args.area_km)
+        radius = random.uniform(0.5, args.radius_km)
+        feed.watch(i, lat, lon, radius)
+        members[i] = i
+        watchers.append((i, lat, lon, radius))
+
+    messages = []
+    for sos_id in range(args.events):
+        lat, lon = random_point(args.area_km)
+        opened = {"event": "sos_opened", "sos_id": sos_id, "user_id": sos_id, "lat": lat, "long": lon}
+        messages.append((json.dumps(opened), lat, lon))
+        messages.append((json.dumps({**opened, "event": "sos_closed"}), lat, lon))
+
+    start = time.perf_counter()
+    reached = [len(feed.route(text, members)) for text, _, _ in messages]
+    indexed = (time.perf_counter() - start) / len(messages)
+
+    sample = messages[: max(2, len(messages) // 20)]
+    start = time.perf_counter()
+    for text, lat, lon in sample:
+        json.loads(text)
+        [i for i, w_lat, w_lon, radius in watchers if distance(lat, lon, w_lat, w_lon) <= radius]
+    scan = (time.perf_counter() - start) / len(sample)
+
+    print(f"{args.subscribers} subscribers, {len(messages)} events")
+    print(f"{'router':<10} {'us/event':>10}")
+    print(f"{'grid':<10} {indexed * 1e6:>10.1f}")
+    print(f"{'full scan':<10} {scan * 1e6:>10.1f}")
+    print(
+        f"clients reached per event: mean {statistics.mean(reached):.1f}, "
+        f"max {max(reached)}; open SOS left in index: {len(feed.open)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Cost of the request instrumentation, to check it can stay on in production.
+
+    python -m benchmarks.bench_instrumentation [--requests 5000]
+
+Serves two endpoints in process through httpx's ASGI transport, once on a
+bare app and once with instrumentation.install: /ping does nothing, /rows
+runs three queries on an in-memory SQLite engine. The difference per request
+is what the middleware and the statement hooks add.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+import instrumentation
+
+
+def build(instrumented):
+    app = FastAPI()
+    engine = create_engine(
+        "sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}
+    )
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.get("/rows/{n}")
+    def rows(n: int):
+        with engine.connect() as connection:
+            return [connection.execute(text("SELECT :n"), {"n": n + i}).scalar() for i in range(3)]
+
+    if instrumented:
+        instrumentation.install(app)
+    return app
+
+
+async def measure(app, path, count):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(100):
+            await client.get(path)
+        start = time.perf_counter()
+        for _ in range(count):
+            await client.get(path)
+        return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    paths = ("/ping", "/rows/1")
+    # Every bare run first: the statement hooks, once installed, are process wide
+    bare_times = [asyncio.run(measure(build(False), path, args.requests)) for path in paths]
+    app = build(True)
+    print(f"{'endpoint':<10} {'bare us':>9} {'metrics us':>11} {'overhead us':>12}")
+    for path, bare in zip(paths, bare_times):
+        instrumented = asyncio.run(measure(app, path, args.requests))
+        print(
+            f"{path:<10} {bare * 1e6:>9.0f} {instrumented * 1e6:>11.0f} "
+            f"{(instrumented - bare) * 1e6:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Ingest rate of live location sharing on one worker.
+
+    python -m benchmarks.bench_location [--database-url sqlite:///bench.db] \
+        [--sos 200] [--watchers 5] [--seconds 5]
+
+Every simulated phone sends a JSON location message as fast as the event
+loop takes them, for --sos open SOS at once, each watched by --watchers fake
+sockets. LocationStream coalesces, flushes to the database every second
+and fans out every half second, as in the app. The "per update" row is the
+straightforward alternative, one INSERT and commit per message.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import crud, models
+from broadcast import Hub, location_room
+from location_sharing import LocationStream
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = 0
+
+    async def send_text(self, text):
+        self.received += 1
+
+
+def setup(database_url, sos_count):
+    engine = create_engine(database_url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    with factory() as db:
+        db.execute(
+            insert(models.User),
+            [
+                {
+                    "email": "phone@example.com",
+                    "name": "Phone",
+                    "hashed_password": "x",
+                    "phone_number": "0000000000",
+                }
+            ],
+        )
+        db.execute(
+            insert(models.SOS),
+            [{"user_id": 1, "lat": 28.79, "long": 77.53, "is_open": True} for _ in range(sos_count)],
+        )
+        db.commit()
+    return factory
+
+
+def messages(count):
+    return [
+        json.dumps({"lat": 28.79 + random.uniform(-0.01, 0.01), "long": 77.53 + random.uniform(-0.01, 0.01)})
+        for _ in range(count)
+    ]
+
+
+async def pipelined(args, factory):
+    hub = Hub()
+    stream = LocationStream(hub)
+    sockets = []
+    for sos_id in range(1, args.sos + 1):
+        for _ in range(args.watchers):
+            websocket = FakeWebSocket()
+            hub.join(location_room(sos_id), websocket)
+            sockets.append(websocket)
+
+    def save(rows):
+        with factory() as db:
+            crud.create_sos_locations(db, rows)
+
+    await stream.start(lambda rows: run_in_threadpool(save, rows))
+    payloads = messages(1000)
+    received = 0
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    while time.perf_counter() < deadline:
+        # A burst of one message per phone, then let the loop breathe
+        for sos_id in range(1, args.sos + 1):
+            location = json.loads(payloads[received % len(payloads)])
+            stream.update(sos_id, float(location["lat"]), float(location["long"]))
+            received += 1
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    await stream.stop()
+    await asyncio.sleep(0.1)
+
+    with factory() as db:
+        stored = db.query(models.SOSLocation).count()
+    delivered = sum(websocket.received for websocket in sockets)
+    return received / elapsed, stored, delivered / elapsed
+
+
+def per_update(args, factory):
+    payloads = messages(1000)
+    count = 0
+    start = time.perf_counter()
+    deadline = start + min(args.seconds, 2.0)
+    with factory() as db:
+        while time.perf_counter() < deadline:
+            location = json.loads(payloads[count % len(payloads)])
+            crud.create_sos_locations(
+                db,
+                [
+                    {
+                        "sos_id": count % args.sos + 1,
+                        "lat": location["lat"],
+                        "long": location["long"],
+                        "recorded_at": datetime.utcnow(),
+                    }
+                ],
+            )
+            count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default="sqlite:///bench_location.db")
+    parser.add_argument("--sos", type=int, default=200)
+    parser.add_argument("--watchers", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    factory = setup(args.database_url, args.sos)
+    rate, stored, fanout = asyncio.run(pipelined(args, factory))
+    baseline = per_update(args, factory)
+
+    print(f"{'path':<12} {'updates/s':>10}")
+    print(f"{'per update':<12} {baseline:>10.0f}")
+    print(f"{'pipelined':<12} {rate:>10.0f}")
+    print(
+        f"pipelined wrote {stored} rows for {args.sos} SOS over {args.seconds:.0f}s "
+        f"and delivered {fanout:.0f} messages/s to {args.sos * args.watchers} watchers"
+    )
+
+
+if __name__ == "__main__":
+    main()
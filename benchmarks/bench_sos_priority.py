@@ -0,0 +1,165 @@
+"""Load test for the SOS priority lane: /sos/create latency on an idle
+server, then while login, chat history and ticket reads saturate the shared
+pool and threadpool.
+
+    DATABASE_ROLE=... DATABASE_PASSWORD=... DATABASE_HOST=... DATABASE_NAME=... \
+        python -m benchmarks.bench_sos_priority [--seconds 10] [--load-clients 64]
+
+Starts the app with uvicorn against the configured Postgres (the schema is
+brought up with migrations.upgrade) and adds a few users. The SOS rows are
+closed again after each phase. The lane is working when the SOS p99 under
+load stays close to the idle one.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import bcrypt
+import httpx
+
+import migrations, models
+from database import SessionLocal
+
+PASSWORD = "bench-password"
+
+
+def seed(users):
+    # A few users with real bcrypt hashes, so logins cost what they do in production
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt()).decode()
+    run = uuid.uuid4().hex[:8]
+    with SessionLocal() as db:
+        rows = [
+            models.User(
+                email=f"sos-bench-{run}-{i}@example.com",
+                name=f"Bench {i}",
+                hashed_password=hashed,
+                phone_number="0000000000",
+            )
+            for i in range(users)
+        ]
+        db.add_all(rows)
+        db.commit()
+        return [(row.user_id, row.email) for row in rows]
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+async def wait_ready(client):
+    for _ in range(100):
+        try:
+            await client.get("/metrics")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def sos_probe(client, user_id, stop, samples, interval):
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.post(
+            "/sos/create", json={"user_id": user_id, "lat": 28.7973, "long": 77.5368}
+        )
+        samples.append(time.perf_counter() - start)
+        response.raise_for_status()
+        await asyncio.sleep(interval)
+
+
+def close_open_sos(user_id):
+    # Straight to the database: /sos/close/ would queue behind the load
+    with SessionLocal() as db:
+        db.query(models.SOS).filter(models.SOS.user_id == user_id).update({"is_open": False})
+        db.commit()
+
+
+async def background_load(client, users, stop, counts):
+    i = 0
+    while not stop.is_set():
+        user_id, email = users[i % len(users)]
+        i += 1
+        kind = ("login", "history", "tickets")[i % 3]
+        try:
+            if kind == "login":
+                response = await client.post(
+                    "/auth/login/", json={"email": email, "password": PASSWORD}
+                )
+            elif kind == "history":
+                response = await client.get("/community_chat/messages/", params={"limit": 200})
+            else:
+                response = await client.get(f"/tickets/{user_id}")
+            if response.status_code >= 500:
+                kind = "5xx"
+        except httpx.HTTPError:
+            kind = "failed"
+        counts[kind] = counts.get(kind, 0) + 1
+
+
+async def phase(base_url, users, seconds, load_clients, interval):
+    limits = httpx.Limits(max_connections=load_clients + 4)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        stop = asyncio.Event()
+        samples, counts = [], {}
+        tasks = [asyncio.create_task(sos_probe(client, users[0][0], stop, samples, interval))]
+        tasks += [
+            asyncio.create_task(background_load(client, users[1:], stop, counts))
+            for _ in range(load_clients)
+        ]
+        await asyncio.sleep(seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+        return samples, counts
+
+
+async def run(args):
+    users = seed(args.users)
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = {**os.environ, "CHATBOT_WARM": "0"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            await wait_ready(client)
+
+        print(f"{'phase':<10} {'sos':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  background req/s")
+        idle_p99 = None
+        for name, clients in (("idle", 0), ("saturated", args.load_clients)):
+            samples, counts = await phase(base_url, users, args.seconds, clients, args.interval)
+            close_open_sos(users[0][0])
+            p50, p95, p99 = percentiles(samples)
+            idle_p99 = idle_p99 or p99
+            load = ", ".join(f"{k} {v / args.seconds:.0f}" for k, v in sorted(counts.items())) or "-"
+            print(
+                f"{name:<10} {len(samples):>5} {p50 * 1e3:>8.1f} {p95 * 1e3:>8.1f} "
+                f"{p99 * 1e3:>8.1f}  {load}"
+            )
+        print(f"p99 under load / idle p99: {p99 / idle_p99:.2f}x")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--load-clients", type=int, default=64)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.02, help="pause between SOS requests")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    migrations.upgrade()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Cold start cost of the app: time to `import main` in a fresh interpreter,
+and the heavy modules that import drags in.
+
+    python -m benchmarks.bench_startup [--runs 5] [--budget 1.0]
+
+Exits non-zero when the median import time is over --budget seconds or a
+module only the chatbot needs (langchain, pinecone, numpy) is loaded, so it
+can guard the SOS path in CI. The "with chatbot" row is what every cold
+start paid when main imported chatBot eagerly.
+
+Importing main does not connect to the database, so no server is needed.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Only the chatbot and the vectorised clustering path need these
+HEAVY = ("chatBot", "langchain", "pinecone", "openai", "numpy")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def probe(imports):
+    code = PROBE.format(imports=imports, heavy=HEAVY)
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure(imports, runs):
+    results = [probe(imports) for _ in range(runs)]
+    return statistics.median(r["seconds"] for r in results), results[-1]["heavy"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.0)
+    parser.add_argument("--skip-chatbot", action="store_true", help="do not time the eager chatbot import")
+    args = parser.parse_args()
+
+    cases = [("app", "import main")]
+    if not args.skip_chatbot:
+        cases.append(("with chatbot", "import main, chatBot"))
+
+    print(f"{'import':<14} {'median s':>9}  heavy modules")
+    failed = False
+    for name, imports in cases:
+        seconds, heavy = measure(imports, args.runs)
+        print(f"{name:<14} {seconds:>9.3f}  {', '.join(heavy) or '-'}")
+        if name == "app":
+            failed = seconds > args.budget or bool(heavy)
+
+    if failed:
+        print(f"over budget: app import must take under {args.budget}s and load none of {', '.join(HEAVY)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Concurrent ticket assignment: fairness and cost per assignment.
+
+    python -m benchmarks.bench_ticket_assignment \
+        [--database-url postgresql://localhost/safeher_bench] \
+        [--teachers 10000] [--tickets 5000] [--threads 16]
+
+Tables are dropped and recreated. --threads workers each assign a teacher
+and insert a ticket in one transaction, the way /tickets/create/ does. The
+run reports the spread between the most and least loaded teachers (0 or 1
+means fair) and assignment latency, next to the old GROUP BY query. Use
+Postgres for real concurrency, SQLite serializes writers.
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from sqlalchemy import and_, create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+import crud, models
+
+
+def legacy_min_open_tickets(db):
+    # crud.get_user_with_min_open_tickets before the counters
+    return (
+        db.query(
+            models.User.user_id,
+            func.coalesce(func.count(models.Ticket.ticket_id), 0).label("ticket_count"),
+        )
+        .outerjoin(
+            models.Ticket,
+            and_(
+                models.User.user_id == models.Ticket.teacher_id,
+                models.Ticket.is_open == True,
+            ),
+        )
+        .filter(models.User.is_teacher == True)
+        .group_by(models.User.user_id)
+        .order_by(func.coalesce(func.count(models.Ticket.ticket_id), 0).asc())
+        .first()
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default="sqlite:///bench_tickets.db")
+    parser.add_argument("--teachers", type=int, default=10_000)
+    parser.add_argument("--tickets", type=int, default=5_000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url, pool_size=args.threads, max_overflow=0)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+    with session_factory() as db:
+        db.execute(
+            insert(models.User),
+            [
+                {
+                    "email": f"user{i}@example.com",
+                    "name": f"User {i}",
+                    "hashed_password": "x",
+                    "phone_number": "0000000000",
+                    "is_teacher": i > 0,
+                }
+                for i in range(args.teachers + 1)
+            ],
+        )
+        db.commit()
+
+    latencies = []
+    lock = threading.Lock()
+    remaining = iter(range(args.tickets))
+
+    def worker():
+        with session_factory() as db:
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                start = time.perf_counter()
+                teacher_id = crud.assign_teacher(db)
+                elapsed = time.perf_counter() - start
+                db.add(models.Ticket(user_id=1, teacher_id=teacher_id, is_open=True))
+                db.commit()
+                with lock:
+                    latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    with session_factory() as db:
+        loads = [
+            count
+            for (count,) in db.query(models.User.open_ticket_count).filter(
+                models.User.is_teacher == True
+            )
+        ]
+        actual = dict(
+            db.query(models.Ticket.teacher_id, func.count())
+            .group_by(models.Ticket.teacher_id)
+            .all()
+        )
+        drift = sum(
+            1
+            for user_id, count in db.query(
+                models.User.user_id, models.User.open_ticket_count
+            ).filter(models.User.is_teacher == True)
+            if actual.get(user_id, 0) != count
+        )
+
+        legacy = []
+        for _ in range(20):
+            t = time.perf_counter()
+            legacy_min_open_tickets(db)
+            legacy.append(time.perf_counter() - t)
+
+    latencies.sort()
+    print(f"{args.teachers} teachers, {args.tickets} tickets, {args.threads} threads")
+    print(f"tickets/s: {args.tickets / wall:.0f}")
+    print(f"load spread (max - min): {max(loads) - min(loads)}, counters out of sync: {drift}")
+    print(
+        f"assign p50/p99 (ms): {statistics.median(latencies) * 1e3:.2f} / "
+        f"{latencies[int(0.99 * (len(latencies) - 1))] * 1e3:.2f}"
+    )
+    print(f"legacy GROUP BY query p50 (ms): {statistics.median(legacy) * 1e3:.2f}")
+
+
+if __name__ == "__main__":
+    main()
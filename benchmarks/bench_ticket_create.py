@@ -0,0 +1,129 @@
+"""Round trips and time per ticket create, before and after the single
+transaction, plus bulk import throughput.
+
+    python -m benchmarks.bench_ticket_create [--database-url ...] [--tickets 500]
+
+Round trips are counted as statements sent plus transaction commits, which
+is what a remote Postgres (Neon) charges a network round trip for each.
+"""
+import argparse
+import time
+
+from sqlalchemy import and_, create_engine, event, func, insert
+from sqlalchemy.orm import sessionmaker
+
+import crud, models, schemas
+
+
+def legacy_create_ticket(db, ticket):
+    # /tickets/create/ before the single transaction
+    teacher_id = (
+        db.query(models.User.user_id, func.count(models.Ticket.ticket_id))
+        .outerjoin(
+            models.Ticket,
+            and_(
+                models.User.user_id == models.Ticket.teacher_id,
+                models.Ticket.is_open == True,
+            ),
+        )
+        .filter(models.User.is_teacher == True)
+        .group_by(models.User.user_id)
+        .order_by(func.count(models.Ticket.ticket_id).asc())
+        .first()
+        .user_id
+    )
+    ticket_model = models.Ticket(
+        user_id=ticket.user_id,
+        teacher_id=teacher_id,
+        is_anonymous=ticket.is_anonymous,
+        is_open=True,
+    )
+    db.add(ticket_model)
+    db.commit()
+    db.refresh(ticket_model)
+    message = models.TicketChatMessage(
+        ticket_id=ticket_model.ticket_id,
+        message_text=ticket.report_content,
+        user_id=ticket.user_id,
+    )
+    db.add(message)
+    db.commit()
+    db.refresh(message)
+    db.query(models.User).filter(models.User.user_id == message.user_id).one()
+    return ticket_model
+
+
+def current_create_ticket(db, ticket):
+    return crud.create_ticket(db, ticket, crud.assign_teacher(db))
+
+
+class RoundTrips:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self.bump)
+        event.listen(engine, "commit", self.bump)
+
+    def bump(self, *_):
+        self.count += 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--tickets", type=int, default=500)
+    parser.add_argument("--teachers", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    trips = RoundTrips(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+    ticket = schemas.TicketCreate(
+        user_id=1, is_anonymous=False, report_content="report", lat=28.79, long=77.53
+    )
+
+    print(f"{'path':<22} {'round trips/ticket':>19} {'ms/ticket':>10}")
+    for name, create in (("legacy", legacy_create_ticket), ("single transaction", current_create_ticket)):
+        models.Base.metadata.drop_all(engine)
+        models.Base.metadata.create_all(engine)
+        with session_factory() as db:
+            db.execute(
+                insert(models.User),
+                [
+                    {
+                        "email": f"user{i}@example.com",
+                        "name": f"User {i}",
+                        "hashed_password": "x",
+                        "phone_number": "0000000000",
+                        "is_teacher": i > 0,
+                    }
+                    for i in range(args.teachers + 1)
+                ],
+            )
+            db.commit()
+
+            trips.count = 0
+            start = time.perf_counter()
+            for _ in range(args.tickets):
+                create(db, ticket)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:<22} {trips.count / args.tickets:>19.1f} "
+                f"{elapsed / args.tickets * 1e3:>10.3f}"
+            )
+
+    with session_factory() as db:
+        trips.count = 0
+        start = time.perf_counter()
+        for offset in range(0, args.tickets * 10, args.batch):
+            crud.import_tickets(db, [ticket] * min(args.batch, args.tickets * 10 - offset))
+        elapsed = time.perf_counter() - start
+        total = args.tickets * 10
+        print(
+            f"{'bulk import':<22} {trips.count / total:>19.3f} "
+            f"{elapsed / total * 1e3:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
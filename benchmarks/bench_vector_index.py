@@ -0,0 +1,84 @@
+"""FAQ retrieval latency: local memory-mapped index vs Pinecone.
+
+    python -m benchmarks.bench_vector_index [--chunks 5000] [--queries 500] \
+        [--index faq_index] [--remote]
+
+Without --index a random index of --chunks 1536-d vectors is generated.
+--remote also times the same queries against the Pinecone index (needs
+PINECONE_API_KEY / PINECONE_ENVIRONMENT and network access).
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from langchain.schema import Document
+
+import vector_index
+from vector_index import LocalIndex
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e3
+    return f"p50 {pick(0.5):8.3f} ms   p99 {pick(0.99):8.3f} ms"
+
+
+def time_each(fn, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--index")
+    parser.add_argument("--remote", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    path = args.index
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "faq_index")
+        vectors = rng.standard_normal((args.chunks, args.dim), dtype=np.float32)
+        documents = [Document(page_content=f"chunk {i}") for i in range(args.chunks)]
+        vector_index.save(path, vectors, documents)
+
+    index = LocalIndex(path)
+    queries = rng.standard_normal((args.queries, index.vectors.shape[1]), dtype=np.float32)
+
+    print(f"{index.vectors.shape[0]} chunks, {index.vectors.shape[1]} dims")
+    local = time_each(lambda q: index.similarity_search_by_vector_with_score(q), queries)
+    print(f"local single   {percentiles(local)}")
+
+    batches = [queries[i : i + args.batch] for i in range(0, len(queries), args.batch)]
+    batched = time_each(lambda b: index.search(b), batches)
+    per_query = [t / args.batch for t in batched]
+    print(f"local batched  {percentiles(per_query)}  (per query, batch {args.batch})")
+
+    if args.remote:
+        import pinecone
+
+        import chatBot
+
+        chatBot.init_pinecone(chatBot.pinecone_key, chatBot.pinecoen_env)
+        remote_index = pinecone.Index(chatBot.index_name)
+        remote = time_each(
+            lambda q: remote_index.query(
+                vector=q.tolist(), top_k=4, include_metadata=True
+            ),
+            queries[: min(100, len(queries))],
+        )
+        print(f"pinecone       {percentiles(remote)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Shared pieces of the benchmark suite: percentiles, the results table and
+the results store.
+
+Every run of benchmarks.load or benchmarks.micro appends one JSON line to
+benchmarks/results/<suite>.jsonl (git revision, time, host and one row per
+scenario) and prints each scenario next to the previous stored run, so a
+change can be checked by running the suite before and after it on the same
+machine. --results somewhere/else keeps separate histories, e.g. per host.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentiles(samples):
+    # p50, p95, p99 of a list of seconds
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+def summarize(scenario, samples, elapsed, errors=0, **extra):
+    p50, p95, p99 = percentiles(samples)
+    return {
+        "scenario": scenario,
+        "count": len(samples),
+        "errors": errors,
+        "per_second": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": p50 * 1e3,
+        "p95_ms": p95 * 1e3,
+        "p99_ms": p99 * 1e3,
+        **extra,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def results_path(suite, directory=None):
+    return os.path.join(directory or RESULTS_DIR, f"{suite}.jsonl")
+
+
+def previous_run(suite, directory=None):
+    path = results_path(suite, directory)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        lines = [line for line in file if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def store(suite, rows, params, directory=None):
+    path = results_path(suite, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    run = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "params": params,
+        "rows": rows,
+    }
+    with open(path, "a") as file:
+        file.write(json.dumps(run) + "\n")
+    return path
+
+
+def report(rows, previous=None):
+    # One line per scenario; with a previous run, p50/p99 change in percent
+    before = {row["scenario"]: row for row in (previous or {}).get("rows", [])}
+    header = f"{'scenario':<28} {'count':>7} {'err':>5} {'per s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    if previous:
+        header += f"  vs {previous['revision']}"
+    print(header)
+    for row in rows:
+        line = (
+            f"{row['scenario']:<28} {row['count']:>7} {row['errors']:>5} {row['per_second']:>9.1f} "
+            f"{row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f}"
+        )
+        old = before.get(row["scenario"])
+        if old and old["p50_ms"] and old["p99_ms"]:
+            line += (
+                f"  p50 {100 * (row['p50_ms'] / old['p50_ms'] - 1):+.0f}%"
+                f" p99 {100 * (row['p99_ms'] / old['p99_ms'] - 1):+.0f}%"
+            )
+        print(line)
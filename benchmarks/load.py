@@ -0,0 +1,309 @@
+"""Load test of the REST endpoints and chat WebSockets with concurrent
+synthetic clients.
+
+    DATABASE_ROLE=... DATABASE_PASSWORD=... DATABASE_HOST=... DATABASE_NAME=... \
+        python -m benchmarks.load [--seconds 10] [--clients 32] [--ws-clients 50] \
+        [--scale 0.2] [--only areas,sos] [--url http://host:port] [--seed]
+
+Runs against the configured database, which has to be seeded with
+benchmarks.seed first. --seed seeds it here, at --scale, and drops every
+table to do so: only pass it with the DATABASE_* variables pointing at a
+scratch database. Starts the app with uvicorn and runs every scenario in
+turn for --seconds with --clients concurrent clients, then prints and stores
+throughput and p50/p95/p99 per scenario (see benchmarks.harness). With --url
+an already running server is used instead, and it must have been started
+on a database seeded the same way.
+
+WebSocket scenarios need the `websockets` package, which uvicorn also needs
+to serve them; they are skipped when it is missing. Their latency is from a
+message being sent to it arriving back through the room: at the sender in
+the community chat (which every other client also gets), at the other side
+in a ticket chat.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import text
+
+from benchmarks import harness, seed as seeding
+
+SUITE = "load"
+
+
+async def wait_ready(client):
+    for _ in range(150):
+        try:
+            await client.get("/metrics")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def fixtures(engine):
+    # Ids the scenarios pick from, read back from the seeded tables
+    with engine.connect() as connection:
+        open_tickets = connection.execute(
+            text("SELECT ticket_id, user_id, teacher_id FROM tickets WHERE is_open ORDER BY ticket_id")
+        ).all()
+        students = connection.execute(
+            text(
+                """SELECT user_id FROM users WHERE NOT is_teacher AND user_id NOT IN (
+                    SELECT user_id FROM sos WHERE is_open
+                ) ORDER BY user_id"""
+            )
+        ).scalars().all()
+        last_message = connection.execute(
+            text("SELECT max(message_id) FROM community_chat_messages")
+        ).scalar()
+    return {
+        "open_tickets": [tuple(row) for row in open_tickets],
+        "students": list(students),
+        "last_message": last_message or 1,
+    }
+
+
+def rest_scenarios(data):
+    # name -> request(client, worker, rng); each returns the response
+    tickets = data["open_tickets"]
+    students = data["students"]
+
+    async def areas(client, worker, rng):
+        return await client.get("/areas/")
+
+    centers = seeding.campuses(random.Random(0))
+
+    async def areas_viewport(client, worker, rng):
+        lat, lon = rng.choice(centers)
+        box = {"min_lat": lat - 0.05, "min_long": lon - 0.05, "max_lat": lat + 0.05, "max_long": lon + 0.05}
+        return await client.get("/areas/", params={**box, "zoom": 14})
+
+    async def community_history(client, worker, rng):
+        before = rng.randint(2, data["last_message"] + 1)
+        return await client.get("/community_chat/messages/", params={"before": before, "limit": 100})
+
+    async def ticket_history(client, worker, rng):
+        ticket_id = rng.choice(tickets)[0]
+        return await client.get(f"/tickets/messages/{ticket_id}", params={"limit": 50})
+
+    async def open_tickets(client, worker, rng):
+        return await client.get(f"/tickets/{rng.choice(tickets)[1]}")
+
+    async def login(client, worker, rng):
+        return await client.post(
+            "/auth/login/",
+            json={"email": f"user{rng.choice(students)}@example.com", "password": seeding.PASSWORD},
+        )
+
+    async def sos(client, worker, rng):
+        # Open and close again, one student per client so they never overlap
+        user_id = students[worker % len(students)]
+        response = await client.post(
+            "/sos/create",
+            json={"user_id": user_id, "lat": 28.7973 + rng.gauss(0, 0.01), "long": 77.5368},
+        )
+        if response.status_code >= 400:
+            return response
+        return await client.patch(f"/sos/close/{user_id}")
+
+    async def create_ticket(client, worker, rng):
+        return await client.post(
+            "/tickets/create/",
+            json={
+                "user_id": rng.choice(students),
+                "is_anonymous": False,
+                "report_content": "Load test report",
+                "lat": 28.7973,
+                "long": 77.5368,
+            },
+        )
+
+    return {
+        "GET /areas/": areas,
+        "GET /areas/ campus zoom 14": areas_viewport,
+        "GET /community_chat/messages/": community_history,
+        "GET /tickets/messages/{id}": ticket_history,
+        "GET /tickets/{user_id}": open_tickets,
+        "POST /auth/login/": login,
+        "POST /sos/create + close": sos,
+        "POST /tickets/create/": create_ticket,
+    }
+
+
+async def run_rest(base_url, name, request, clients, seconds):
+    samples, errors = [], 0
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + seconds
+
+        async def worker(i):
+            nonlocal errors
+            rng = random.Random(i)
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await request(client, i, rng)
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                if failed:
+                    errors += 1
+                else:
+                    samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(clients)))
+        return harness.summarize(name, samples, time.perf_counter() - started, errors)
+
+
+async def run_community_ws(ws_url, data, clients, seconds):
+    # Every client sends, then waits for its own message to come back
+    # through the room before sending the next
+    import websockets
+
+    students = data["students"]
+    sockets = [
+        await websockets.connect(f"{ws_url}/ws/community_chat/{students[i % len(students)]}")
+        for i in range(clients)
+    ]
+    samples, errors = [], 0
+    deadline = time.perf_counter() + seconds
+
+    async def conversation(i, websocket):
+        nonlocal errors
+        n = 0
+        while time.perf_counter() < deadline:
+            key = f"load {i} {n}"
+            n += 1
+            started = time.perf_counter()
+            try:
+                await websocket.send(key)
+                while json.loads(await asyncio.wait_for(websocket.recv(), 10))["message_text"] != key:
+                    pass
+            except (asyncio.TimeoutError, websockets.ConnectionClosed):
+                errors += 1
+                return
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(conversation(i, websocket) for i, websocket in enumerate(sockets)))
+    elapsed = time.perf_counter() - started
+    for websocket in sockets:
+        await websocket.close()
+    return harness.summarize("WS community chat", samples, elapsed, errors, fanout=clients)
+
+
+async def run_ticket_ws(ws_url, data, clients, seconds):
+    # Student and teacher of one open ticket each; the student sends and
+    # the time until the teacher has it is recorded
+    import websockets
+
+    pairs = []
+    for ticket_id, user_id, teacher_id in data["open_tickets"][:clients]:
+        student = await websockets.connect(f"{ws_url}/ws/{ticket_id}/{user_id}")
+        teacher = await websockets.connect(f"{ws_url}/ws/{ticket_id}/{teacher_id}")
+        pairs.append((student, teacher))
+    samples, errors = [], 0
+    deadline = time.perf_counter() + seconds
+
+    async def conversation(student, teacher):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await student.send("load test")
+                await asyncio.wait_for(teacher.recv(), 10)
+                await asyncio.wait_for(student.recv(), 10)
+            except (asyncio.TimeoutError, websockets.ConnectionClosed):
+                errors += 1
+                return
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(conversation(*pair) for pair in pairs))
+    elapsed = time.perf_counter() - started
+    for student, teacher in pairs:
+        await student.close()
+        await teacher.close()
+    return harness.summarize("WS ticket chat", samples, elapsed, errors, pairs=len(pairs))
+
+
+async def run(args, data):
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+    ws_url = base_url.replace("http", "ws", 1)
+    server = None
+    if not args.url:
+        env = {**os.environ, "CHATBOT_WARM": "0"}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            env=env,
+        )
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            await wait_ready(client)
+
+        rows = []
+        for name, request in rest_scenarios(data).items():
+            if args.only and not any(word in name for word in args.only):
+                continue
+            rows.append(await run_rest(base_url, name, request, args.clients, args.seconds))
+            print(f"  {name} done", file=sys.stderr)
+
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            print("websockets is not installed, skipping the WebSocket scenarios", file=sys.stderr)
+        else:
+            if not args.only or any(word in "WS community chat" for word in args.only):
+                rows.append(await run_community_ws(ws_url, data, args.ws_clients, args.seconds))
+            if not args.only or any(word in "WS ticket chat" for word in args.only):
+                rows.append(await run_ticket_ws(ws_url, data, args.ws_clients, args.seconds))
+        return rows
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--ws-clients", type=int, default=50)
+    parser.add_argument("--scale", type=float, default=0.2)
+    parser.add_argument("--only", type=lambda value: value.split(","), help="comma separated parts of scenario names")
+    parser.add_argument("--url", help="benchmark a running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument(
+        "--seed", action="store_true", help="drop, recreate and seed the configured database first"
+    )
+    parser.add_argument("--results", help="directory for the stored results")
+    args = parser.parse_args()
+
+    from database import engine
+
+    if args.seed:
+        seeding.seed(engine, args.scale)
+    data = fixtures(engine)
+
+    previous = harness.previous_run(SUITE, args.results)
+    rows = asyncio.run(run(args, data))
+    harness.report(rows, previous)
+    params = {
+        "seconds": args.seconds,
+        "clients": args.clients,
+        "ws_clients": args.ws_clients,
+        "scale": args.scale,
+    }
+    print(f"stored in {harness.store(SUITE, rows, params, args.results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Microbenchmarks for the in-process hot paths and the crud layer.
+
+    python -m benchmarks.micro [--database-url sqlite:///bench_micro.db] \
+        [--scale 0.1] [--only cluster,crud] [--repeat 7] [--results DIR]
+
+Each benchmark is timed in --repeat batches of however many calls fill
+about --batch-seconds; p50/p95/p99 are of the per-call time of each batch,
+so a noisy batch shows up in p99 without moving p50. Results are stored
+and compared with the previous run like benchmarks.load (see
+benchmarks.harness).
+
+The crud benchmarks run on a database seeded with benchmarks.seed, a
+SQLite file by default; pass a scratch Postgres URL to time the real
+queries. Writes (assign_teacher, chat inserts) are rolled back or kept
+small so repeated runs see the same data.
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud, schemas
+from areas import HotAreas
+from benchmarks import harness, seed as seeding
+from clustering import ClusterIndex
+from geostream import SOSFeed
+from ticket_history import TicketHistory, TicketMessage
+from utils import group_points
+
+SUITE = "micro"
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    # Registers setup(context) -> a no-argument callable to time
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def campus_points(rng, count):
+    centers = seeding.campuses(rng)
+    points = []
+    for _ in range(count):
+        lat, lon = rng.choice(centers)
+        points.append({"latitude": lat + rng.gauss(0, 0.02), "longitude": lon + rng.gauss(0, 0.02)})
+    return points
+
+
+@benchmark("cluster group_points 10k")
+def _group_points(context):
+    points = campus_points(random.Random(1), 10_000)
+    return lambda: group_points(points)
+
+
+@benchmark("cluster index add")
+def _cluster_add(context):
+    rng = random.Random(2)
+    index = ClusterIndex()
+    index.extend(campus_points(rng, 50_000))
+    extra = campus_points(rng, 1000)
+    state = {"i": 0}
+
+    def add():
+        point = extra[state["i"] % len(extra)]
+        state["i"] += 1
+        index.add(point["latitude"], point["longitude"])
+
+    return add
+
+
+@benchmark("cluster hot areas snapshot")
+def _hot_areas(context):
+    areas = HotAreas()
+    areas.rebuild(campus_points(random.Random(3), 50_000))
+    return areas.snapshot
+
+
+@benchmark("geostream route 10k watchers")
+def _geostream(context):
+    rng = random.Random(4)
+    feed = SOSFeed()
+    members = {}
+    for i in range(10_000):
+        feed.watch(i, 28.79 + rng.uniform(-0.2, 0.2), 77.53 + rng.uniform(-0.2, 0.2), rng.uniform(0.5, 5))
+        members[i] = i
+    text = '{"event":"sos_opened","sos_id":1,"user_id":1,"lat":28.79,"long":77.53}'
+    return lambda: feed.route(text, members)
+
+
+@benchmark("ticket history page")
+def _ticket_history(context):
+    history = TicketHistory(size=100)
+    messages = [TicketMessage(i, 1, 1, "hello", None, "User") for i in range(1, 101)]
+    history.fill(1, lambda: messages)
+    return lambda: history.page(1, before=80, limit=50)
+
+
+def crud_call(fn, *args, **kwargs):
+    def setup(context):
+        factory = context["factory"]
+
+        def run():
+            with factory() as db:
+                fn(db, *args, **kwargs)
+                db.rollback()
+
+        return run
+
+    return setup
+
+
+def crud_benchmarks(counts, dialect):
+    rng = random.Random(5)
+    users = counts["users"]
+    benchmark("crud get_user_by_email")(
+        crud_call(crud.get_user_by_email, f"user{rng.randint(1, users)}@example.com")
+    )
+    benchmark("crud community history page")(
+        crud_call(crud.get_community_chat_messages, before=counts["community_messages"] // 2)
+    )
+    benchmark("crud ticket messages")(crud_call(crud.get_ticket_messages, 1, limit=50))
+    benchmark("crud open user tickets")(crud_call(crud.get_open_user_tickets, users))
+    benchmark("crud get_sos")(crud_call(crud.get_sos))
+    benchmark("crud get_all_coords")(crud_call(crud.get_all_coords))
+    benchmark("crud assign_teacher")(crud_call(crud.assign_teacher))
+    benchmark("crud community message insert")(
+        crud_call(
+            crud.create_community_chat_message,
+            schemas.CommunityChatMessageCreate(message_text="micro", user_id=1),
+        )
+    )
+    if dialect == "postgresql":
+        # Risk tables are only kept on Postgres (see benchmarks.seed)
+        lat, lon = seeding.campuses(random.Random(0))[0]
+        box = (lat - 0.5, lon - 0.5, lat + 0.5, lon + 0.5)
+        benchmark("crud risk cells")(crud_call(crud.get_risk_cells, *box))
+        benchmark("crud risk cells 7d night")(
+            crud_call(crud.get_risk_cells, *box, window="7d", hours_of_day=[22, 23, 0, 1, 2, 3, 4, 5])
+        )
+        benchmark("crud risk cells country p4")(
+            crud_call(crud.get_risk_cells, 8, 70, 32, 88, precision=4)
+        )
+
+
+def measure(fn, repeat, batch_seconds):
+    # Calibrate a batch size, then time `repeat` batches of it. The first
+    # call (connecting, filling caches) is left out.
+    fn()
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= batch_seconds / 4 or number >= 1_000_000:
+            break
+        number *= 4 if elapsed < batch_seconds / 40 else 2
+    number = max(1, int(number * batch_seconds / max(elapsed, 1e-9)))
+
+    samples = []
+    total = 0.0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        total += elapsed
+        samples.append(elapsed / number)
+    return samples, number * repeat, total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default="sqlite:///bench_micro.db")
+    parser.add_argument("--scale", type=float, default=0.1)
+    parser.add_argument("--only", type=lambda value: value.split(","), help="comma separated parts of benchmark names")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--batch-seconds", type=float, default=0.2)
+    parser.add_argument("--results", help="directory for the stored results")
+    args = parser.parse_args()
+
+    selected = lambda name: not args.only or any(word in name for word in args.only)
+    context = {}
+    if selected("crud"):
+        engine = create_engine(args.database_url)
+        counts = seeding.seed(engine, args.scale)
+        context["factory"] = sessionmaker(bind=engine, autoflush=False)
+        crud_benchmarks(counts, engine.dialect.name)
+
+    previous = harness.previous_run(SUITE, args.results)
+    rows = []
+    for name, setup in BENCHMARKS.items():
+        if not selected(name):
+            continue
+        samples, calls, total = measure(setup(context), args.repeat, args.batch_seconds)
+        row = harness.summarize(name, samples, total)
+        row["count"] = calls
+        row["per_second"] = calls / total
+        rows.append(row)
+
+    harness.report(rows, previous)
+    params = {"database": args.database_url.split("://")[0], "scale": args.scale, "repeat": args.repeat}
+    print(f"stored in {harness.store(SUITE, rows, params, args.results)}")
+
+
+if __name__ == "__main__":
+    main()
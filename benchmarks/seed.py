@@ -0,0 +1,197 @@
+"""Seed a scratch database with realistic volumes for the benchmark suite.
+
+    python -m benchmarks.seed --database-url postgresql://localhost/safeher_bench \
+        [--scale 1.0]
+
+Every table of --database-url is dropped and recreated first, so it has to
+be given explicitly and never defaults to the app's own database. Point
+the DATABASE_* variables of benchmarks.load at the same database. Data is generated from a fixed random seed, so the
+same --scale gives the same rows, and the ids are 1..n on a fresh database.
+
+At --scale 1: 5000 users of which 50 teachers, 20000 SOS (1% still open)
+around 20 campuses, 5000 tickets (10% open) with one report each, 100k
+community chat messages and 50k ticket chat messages. SOS and reports are
+spread over the last HISTORY and, on Postgres, the risk heatmap tables are
+rebuilt from them. Every user's password is PASSWORD.
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+import bcrypt
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import Session
+
+import crud, models
+
+PASSWORD = "bench-password"
+
+VOLUMES = {
+    "users": 5000,
+    "teachers": 50,
+    "sos": 20000,
+    "tickets": 5000,
+    "community_messages": 100_000,
+    "ticket_messages": 50_000,
+}
+
+HISTORY = timedelta(days=90)
+
+# Rows per INSERT statement
+CHUNK = 5000
+
+
+def volumes(scale=1.0):
+    counts = {name: max(1, int(count * scale)) for name, count in VOLUMES.items()}
+    counts["teachers"] = min(max(2, counts["teachers"]), counts["users"] - 1)
+    return counts
+
+
+def campuses(rng, count=20):
+    return [(rng.uniform(8, 32), rng.uniform(70, 88)) for _ in range(count)]
+
+
+def _insert(connection, table, rows):
+    for start in range(0, len(rows), CHUNK):
+        connection.execute(insert(table), rows[start : start + CHUNK])
+
+
+def seed(engine, scale=1.0, seed=0, rounds=4):
+    # Returns the volumes written. Low bcrypt rounds keep seeding quick; the
+    # app verifies whatever cost the hash was made with.
+    rng = random.Random(seed)
+    counts = volumes(scale)
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=rounds)).decode()
+    centers = campuses(rng)
+    start = datetime(2024, 1, 1)
+    now = datetime.now()
+
+    def recently():
+        return now - rng.random() * HISTORY
+
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+
+    teachers = counts["teachers"]
+    users = counts["users"]
+    with engine.begin() as connection:
+        _insert(
+            connection,
+            models.User,
+            [
+                {
+                    "email": f"user{i}@example.com",
+                    "name": f"User {i}",
+                    "hashed_password": hashed,
+                    "is_teacher": i <= teachers,
+                    "phone_number": f"{9000000000 + i}",
+                }
+                for i in range(1, users + 1)
+            ],
+        )
+
+        def student():
+            return rng.randint(teachers + 1, users)
+
+        def near_campus():
+            lat, lon = rng.choice(centers)
+            return lat + rng.gauss(0, 0.02), lon + rng.gauss(0, 0.02)
+
+        sos_rows = []
+        open_sos_users = set()
+        for _ in range(counts["sos"]):
+            lat, lon = near_campus()
+            user_id = student()
+            # At most one open SOS per user, like /sos/create and /sos/close
+            is_open = rng.random() < 0.01 and user_id not in open_sos_users
+            if is_open:
+                open_sos_users.add(user_id)
+            sos_rows.append(
+                {"user_id": user_id, "lat": lat, "long": lon, "is_open": is_open, "created_at": recently()}
+            )
+        _insert(connection, models.SOS, sos_rows)
+
+        ticket_rows, report_rows = [], []
+        for ticket_id in range(1, counts["tickets"] + 1):
+            lat, lon = near_campus()
+            ticket_rows.append(
+                {
+                    "user_id": student(),
+                    "teacher_id": rng.randint(1, teachers),
+                    "is_open": rng.random() < 0.1,
+                    "is_anonymous": rng.random() < 0.3,
+                }
+            )
+            report_rows.append(
+                {
+                    "ticket_id": ticket_id,
+                    "report_content": "Seeded report",
+                    "lat": lat,
+                    "long": lon,
+                    "created_at": recently(),
+                }
+            )
+        _insert(connection, models.Ticket, ticket_rows)
+        _insert(connection, models.TicketReport, report_rows)
+
+        step = timedelta(seconds=30)
+        _insert(
+            connection,
+            models.CommunityChatMessage,
+            [
+                {
+                    "user_id": rng.randint(1, users),
+                    "message_text": f"Community message {i}",
+                    "created_at": start + i * step,
+                }
+                for i in range(counts["community_messages"])
+            ],
+        )
+
+        message_rows = []
+        for i in range(counts["ticket_messages"]):
+            ticket_id = rng.randint(1, counts["tickets"])
+            ticket = ticket_rows[ticket_id - 1]
+            message_rows.append(
+                {
+                    "ticket_id": ticket_id,
+                    "user_id": ticket["user_id"] if i % 2 else ticket["teacher_id"],
+                    "message_text": f"Ticket message {i}",
+                    "created_at": start + i * step,
+                }
+            )
+        _insert(connection, models.TicketChatMessage, message_rows)
+
+        # Teacher load counters (crud.assign_teacher) match the open tickets
+        connection.execute(
+            text(
+                """UPDATE users SET open_ticket_count = (
+                    SELECT count(*) FROM tickets
+                    WHERE tickets.teacher_id = users.user_id AND tickets.is_open
+                )"""
+            )
+        )
+
+    if engine.dialect.name == "postgresql":
+        with Session(engine) as db:
+            crud.rebuild_risk_cells(db)
+            db.commit()
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    counts = seed(engine, args.scale, args.seed)
+    print(", ".join(f"{name} {count}" for name, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import time
+
+from fastapi import WebSocket
+
+import backplane
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+COMMUNITY_ROOM = "community"
+# SOS open/close events, routed by geostream.SOSFeed
+SOS_ROOM = "sos"
+# Points added to /areas/ on any worker, see areas.HotAreas.publish
+AREAS_ROOM = "areas"
+
+
+send_seconds = Histogram(
+    "safeher_ws_send_seconds",
+    "Time to hand one message to a client socket",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 2.5, 10.0),
+)
+messages_dropped = Counter(
+    "safeher_ws_messages_dropped_total",
+    "Messages dropped from a full client queue (drop_oldest policy)",
+)
+clients_disconnected = Counter(
+    "safeher_ws_slow_clients_disconnected_total",
+    "Clients disconnected for a full queue or a failed send",
+)
+publish_failures = Counter(
+    "safeher_backplane_publish_failures_total",
+    "Messages the backplane refused, delivered on this worker only",
+)
+
+
+def ticket_room(ticket_id: int):
+    return f"ticket:{ticket_id}"
+
+
+def location_room(sos_id: int):
+    return f"location:{sos_id}"
+
+
+class Connection:
+    def __init__(self, hub: "Hub", room: str, websocket: WebSocket):
+        self.hub = hub
+        self.room = room
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=hub.queue_size)
+        self.closing = False
+        self.task = asyncio.create_task(self._writer())
+
+    def drop(self):
+        if self.closing:
+            return
+        self.closing = True
+        self.hub.disconnected += 1
+        clients_disconnected.inc()
+        self.hub.spawn(self.hub.leave(self.room, self.websocket, close=True))
+
+    def offer(self, text: str):
+        if self.closing:
+            return
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            if self.hub.policy == "drop_oldest":
+                self.queue.get_nowait()
+                self.queue.put_nowait(text)
+                self.hub.dropped += 1
+                messages_dropped.inc()
+            else:
+                # The client can reconnect and catch up from the history endpoints
+                self.drop()
+
+    async def _writer(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                started = time.perf_counter()
+                await asyncio.wait_for(
+                    self.websocket.send_text(text), self.hub.send_timeout
+                )
+                send_seconds.observe(time.perf_counter() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Failed or timed out send, only this client is dropped
+            self.drop()
+
+
+class Hub:
+    """Room based fan-out for the chat and SOS WebSockets.
+
+    ``publish`` serializes a message once and only enqueues it; every
+    connection has its own bounded queue drained by its own writer task, so a
+    slow or dead socket never holds up the rest of the room. When a queue is
+    full the connection is either disconnected (default) or its oldest
+    pending message is dropped, depending on ``policy``.
+
+    Once started with a backplane, published messages and room closes go
+    through it and come back to every worker's hub, so a room's members can
+    be spread over any number of processes. A message the backplane refuses
+    is still delivered to this process's sockets. Without one, publishing
+    delivers straight to this process's sockets.
+
+    A room can have a router, which is handed every message and the room's
+    members and returns the connections that should get it. Listeners see
+    every delivered message of every room, and close listeners every room
+    closed with ``close_room``, on every worker.
+    """
+
+    def __init__(self, queue_size=64, send_timeout=10.0, policy="disconnect"):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.policy = policy
+        self.rooms: dict[str, dict[WebSocket, Connection]] = {}
+        self.routers = {}
+        self.listeners = []
+        self.close_listeners = []
+        self.dropped = 0
+        self.disconnected = 0
+        self._tasks: set[asyncio.Task] = set()
+        self.backplane = None
+        self._outbox: asyncio.Queue[str] | None = None
+        self._sender: asyncio.Task | None = None
+
+    async def start(self, bus):
+        self.backplane = bus
+        self._outbox = asyncio.Queue()
+        await bus.start(self.receive)
+        self._sender = asyncio.create_task(self._send())
+
+    async def stop(self):
+        if self._sender is not None:
+            self._sender.cancel()
+        if self.backplane is not None:
+            await self.backplane.stop()
+        self.backplane = None
+
+    async def _send(self):
+        # One sender keeps messages in publish order on the backplane
+        while True:
+            payload = await self._outbox.get()
+            try:
+                await self.backplane.publish(payload)
+            except Exception as exc:
+                # Backplane down or message too large for it: the other
+                # workers miss it, but this worker's clients still get it.
+                # Delivery errors are handled in deliver, so this is only
+                # reached for the backplane's own.
+                publish_failures.inc()
+                logger.warning("backplane publish failed, delivering locally: %s", exc)
+                self.receive(payload)
+
+    def receive(self, payload):
+        try:
+            room, text, close = backplane.decode(payload)
+        except Exception:
+            logger.exception("dropped an undecodable backplane message")
+            return
+        if close:
+            self.spawn(self._close_local(room))
+        else:
+            self.deliver(room, text)
+
+    def deliver(self, room: str, text: str):
+        # Never raises: a failing listener or router is logged and skipped,
+        # the other listeners and the backplane sender carry on
+        for listener in self.listeners:
+            try:
+                listener(room, text)
+            except Exception:
+                logger.exception("hub listener %r failed on room %s", listener, room)
+        members = self.rooms.get(room, {})
+        router = self.routers.get(room)
+        if router is None:
+            connections = list(members.values())
+        else:
+            # Routers also see messages for an empty room, they may keep state
+            try:
+                connections = router(text, members)
+            except Exception:
+                logger.exception("hub router failed on room %s", room)
+                connections = []
+        for connection in connections:
+            connection.offer(text)
+
+    def route(self, room: str, router):
+        self.routers[room] = router
+
+    def listen(self, listener):
+        self.listeners.append(listener)
+
+    def listen_close(self, listener):
+        self.close_listeners.append(listener)
+
+    def spawn(self, coro):
+        # Keeps a reference so fire-and-forget tasks are not garbage collected
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def join(self, room: str, websocket: WebSocket):
+        connection = Connection(self, room, websocket)
+        self.rooms.setdefault(room, {})[websocket] = connection
+        return connection
+
+    async def leave(self, room: str, websocket: WebSocket, close=False):
+        members = self.rooms.get(room)
+        connection = members.pop(websocket, None) if members is not None else None
+        if members is not None and not members:
+            self.rooms.pop(room, None)
+        if connection is None:
+            return
+
+        connection.closing = True
+        if connection.task is not asyncio.current_task():
+            connection.task.cancel()
+        if close:
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
+    async def _close_local(self, room: str):
+        for listener in self.close_listeners:
+            try:
+                listener(room)
+            except Exception:
+                logger.exception("hub close listener %r failed on room %s", listener, room)
+        for websocket in list(self.rooms.get(room, {})):
+            await self.leave(room, websocket, close=True)
+
+    async def close_room(self, room: str):
+        if self.backplane is None:
+            await self._close_local(room)
+        else:
+            self._outbox.put_nowait(backplane.encode(room, None, close=True))
+
+    def publish(self, room: str, message: dict):
+        # Same encoding as WebSocket.send_json, done once for every recipient
+        text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        if self.backplane is None:
+            self.deliver(room, text)
+        else:
+            self._outbox.put_nowait(backplane.encode(room, text))
+
+    def size(self, room: str):
+        return len(self.rooms.get(room, ()))
+
+    def sizes(self):
+        # (rooms, members) per kind of room: community, sos, ticket, location
+        totals = {}
+        for room, members in list(self.rooms.items()):
+            kind = room.split(":", 1)[0]
+            rooms, count = totals.get(kind, (0, 0))
+            totals[kind] = (rooms + 1, count + len(members))
+        return totals
+
+
+hub = Hub()
+
+Gauge(
+    "safeher_ws_rooms",
+    "Rooms with at least one client on this worker, by kind",
+    labels=("kind",),
+    function=lambda: {kind: rooms for kind, (rooms, _) in hub.sizes().items()},
+)
+Gauge(
+    "safeher_ws_clients",
+    "WebSocket clients on this worker, by kind of room",
+    labels=("kind",),
+    function=lambda: {kind: count for kind, (_, count) in hub.sizes().items()},
+)
+Gauge(
+    "safeher_ws_queued_messages",
+    "Messages waiting in client queues on this worker",
+    function=lambda: sum(
+        connection.queue.qsize()
+        for members in list(hub.rooms.values())
+        for connection in list(members.values())
+    ),
+)
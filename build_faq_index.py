@@ -0,0 +1,40 @@
+"""Build the local FAQ vector index used by CHATBOT_VECTOR_BACKEND=local.
+
+    python build_faq_index.py path/to/faq_corpus [--out faq_index]
+
+Splits every document in the corpus directory the same way it was split
+for the Pinecone index, embeds the chunks with OpenAI and writes
+<out>.npy / <out>.json.
+"""
+import argparse
+import os
+
+from langchain.document_loaders import DirectoryLoader
+from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+import vector_index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus")
+    parser.add_argument("--out", default="faq_index")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=20)
+    args = parser.parse_args()
+
+    documents = DirectoryLoader(args.corpus).load()
+    chunks = RecursiveCharacterTextSplitter(
+        chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
+    ).split_documents(documents)
+
+    embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+    vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+
+    vector_index.save(args.out, vectors, chunks)
+    print(f"wrote {len(chunks)} chunks to {args.out}.npy / {args.out}.json")
+
+
+if __name__ == "__main__":
+    main()
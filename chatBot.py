@@ -2,13 +2,64 @@ from langchain.vectorstores import Pinecone
 from langchain.chat_models import ChatOpenAI
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.chains.question_answering import load_qa_chain
+from langchain.callbacks import AsyncIteratorCallbackHandler
+from fastapi.concurrency import run_in_threadpool
 import pinecone
+import asyncio
 import os
+import threading
+import time
+
+from answer_cache import AnswerCache, normalize
+from metrics import Counter, Gauge, Histogram
+from vector_index import LocalIndex
 
 openai_key = os.getenv("OPENAI_API_KEY")
 pinecone_key = os.getenv("PINECONE_API_KEY")
 pinecoen_env = os.getenv("PINECONE_ENVIRONMENT")
 
+# index_name -> index vector name in Pinecone
+index_name = "woman-safety-embeddings"
+
+# "pinecone", or "local" for the in-process index built by build_faq_index.py
+vector_backend = os.getenv("CHATBOT_VECTOR_BACKEND", "pinecone")
+local_index_path = os.getenv("CHATBOT_INDEX_PATH", "faq_index")
+
+# Retrieval searches with the embedding of the prompt-wrapped query, as it
+# always has. CHATBOT_RETRIEVE_QUESTION=1 searches with the bare question's
+# embedding instead, which the semantic cache computes anyway: one embedding
+# call per miss instead of two, but the documents found can differ.
+retrieve_question = os.getenv("CHATBOT_RETRIEVE_QUESTION", "0") == "1"
+
+answer_cache = AnswerCache(
+    maxsize=int(os.getenv("CHATBOT_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("CHATBOT_CACHE_TTL", "3600")),
+    similarity=float(os.getenv("CHATBOT_CACHE_SIMILARITY", "0.97")),
+)
+
+cache_lookups = Counter(
+    "safeher_chatbot_cache_total",
+    "Chatbot answer cache lookups by result",
+    labels=("result",),
+)
+cache_hit_rate = Gauge(
+    "safeher_chatbot_cache_hit_ratio",
+    "Share of chatbot questions answered from the cache",
+    function=lambda: _hit_rate(),
+)
+
+time_to_first_token = Histogram(
+    "safeher_chatbot_time_to_first_token_seconds",
+    "Time from a streaming chatbot request to its first token",
+    labels=("source",),
+)
+
+
+def _hit_rate():
+    hits = sum(v for k, v in cache_lookups.values.items() if k != ("miss",))
+    total = hits + cache_lookups.values.get(("miss",), 0)
+    return hits / total if total else 0.0
+
 
 def init_pinecone(pinecone_key, pinecoen_env):
     # init pinecone
@@ -18,22 +69,177 @@ def init_pinecone(pinecone_key, pinecoen_env):
     )
 
 
-def get_answer(question):
-    query = f"You are a chatbot personalized for answering questions, now answer the\nquestion: {question} \n Do not go out of context in any circumstance or hallucinate or fabricate information."
+class Pipeline:
+    # Everything get_answer and stream_answer need, built once and shared
+    # between requests. stream_chain is qa_chain unless given.
+    def __init__(self, embeddings, qa_chain, docsearch, stream_chain=None):
+        self.embeddings = embeddings
+        self.qa_chain = qa_chain
+        self.docsearch = docsearch
+        self.stream_chain = stream_chain or qa_chain
 
+    def retrieve(self, vector):
+        return [
+            doc
+            for doc, _ in self.docsearch.similarity_search_by_vector_with_score(
+                vector, k=4
+            )
+        ]
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def build_pipeline():
     # select the chat model and temperature
     llm = ChatOpenAI(temperature=0.6, openai_api_key=openai_key)
+    # A streaming model always calls OpenAI's streaming API, so /chatbot/
+    # keeps the plain one and only stream_answer uses this
+    stream_llm = ChatOpenAI(temperature=0.6, openai_api_key=openai_key, streaming=True)
     embeddings = OpenAIEmbeddings(openai_api_key=openai_key)
 
-    # index_name -> index vector name in Pinecone
-    index_name = "woman-safety-embeddings"
-
-    # question and answer chain
+    # question and answer chains
     qa_chain = load_qa_chain(llm, chain_type="stuff")
+    stream_chain = load_qa_chain(stream_llm, chain_type="stuff")
+
+    if vector_backend == "local":
+        docsearch = LocalIndex(local_index_path)
+    else:
+        if pinecone_key:
+            init_pinecone(pinecone_key, pinecoen_env)
+        docsearch = Pinecone.from_existing_index(index_name, embeddings)
+    return Pipeline(embeddings, qa_chain, docsearch, stream_chain)
+
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = build_pipeline()
+    return _pipeline
+
+
+def warm():
+    # Called in the background at startup so the first user does not pay for it
+    try:
+        get_pipeline()
+    except Exception as exc:
+        print(exc)
 
-    docsearch = Pinecone.from_existing_index(index_name, embeddings)
 
-    docs = docsearch.similarity_search(query)
-    answer = qa_chain.run(input_documents=docs, question=query, max_tokens=150)
+def set_pipeline(pipeline):
+    # Swap in another pipeline, e.g. a local fake LLM and vector store
+    global _pipeline
+    _pipeline = pipeline
+    answer_cache.clear()
 
+
+def make_query(question):
+    return f"You are a chatbot personalized for answering questions, now answer the\nquestion: {question} \n Do not go out of context in any circumstance or hallucinate or fabricate information."
+
+
+class Prepared:
+    # A cache miss, ready for the LLM
+    def __init__(self, key, vector, query, docs):
+        self.key = key
+        self.vector = vector
+        self.query = query
+        self.docs = docs
+
+
+def prepare(question):
+    # Cache lookups and retrieval shared by get_answer and stream_answer.
+    # Returns (cached answer, None) on a hit, (None, Prepared) on a miss.
+    key = normalize(question)
+    answer = answer_cache.get(key)
+    if answer is not None:
+        cache_lookups.inc(result="exact")
+        return answer, None
+
+    pipeline = get_pipeline()
+
+    # The semantic cache compares bare questions; the prompt wrapper would
+    # make every question look alike
+    vector = pipeline.embeddings.embed_query(question)
+    answer = answer_cache.get_similar(vector)
+    if answer is not None:
+        cache_lookups.inc(result="semantic")
+        return answer, None
+    cache_lookups.inc(result="miss")
+
+    query = make_query(question)
+    if retrieve_question:
+        docs = pipeline.retrieve(vector)
+    else:
+        docs = pipeline.retrieve(pipeline.embeddings.embed_query(query))
+    return None, Prepared(key, vector, query, docs)
+
+
+def get_answer(question):
+    answer, prepared = prepare(question)
+    if prepared is None:
+        return answer
+
+    answer = get_pipeline().qa_chain.run(
+        input_documents=prepared.docs, question=prepared.query, max_tokens=150
+    )
+
+    answer_cache.put(prepared.key, answer, prepared.vector)
     return answer
+
+
+async def stream_answer(question):
+    # Yields the answer as the LLM produces it, and raises what the chain
+    # raised. Closing the generator (the client went away) cancels the LLM
+    # call.
+    started = time.perf_counter()
+    answer, prepared = await run_in_threadpool(prepare, question)
+    if prepared is None:
+        time_to_first_token.observe(time.perf_counter() - started, source="cache")
+        yield answer
+        return
+
+    handler = AsyncIteratorCallbackHandler()
+    task = asyncio.create_task(
+        get_pipeline().stream_chain.arun(
+            input_documents=prepared.docs,
+            question=prepared.query,
+            max_tokens=150,
+            callbacks=[handler],
+        )
+    )
+    get = None
+    try:
+        first = True
+        # Tokens are read off the handler's queue until the chain is done.
+        # handler.aiter() would wait for the LLM to end, which never happens
+        # when the chain fails before calling it.
+        while True:
+            get = asyncio.ensure_future(handler.queue.get())
+            await asyncio.wait({get, task}, return_when=asyncio.FIRST_COMPLETED)
+            if get.done():
+                token = get.result()
+            else:
+                # The chain is done, and every token it made is queued
+                get.cancel()
+                if handler.queue.empty():
+                    break
+                token = handler.queue.get_nowait()
+            if first:
+                time_to_first_token.observe(time.perf_counter() - started, source="llm")
+                first = False
+            yield token
+
+        answer = task.result()
+        if first:
+            # The model did not stream, send the whole answer at once
+            time_to_first_token.observe(time.perf_counter() - started, source="llm")
+            yield answer
+        answer_cache.put(prepared.key, answer, prepared.vector)
+    finally:
+        if get is not None and not get.done():
+            get.cancel()
+        if not task.done():
+            task.cancel()
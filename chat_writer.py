@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+from itertools import islice
+
+from fastapi import HTTPException
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+COMMUNITY_TABLE = "community_chat_messages"
+TICKET_TABLE = "ticket_chat_messages"
+
+# A message as broadcast, same fields as ticket_history.TicketMessage;
+# ticket_id is None for the community chat
+ChatMessage = namedtuple(
+    "ChatMessage", "message_id ticket_id user_id message_text created_at name"
+)
+
+messages_accepted = Counter(
+    "safeher_chat_messages_accepted_total",
+    "Chat messages broadcast before being written",
+)
+messages_written = Counter(
+    "safeher_chat_messages_written_total",
+    "Write-behind chat messages committed to the database",
+)
+flush_failures = Counter(
+    "safeher_chat_flush_failures_total",
+    "Write-behind batches the database refused",
+)
+messages_dropped = Counter(
+    "safeher_chat_messages_dropped_total",
+    "Write-behind chat messages the database refused on their own, logged and dropped",
+)
+backpressure_waits = Counter(
+    "safeher_chat_backpressure_waits_total",
+    "Chat messages that had to wait for room in the write-behind queue",
+)
+flush_seconds = Histogram(
+    "safeher_chat_flush_seconds",
+    "Time to write one batch of chat messages",
+)
+
+
+class ChatWriter:
+    """Write-behind persistence for chat messages.
+
+    ``add`` gives a message an id from a block reserved ahead of time from
+    the table's own sequence, and a local timestamp, and returns at once so
+    the message can be broadcast. Rows are written later in one transaction
+    per batch, every ``flush_interval`` or as soon as ``batch_size`` are
+    waiting.
+
+    A message is only forgotten once its batch has committed: a batch that
+    fails on a connection error stays at the head of the queue and is
+    retried with backoff, and ``stop`` writes whatever is left. A batch the
+    database refuses for its content is written row by row instead, and a
+    row refused on its own is logged and dropped so it cannot hold up the
+    messages behind it. What a worker loses if it dies is the messages
+    it accepted since its last flush. While ``max_pending`` messages wait,
+    ``add`` waits too, so a chat socket stops being read rather than the
+    queue growing without bound.
+
+    Each worker takes ids ``id_block`` at a time, so with several workers
+    message_id order can differ from send order by up to a block. Set
+    ``id_block`` to 1 to take one id per message.
+    """
+
+    def __init__(self, flush_interval=0.05, batch_size=500, max_pending=5000, id_block=100):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.id_block = id_block
+        self._pending: deque[ChatMessage] = deque()
+        self._ids = {COMMUNITY_TABLE: deque(), TICKET_TABLE: deque()}
+        self._refills: dict[str, asyncio.Task] = {}
+        self._space = asyncio.Semaphore(max_pending)
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._save = None
+        self._reserve = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def start(self, save, reserve):
+        # save(community_rows, ticket_rows) writes one batch in one transaction;
+        # reserve(table, count) returns `count` unused message ids, ascending
+        self._save = save
+        self._reserve = reserve
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        for refill in self._refills.values():
+            refill.cancel()
+        for attempt in range(5):
+            if await self.flush():
+                return
+            await asyncio.sleep(0.2 * 2**attempt)
+        logger.error("chat_writer: %d messages could not be written", len(self._pending))
+
+    async def _run(self):
+        delay = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            delay = self.flush_interval if await self.flush() else min(delay * 2, 5.0)
+
+    def _refill(self, table):
+        if table not in self._refills:
+            self._refills[table] = asyncio.create_task(self._take_ids(table))
+        return self._refills[table]
+
+    async def _take_ids(self, table):
+        try:
+            self._ids[table].extend(await self._reserve(table, self.id_block))
+        finally:
+            del self._refills[table]
+
+    async def _next_id(self, table):
+        ids = self._ids[table]
+        while not ids:
+            await asyncio.shield(self._refill(table))
+        if len(ids) <= self.id_block // 4:
+            # Next block arrives before this one runs out
+            self._refill(table)
+        return ids.popleft()
+
+    async def add(self, user_id: int, message_text: str, name: str, ticket_id=None):
+        # Postgres text cannot hold NUL, and a row it refuses is dropped
+        message_text = message_text.replace("\x00", "")
+        if self._space.locked():
+            backpressure_waits.inc()
+        await self._space.acquire()
+        try:
+            message_id = await self._next_id(
+                COMMUNITY_TABLE if ticket_id is None else TICKET_TABLE
+            )
+        except BaseException:
+            self._space.release()
+            raise
+        message = ChatMessage(
+            message_id,
+            ticket_id,
+            user_id,
+            message_text,
+            datetime.now(timezone.utc).replace(tzinfo=None),
+            name,
+        )
+        self._pending.append(message)
+        messages_accepted.inc()
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+        return message
+
+    def waiting(self, ticket_id: int):
+        # This ticket's messages not written yet, oldest first
+        return [m for m in self._pending if m.ticket_id == ticket_id]
+
+    async def flush(self):
+        # Writes everything waiting, batch_size rows per transaction. False if
+        # the database could not be reached; the batch stays queued for the
+        # next try.
+        async with self._flush_lock:
+            while self._pending:
+                batch = list(islice(self._pending, self.batch_size))
+                started = time.perf_counter()
+                try:
+                    await self._save(*_rows(batch))
+                    written = len(batch)
+                except Exception as exc:
+                    flush_failures.inc()
+                    if _transient(exc):
+                        logger.warning(
+                            "chat_writer: batch of %d not written: %s",
+                            len(batch),
+                            _reason(exc),
+                        )
+                        return False
+                    written = await self._save_each(batch)
+                    if written is None:
+                        return False
+                flush_seconds.observe(time.perf_counter() - started)
+
+                for _ in batch:
+                    self._pending.popleft()
+                    self._space.release()
+                messages_written.inc(written)
+            return True
+
+    async def _save_each(self, batch):
+        # One transaction per row after a refused batch. Rows written before
+        # a connection error are skipped on the retry by their taken ids.
+        # Returns the rows written, None on a connection error.
+        written = 0
+        for m in batch:
+            try:
+                await self._save(*_rows([m]))
+                written += 1
+            except Exception as exc:
+                if _transient(exc):
+                    logger.warning("chat_writer: batch not written: %s", _reason(exc))
+                    return None
+                logger.error(
+                    "chat_writer: dropped message %s refused by the database: %s %r",
+                    m.message_id,
+                    _reason(exc),
+                    m,
+                )
+                messages_dropped.inc()
+        return written
+
+
+def _rows(messages):
+    # (community_rows, ticket_rows) for ChatWriter.start's save
+    community, ticket = [], []
+    for m in messages:
+        row = {
+            "message_id": m.message_id,
+            "user_id": m.user_id,
+            "message_text": m.message_text,
+            "created_at": m.created_at,
+        }
+        if m.ticket_id is None:
+            community.append(row)
+        else:
+            row["ticket_id"] = m.ticket_id
+            ticket.append(row)
+    return community, ticket
+
+
+def _reason(exc):
+    return exc.detail if isinstance(exc, HTTPException) else exc
+
+
+def _transient(exc):
+    # Whether a failed save is the connection's fault rather than the rows'.
+    # crud re-raises as HTTPException, so the original is in the chain.
+    while exc is not None:
+        if isinstance(exc, (OperationalError, InterfaceError, ConnectionError, TimeoutError)):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+chat_writer = ChatWriter(
+    flush_interval=float(os.environ.get("CHAT_FLUSH_INTERVAL", "0.05")),
+    batch_size=int(os.environ.get("CHAT_FLUSH_BATCH", "500")),
+    max_pending=int(os.environ.get("CHAT_MAX_PENDING", "5000")),
+    id_block=int(os.environ.get("CHAT_ID_BLOCK", "100")),
+)
+
+Gauge(
+    "safeher_chat_pending_messages",
+    "Chat messages broadcast but not yet written to the database",
+    function=lambda: len(chat_writer),
+)
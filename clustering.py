@@ -0,0 +1,237 @@
+from math import asin, atan2, cos, degrees, floor, radians, sin, sqrt
+
+R = 6371.0  # radius of the Earth in kilometers
+
+# Below this many candidates the scalar haversine is cheaper than numpy setup
+VECTORIZE_MIN_CANDIDATES = 32
+
+
+def haversine_many(lat, lon, lats, lons):
+    # Haversine distance in km from one point to arrays of points.
+    # numpy is imported here so the SOS path does not pay for it at startup
+    import numpy as np
+
+    lat1 = np.radians(lat)
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lats - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lats) * np.sin(dlon / 2) ** 2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class ClusterIndex:
+    """Greedy threshold clustering backed by a uniform lat/long grid.
+
+    Gives the same groups as the original ``utils.group_points`` loop: a point
+    joins the oldest group whose running centroid is within ``threshold`` km,
+    otherwise it starts a new group. Centroids are kept as running sums, and
+    only groups in grid cells that can possibly be in range are checked.
+    """
+
+    def __init__(self, threshold=0.2):
+        self.threshold = threshold
+        # Cell edge in degrees, equal to the threshold measured along a meridian
+        self.cell = degrees(threshold / R)
+        # Columns tile the full circle exactly so wrapping at +-180 stays consistent
+        self.columns = max(1, floor(360 / self.cell))
+        self.lon_cell = 360 / self.columns
+        # haversine of the threshold angle, used to bound the longitude search
+        self._sin_half = sin(threshold / (2 * R))
+
+        self.lat_sums: list[float] = []
+        self.lon_sums: list[float] = []
+        self.counts: list[int] = []
+        self.centers: list[tuple[float, float]] = []
+        self._cell_of: list[tuple[int, int]] = []
+        self._grid: dict[tuple[int, int], list[int]] = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _key(self, lat, lon):
+        return floor(lat / self.cell), floor((lon + 180) / self.lon_cell) % self.columns
+
+    def _candidates(self, lat, lon):
+        row_lo = floor((lat - self.cell) / self.cell)
+        row_hi = floor((lat + self.cell) / self.cell)
+
+        # Longitude span that can still be within the threshold at the most
+        # poleward latitude of the search band
+        max_lat = min(90.0, abs(lat) + self.cell)
+        cos_max = cos(radians(max_lat))
+        if cos_max <= 0 or self._sin_half >= cos_max:
+            col_range = range(self.columns)
+        else:
+            span = degrees(2 * asin(self._sin_half / cos_max)) * (1 + 1e-9)
+            col_lo = floor((lon + 180 - span) / self.lon_cell)
+            col_hi = floor((lon + 180 + span) / self.lon_cell)
+            if col_hi - col_lo + 1 >= self.columns:
+                col_range = range(self.columns)
+            else:
+                col_range = [c % self.columns for c in range(col_lo, col_hi + 1)]
+
+        found = []
+        for row in range(row_lo, row_hi + 1):
+            for col in col_range:
+                bucket = self._grid.get((row, col))
+                if bucket:
+                    found.extend(bucket)
+        found.sort()
+        return found
+
+    def _nearest_group(self, lat, lon):
+        candidates = self._candidates(lat, lon)
+        if not candidates:
+            return None
+
+        if len(candidates) >= VECTORIZE_MIN_CANDIDATES:
+            lats = [self.centers[i][0] for i in candidates]
+            lons = [self.centers[i][1] for i in candidates]
+            hits = (haversine_many(lat, lon, lats, lons) <= self.threshold).nonzero()[0]
+            return candidates[hits[0]] if len(hits) else None
+
+        for i in candidates:
+            c_lat, c_lon = self.centers[i]
+            if _haversine(lat, lon, c_lat, c_lon) <= self.threshold:
+                return i
+        return None
+
+    def add(self, lat, lon, count=1):
+        # One point, or `count` points at (lat, lon) such as a finer group's
+        # centroid. Returns the group it went into.
+        i = self._nearest_group(lat, lon)
+        if i is None:
+            i = len(self.counts)
+            self.lat_sums.append(lat * count)
+            self.lon_sums.append(lon * count)
+            self.counts.append(count)
+            self.centers.append((lat, lon))
+            key = self._key(lat, lon)
+            self._cell_of.append(key)
+            self._grid.setdefault(key, []).append(i)
+            return i
+
+        self.join(i, lat, lon, count)
+        return i
+
+    def join(self, i, lat, lon, count=1):
+        # Adds to group i whether or not it is in range
+        self.lat_sums[i] += lat * count
+        self.lon_sums[i] += lon * count
+        self.counts[i] += count
+        center = (self.lat_sums[i] / self.counts[i], self.lon_sums[i] / self.counts[i])
+        self.centers[i] = center
+
+        # Move the group if its centroid drifted into another cell
+        key = self._key(*center)
+        if key != self._cell_of[i]:
+            self._grid[self._cell_of[i]].remove(i)
+            self._grid.setdefault(key, []).append(i)
+            self._cell_of[i] = key
+
+    def extend(self, points):
+        for point in points:
+            self.add(point["latitude"], point["longitude"])
+
+    def within(self, min_lat, min_lon, max_lat, max_lon):
+        # Groups whose centroid is in the box, in order. min_lon > max_lon
+        # is a box across the antimeridian.
+        rows = range(floor(min_lat / self.cell), floor(max_lat / self.cell) + 1)
+        col_lo = floor((min_lon + 180) / self.lon_cell)
+        col_hi = floor((max_lon + 180) / self.lon_cell)
+        if col_hi < col_lo:
+            col_hi += self.columns
+        columns = min(col_hi - col_lo + 1, self.columns)
+
+        # A box spanning more cells than there are occupied ones is cheaper
+        # to answer by checking every group
+        if len(rows) * columns > len(self._grid):
+            candidates = range(len(self.counts))
+        else:
+            candidates = []
+            for row in rows:
+                for col in range(col_lo, col_lo + columns):
+                    bucket = self._grid.get((row, col % self.columns))
+                    if bucket:
+                        candidates.extend(bucket)
+
+        crosses = min_lon > max_lon
+        found = []
+        for i in candidates:
+            lat, lon = self.centers[i]
+            if not min_lat <= lat <= max_lat:
+                continue
+            if (lon >= min_lon or lon <= max_lon) if crosses else min_lon <= lon <= max_lon:
+                found.append(i)
+        found.sort()
+        return found
+
+    def markers(self, groups=None):
+        if groups is None:
+            groups = range(len(self.counts))
+        return [
+            {
+                "center": {"latitude": self.centers[i][0], "longitude": self.centers[i][1]},
+                "radius": min(2 * self.counts[i], 40),
+            }
+            for i in groups
+        ]
+
+
+class ClusterPyramid:
+    """A ClusterIndex per map zoom level, each clustering the groups of the
+    level below it.
+
+    ``max_zoom`` clusters the points themselves with ``threshold`` km, the
+    same groups as a plain ClusterIndex. Every zoom level out doubles the
+    threshold and clusters the finer level's centroids weighted by their
+    counts, so it only costs as many adds as the finer level has groups.
+    A group keeps the parent it joined first, even if its centroid drifts.
+    """
+
+    def __init__(self, threshold=0.2, min_zoom=3, max_zoom=16):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        # levels[0] is max_zoom, levels[-1] is min_zoom
+        self.levels = [
+            ClusterIndex(threshold * 2**k) for k in range(max_zoom - min_zoom + 1)
+        ]
+        # parents[k][i] is the group in levels[k + 1] of group i in levels[k]
+        self.parents = [[] for _ in self.levels[1:]]
+
+    def level(self, zoom):
+        zoom = min(max(zoom, self.min_zoom), self.max_zoom)
+        return self.levels[self.max_zoom - zoom]
+
+    def add(self, lat, lon):
+        i = self.levels[0].add(lat, lon)
+        for k, parents in enumerate(self.parents):
+            if i < len(parents):
+                # An existing group, whose parents all grow by the point
+                for j in range(k, len(self.parents)):
+                    i = self.parents[j][i]
+                    self.levels[j + 1].join(i, lat, lon)
+                return
+            i = self.levels[k + 1].add(lat, lon)
+            parents.append(i)
+
+    def extend(self, points):
+        if len(self.levels[0]):
+            for point in points:
+                self.add(point["latitude"], point["longitude"])
+            return
+
+        # Level by level from the bottom when starting empty
+        self.levels[0].extend(points)
+        for k, parents in enumerate(self.parents):
+            finer, coarser = self.levels[k], self.levels[k + 1]
+            for (lat, lon), count in zip(finer.centers, finer.counts):
+                parents.append(coarser.add(lat, lon, count))
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return R * 2 * atan2(sqrt(a), sqrt(1 - a))
@@ -1,9 +1,16 @@
+import heapq
+import logging
+from collections import defaultdict
+
 from fastapi import HTTPException, status
-from sqlalchemy import and_, func
+from sqlalchemy import and_, bindparam, delete, func, insert, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-import bcrypt
 
-import models, schemas
+import models, risk, schemas
+from areas import hot_areas
+
+logger = logging.getLogger(__name__)
 
 
 def get_user(db: Session, user_id: int):
@@ -18,14 +25,13 @@ def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
 
-def create_user(db: Session, user: schemas.UserCreate):
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(user.password.encode("utf-8"), salt)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
+    # The password is hashed by the caller, see passwords.hash_password
     try:
         db_user = models.User(
             email=user.email,
             name=user.name,
-            hashed_password=hashed_password.decode("utf-8"),
+            hashed_password=hashed_password,
             phone_number=user.phone_number,
         )
         db.add(db_user)
@@ -77,71 +83,237 @@ def update_sos_chat_message(db: Session, message_id: int):
     )
 
 
-def get_community_chat_messages(db: Session):
-    resp = []
-    chats = db.query(models.CommunityChatMessage).all()
-    for chat in chats:
-        user = db.query(models.User).filter(models.User.user_id == chat.user_id).one()
-
-        chat_details = {
-            "user": {
-                "user_id": str(chat.user_id),
-                "name": str(user.name),
-            },
-            "message_id": str(chat.message_id),
-            "message_text": str(chat.message_text),
-            "created_at": str(chat.created_at),
-        }
-        resp.append(chat_details)
-    return resp
-
-
-def get_user_with_min_open_tickets(db: Session):
-    result = (
-        db.query(
-            models.User.user_id,
-            func.coalesce(func.count(models.Ticket.ticket_id), 0).label("ticket_count"),
-        )
-        .outerjoin(
-            models.Ticket,
-            and_(
-                models.User.user_id == models.Ticket.teacher_id,
-                models.Ticket.is_open == True,
-            ),
-        )
-        .filter(models.User.is_teacher == True)
-        .group_by(models.User.user_id)
-        .order_by(func.coalesce(func.count(models.Ticket.ticket_id), 0).asc())
-        .first()
-    )
-    if result:
-        return int(result.user_id)
+def get_community_chat_messages(
+    db: Session,
+    before: int | None = None,
+    after: int | None = None,
+    limit: int = 100,
+):
+    chats = get_community_chat_rows(db, before=before, after=after, limit=limit)
+    return [community_chat_message(chat) for chat in chats]
+
+
+def community_chat_message(chat):
+    return {
+        "user": {
+            "user_id": str(chat.user_id),
+            "name": str(chat.name),
+        },
+        "message_id": str(chat.message_id),
+        "message_text": str(chat.message_text),
+        "created_at": str(chat.created_at),
+    }
+
+
+def get_community_chat_rows(
+    db: Session,
+    before: int | None = None,
+    after: int | None = None,
+    limit: int = 100,
+):
+    # One joined query, paged by message_id (keyset, not OFFSET)
+    query = db.query(
+        models.CommunityChatMessage.message_id,
+        models.CommunityChatMessage.user_id,
+        models.CommunityChatMessage.message_text,
+        models.CommunityChatMessage.created_at,
+        models.User.name,
+    ).join(models.User, models.User.user_id == models.CommunityChatMessage.user_id)
+
+    if after is not None:
+        chats = (
+            query.filter(models.CommunityChatMessage.message_id > after)
+            .order_by(models.CommunityChatMessage.message_id.asc())
+            .limit(limit)
+            .all()
+        )
     else:
-        return None
+        if before is not None:
+            query = query.filter(models.CommunityChatMessage.message_id < before)
+        # Newest page first, returned oldest to newest like the full history was
+        chats = (
+            query.order_by(models.CommunityChatMessage.message_id.desc())
+            .limit(limit)
+            .all()
+        )
+        chats.reverse()
+    return chats
+
+
+def _lock_least_loaded_teacher(db: Session, skip_locked: bool):
+    least_loaded = (
+        select(models.User.user_id)
+        .where(models.User.is_teacher == True)
+        .order_by(models.User.open_ticket_count, models.User.user_id)
+        .limit(1)
+        .with_for_update(skip_locked=skip_locked)
+        .scalar_subquery()
+    )
+    return db.execute(
+        update(models.User)
+        .where(models.User.user_id == least_loaded)
+        .values(open_ticket_count=models.User.open_ticket_count + 1)
+        .returning(models.User.user_id)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+
+
+def assign_teacher(db: Session):
+    # Picks the teacher with the fewest open tickets and bumps their counter in
+    # one statement. The row stays locked until the caller commits, and other
+    # creates skip locked rows, so concurrent tickets spread over teachers.
+    # Not committed here: the ticket insert commits it (or rolls it back).
+    teacher_id = _lock_least_loaded_teacher(db, skip_locked=True)
+    if teacher_id is None:
+        # Every teacher is mid-assignment, wait for one instead of failing
+        teacher_id = _lock_least_loaded_teacher(db, skip_locked=False)
+    return teacher_id
+
+
+def resync_teacher_loads(db: Session):
+    # Recomputes every counter from the tickets table
+    open_tickets = (
+        select(func.count(models.Ticket.ticket_id))
+        .where(
+            models.Ticket.teacher_id == models.User.user_id,
+            models.Ticket.is_open == True,
+        )
+        .scalar_subquery()
+    )
+    db.execute(
+        update(models.User)
+        .values(open_ticket_count=open_tickets)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+TICKET_COLUMNS = (
+    models.Ticket.ticket_id,
+    models.Ticket.user_id,
+    models.Ticket.teacher_id,
+    models.Ticket.is_anonymous,
+    models.Ticket.is_open,
+)
 
 
 def create_ticket(db: Session, ticket: schemas.TicketCreate, teacher_id: int):
+    # Ticket, the user's first message and the report go in one transaction;
+    # RETURNING hands back the new row so nothing has to be re-read
     try:
-        ticket_model = models.Ticket(
-            user_id=ticket.user_id,
-            teacher_id=teacher_id,
-            is_anonymous=ticket.is_anonymous,
-            is_open=True,
+        ticket_row = db.execute(
+            insert(models.Ticket)
+            .values(
+                user_id=ticket.user_id,
+                teacher_id=teacher_id,
+                is_anonymous=ticket.is_anonymous,
+                is_open=True,
+            )
+            .returning(*TICKET_COLUMNS)
+        ).one()
+
+        # Create a message by user with the report
+        db.execute(
+            insert(models.TicketChatMessage).values(
+                ticket_id=ticket_row.ticket_id,
+                message_text=ticket.report_content,
+                user_id=ticket.user_id,
+            )
+        )
+        db.execute(
+            insert(models.TicketReport).values(
+                ticket_id=ticket_row.ticket_id,
+                report_content=ticket.report_content,
+                lat=ticket.lat,
+                long=ticket.long,
+            )
         )
-        db.add(ticket_model)
+        record_risk(db, [(ticket.lat, ticket.long)], "report")
         db.commit()
-        db.refresh(ticket_model)
 
-        message = schemas.TicketChatMessageCreate(
-            message_text=ticket.report_content,
-            user_id=ticket.user_id,
-            ticket_id=int(str(ticket_model.ticket_id)),
+        hot_areas.add(ticket.lat, ticket.long)
+        return ticket_row._asdict()
+    except Exception as exc:
+        # Handle any other unexpected errors
+        db.rollback()
+        print(exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)
         )
 
-        # Create a message by user with the report
-        create_ticket_message(db, message)
 
-        return ticket_model
+def import_tickets(db: Session, tickets: list[schemas.TicketCreate]):
+    # Bulk version of assign_teacher + create_ticket: one transaction, one
+    # executemany per table
+    try:
+        # Lock every teacher's counter for the duration of the import
+        loads = db.execute(
+            select(models.User.user_id, models.User.open_ticket_count)
+            .where(models.User.is_teacher == True)
+            .with_for_update()
+        ).all()
+        if not loads:
+            return None
+
+        heap = [(count, user_id) for user_id, count in loads]
+        heapq.heapify(heap)
+        teacher_ids = []
+        added: dict[int, int] = {}
+        for _ in tickets:
+            count, user_id = heapq.heappop(heap)
+            teacher_ids.append(user_id)
+            added[user_id] = added.get(user_id, 0) + 1
+            heapq.heappush(heap, (count + 1, user_id))
+
+        rows = db.execute(
+            insert(models.Ticket).returning(*TICKET_COLUMNS, sort_by_parameter_order=True),
+            [
+                {
+                    "user_id": ticket.user_id,
+                    "teacher_id": teacher_id,
+                    "is_anonymous": ticket.is_anonymous,
+                    "is_open": True,
+                }
+                for ticket, teacher_id in zip(tickets, teacher_ids)
+            ],
+        ).all()
+
+        db.execute(
+            insert(models.TicketChatMessage),
+            [
+                {
+                    "ticket_id": row.ticket_id,
+                    "message_text": ticket.report_content,
+                    "user_id": ticket.user_id,
+                }
+                for ticket, row in zip(tickets, rows)
+            ],
+        )
+        db.execute(
+            insert(models.TicketReport),
+            [
+                {
+                    "ticket_id": row.ticket_id,
+                    "report_content": ticket.report_content,
+                    "lat": ticket.lat,
+                    "long": ticket.long,
+                }
+                for ticket, row in zip(tickets, rows)
+            ],
+        )
+        record_risk(db, [(ticket.lat, ticket.long) for ticket in tickets], "report")
+
+        users = models.User.__table__
+        db.execute(
+            update(users)
+            .where(users.c.user_id == bindparam("teacher_id"))
+            .values(open_ticket_count=users.c.open_ticket_count + bindparam("added")),
+            [{"teacher_id": user_id, "added": n} for user_id, n in added.items()],
+        )
+        db.commit()
+
+        hot_areas.add_many([(ticket.lat, ticket.long) for ticket in tickets])
+        return [row._asdict() for row in rows]
     except Exception as exc:
         # Handle any other unexpected errors
         db.rollback()
@@ -153,13 +325,26 @@ def create_ticket(db: Session, ticket: schemas.TicketCreate, teacher_id: int):
 
 def close_ticket(db: Session, ticket_id: int):
     try:
-        id = (
-            db.query(models.Ticket)
-            .filter(models.Ticket.ticket_id == ticket_id)
-            .update({"is_open": False})
-        )
+        teacher_id = db.execute(
+            update(models.Ticket)
+            .where(
+                models.Ticket.ticket_id == ticket_id, models.Ticket.is_open == True
+            )
+            .values(is_open=False)
+            .returning(models.Ticket.teacher_id)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+
+        # Only a ticket that was actually open frees a slot
+        if teacher_id is not None:
+            db.execute(
+                update(models.User)
+                .where(models.User.user_id == teacher_id)
+                .values(open_ticket_count=models.User.open_ticket_count - 1)
+                .execution_options(synchronize_session=False)
+            )
         db.commit()
-        return id
+        return 1 if teacher_id is not None else 0
     except Exception as exc:
         # Handle any other unexpected errors
         db.rollback()
@@ -184,12 +369,43 @@ def get_open_user_tickets(db: Session, user_id: int):
     )
 
 
-def get_ticket_messages(db: Session, ticket_id: int):
-    return (
-        db.query(models.TicketChatMessage)
-        .filter(models.TicketChatMessage.ticket_id == ticket_id)
-        .all()
+def ticket_messages_query(
+    ticket_id: int, before: int | None = None, after: int | None = None, limit: int = 100
+):
+    # Same keyset paging as the community history, with the sender's name for
+    # the chat payload. Rows come back newest first unless paging forward.
+    query = (
+        select(
+            models.TicketChatMessage.message_id,
+            models.TicketChatMessage.ticket_id,
+            models.TicketChatMessage.user_id,
+            models.TicketChatMessage.message_text,
+            models.TicketChatMessage.created_at,
+            models.User.name,
+        )
+        .join(models.User, models.User.user_id == models.TicketChatMessage.user_id)
+        .where(models.TicketChatMessage.ticket_id == ticket_id)
+        .limit(limit)
     )
+    if after is not None:
+        return query.where(models.TicketChatMessage.message_id > after).order_by(
+            models.TicketChatMessage.message_id.asc()
+        )
+    if before is not None:
+        query = query.where(models.TicketChatMessage.message_id < before)
+    return query.order_by(models.TicketChatMessage.message_id.desc())
+
+
+def get_ticket_messages(
+    db: Session,
+    ticket_id: int,
+    before: int | None = None,
+    after: int | None = None,
+    limit: int = 100,
+):
+    rows = db.execute(ticket_messages_query(ticket_id, before, after, limit)).all()
+    # Oldest to newest either way
+    return rows if after is not None else rows[::-1]
 
 
 def create_ticket_message(db: Session, message: schemas.TicketChatMessageCreate):
@@ -219,13 +435,86 @@ def create_ticket_message(db: Session, message: schemas.TicketChatMessageCreate)
         )
 
 
-def create_sos(db: Session, sos: schemas.SOSRequest):
+def reserve_message_ids(db: Session, table: str, count: int):
+    # `count` ids from the table's message_id sequence, for messages that are
+    # broadcast before they are written (see chat_writer)
+    ids = db.execute(
+        text(
+            "SELECT nextval(pg_get_serial_sequence(:table, 'message_id')) "
+            "FROM generate_series(1, :count)"
+        ),
+        {"table": table, "count": count},
+    ).scalars().all()
+    db.commit()
+    return sorted(ids)
+
+
+def create_chat_messages(db: Session, community: list[dict], ticket: list[dict]):
+    # A batch of write-behind messages in one transaction. Their ids are taken
+    # already, so a batch retried after a lost commit cannot insert twice.
     try:
-        sos = models.SOS(user_id=sos.user_id, lat=sos.lat, long=sos.long, is_open=True)
-        db.add(sos)
+        if community:
+            db.execute(
+                pg_insert(models.CommunityChatMessage).on_conflict_do_nothing(),
+                community,
+            )
+        if ticket:
+            db.execute(
+                pg_insert(models.TicketChatMessage).on_conflict_do_nothing(), ticket
+            )
         db.commit()
-        db.refresh(sos)
-        return sos
+    except Exception as exc:
+        # Handle any other unexpected errors
+        db.rollback()
+        print(exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)
+        )
+
+
+SOS_COLUMNS = (
+    models.SOS.sos_id,
+    models.SOS.user_id,
+    models.SOS.lat,
+    models.SOS.long,
+    models.SOS.is_open,
+)
+
+MESSAGE_COLUMNS = (
+    models.CommunityChatMessage.message_id,
+    models.CommunityChatMessage.user_id,
+    models.CommunityChatMessage.message_text,
+    models.CommunityChatMessage.created_at,
+)
+
+
+def create_sos_alert(db: Session, sos: schemas.SOSRequest, message_text):
+    # The SOS and its community chat alert in one transaction, so once it is
+    # acknowledged both are on disk. message_text(user) builds the alert.
+    # Returns (sos, message, user), or None for an unknown user.
+    user = db.execute(
+        select(models.User.user_id, models.User.name, models.User.phone_number)
+        .where(models.User.user_id == sos.user_id)
+    ).one_or_none()
+    if user is None:
+        return None
+
+    try:
+        sos_row = db.execute(
+            insert(models.SOS)
+            .values(user_id=sos.user_id, lat=sos.lat, long=sos.long, is_open=True)
+            .returning(*SOS_COLUMNS)
+        ).one()
+        message = db.execute(
+            insert(models.CommunityChatMessage)
+            .values(message_text=message_text(user), user_id=sos.user_id)
+            .returning(*MESSAGE_COLUMNS)
+        ).one()
+        record_risk(db, [(sos.lat, sos.long)], "sos")
+        db.commit()
+
+        hot_areas.add(sos.lat, sos.long)
+        return sos_row, message, user
     except Exception as exc:
         # Handle any other unexpected errors
         db.rollback()
@@ -236,41 +525,325 @@ def create_sos(db: Session, sos: schemas.SOSRequest):
 
 
 def close_sos(db: Session, user_id: int):
-    sos = (
-        db.query(models.SOS)
-        .filter(models.SOS.user_id == user_id)
-        .filter(models.SOS.is_open == True)
-        .one_or_none()
-    )
-    if sos is None:
+    # Closes every open SOS of the user; returns their (sos_id, user_id, lat,
+    # long) rows for the close events
+    sos = models.SOS.__table__
+    closed = db.execute(
+        update(sos)
+        .where(sos.c.user_id == user_id)
+        .where(sos.c.is_open == True)
+        .values(is_open=False)
+        .returning(sos.c.sos_id, sos.c.user_id, sos.c.lat, sos.c.long)
+    ).all()
+    if not closed:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="No Open SOS Found"
         )
+    # Without the commit the session rolled the close back
+    db.commit()
+    return closed
+
+
+def get_sos(db: Session):
+    return db.query(models.SOS).filter(models.SOS.is_open == True).all()
+
+
+def get_sos_rows(db: Session):
+    # get_sos as plain rows, for /sos/
+    return db.query(
+        models.SOS.sos_id,
+        models.SOS.user_id,
+        models.SOS.lat,
+        models.SOS.long,
+        models.SOS.is_open,
+        models.SOS.created_at,
+    ).filter(models.SOS.is_open == True).all()
+
+
+def get_open_sos(db: Session, sos_id: int):
     return (
         db.query(models.SOS)
-        .filter(models.SOS.sos_id == sos.sos_id)
-        .update({"is_open": False})
+        .filter(models.SOS.sos_id == sos_id)
+        .filter(models.SOS.is_open == True)
+        .one_or_none()
     )
 
 
-def get_sos(db: Session):
-    return db.query(models.SOS).filter(models.SOS.is_open == True).all()
+def create_sos_locations(db: Session, locations: list[dict]):
+    # One executemany for a whole batch of location updates
+    try:
+        db.execute(insert(models.SOSLocation), locations)
+        db.commit()
+    except Exception as exc:
+        # Handle any other unexpected errors
+        db.rollback()
+        print(exc)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)
+        )
+
+
+def get_sos_locations(db: Session, sos_id: int, limit: int = 100):
+    # The newest `limit` points of the trail, oldest first
+    rows = db.execute(
+        select(
+            models.SOSLocation.lat,
+            models.SOSLocation.long,
+            models.SOSLocation.recorded_at,
+        )
+        .where(models.SOSLocation.sos_id == sos_id)
+        .order_by(models.SOSLocation.recorded_at.desc())
+        .limit(limit)
+    ).all()
+    return rows[::-1]
 
 
 def get_all_coords(db: Session):
-    soss = db.query(models.SOS).all()
-    reports = db.query(models.TicketReport).all()
-
-    coords = []
-    for sos in soss:
-        coord = {"latitude": float(str(sos.lat)), "longitude": float(str(sos.long))}
-        coords.append(coord)
-
-    for report in reports:
-        coord = {
-            "latitude": float(str(report.lat)),
-            "longitude": float(str(report.long)),
-        }
-        coords.append(coord)
-
-    return coords
+    # Only the two float columns, no ORM objects
+    rows = db.query(models.SOS.lat, models.SOS.long).all()
+    rows += db.query(models.TicketReport.lat, models.TicketReport.long).all()
+
+    return [{"latitude": lat, "longitude": long} for lat, long in rows]
+
+
+def get_coords_in_box(db: Session, min_lat: float, min_long: float, max_lat: float, max_long: float):
+    # get_all_coords for a bounding box, through the (lat, long) indexes.
+    # min_long > max_long is a box across the antimeridian.
+    rows = []
+    for model in (models.SOS, models.TicketReport):
+        if min_long <= max_long:
+            in_long = model.long.between(min_long, max_long)
+        else:
+            in_long = or_(model.long >= min_long, model.long <= max_long)
+        rows += db.query(model.lat, model.long).filter(
+            model.lat.between(min_lat, max_lat), in_long
+        ).all()
+
+    return [{"latitude": lat, "longitude": long} for lat, long in rows]
+
+
+# risk.decay in SQL, for an interval `age`
+SQL_DECAY = (
+    "power(2.0, -LEAST(GREATEST(date_part('epoch', {age}) / CAST(:half_life AS float8), 0.0), "
+    + str(risk.MAX_HALVINGS)
+    + "))"
+)
+
+# All three risk tables for one (cell, kind) in a single statement, stamped
+# with the transaction's LOCALTIMESTAMP, which is also the created_at of the
+# rows being inserted with it. Stored scores are decayed to now first.
+RISK_UPSERT = text(
+    """WITH event AS (
+        SELECT CAST(:cell AS varchar) AS cell, CAST(:kind AS varchar) AS kind,
+            CAST(:count AS integer) AS count
+    ), cells AS (
+        INSERT INTO risk_cells (cell, kind, lat, long, count, decayed, decayed_at)
+        SELECT cell, kind, CAST(:lat AS float8), CAST(:long AS float8), count, count, LOCALTIMESTAMP
+        FROM event
+        ON CONFLICT (cell, kind) DO UPDATE SET
+            count = risk_cells.count + EXCLUDED.count,
+            decayed = risk_cells.decayed * """
+    + SQL_DECAY.format(age="LOCALTIMESTAMP - risk_cells.decayed_at")
+    + """ + EXCLUDED.decayed,
+            decayed_at = GREATEST(risk_cells.decayed_at, LOCALTIMESTAMP)
+    ), hours AS (
+        INSERT INTO risk_cell_hours (cell, kind, hour, count)
+        SELECT cell, kind, date_trunc('hour', LOCALTIMESTAMP), count FROM event
+        ON CONFLICT (cell, kind, hour) DO UPDATE SET
+            count = risk_cell_hours.count + EXCLUDED.count
+    )
+    INSERT INTO risk_cell_hours_of_day (cell, kind, hour_of_day, count, decayed, decayed_at)
+    SELECT cell, kind, CAST(date_part('hour', LOCALTIMESTAMP) AS integer), count, count, LOCALTIMESTAMP
+    FROM event
+    ON CONFLICT (cell, kind, hour_of_day) DO UPDATE SET
+        count = risk_cell_hours_of_day.count + EXCLUDED.count,
+        decayed = risk_cell_hours_of_day.decayed * """
+    + SQL_DECAY.format(age="LOCALTIMESTAMP - risk_cell_hours_of_day.decayed_at")
+    + """ + EXCLUDED.decayed,
+        decayed_at = GREATEST(risk_cell_hours_of_day.decayed_at, LOCALTIMESTAMP)"""
+)
+
+
+def risk_params(points, kind: str):
+    # RISK_UPSERT parameters for new events at (lat, long) points, one set
+    # per cell they fall in
+    counts: dict[str, int] = defaultdict(int)
+    for lat, lon in points:
+        counts[risk.encode(lat, lon)] += 1
+    params = []
+    for cell, count in counts.items():
+        lat, lon = risk.center(cell)
+        params.append(
+            {
+                "cell": cell,
+                "kind": kind,
+                "count": count,
+                "lat": lat,
+                "long": lon,
+                "half_life": risk.HALF_LIFE.total_seconds(),
+            }
+        )
+    return params
+
+
+def record_risk(db: Session, points, kind: str):
+    # In a savepoint of the caller's transaction: if the heatmap update
+    # fails, only it is lost and the SOS or report is still committed.
+    # `python migrations.py rebuild-risk` catches the heatmap up.
+    try:
+        with db.begin_nested():
+            db.execute(RISK_UPSERT, risk_params(points, kind))
+    except Exception:
+        logger.exception("risk heatmap update failed")
+
+
+def rebuild_risk_cells(db: Session):
+    # Recomputes the risk aggregates from the SOS and report history. Rows
+    # from before created_at existed only count towards the all-time total.
+    # Not committed here.
+    for model in (models.RiskCell, models.RiskCellHour, models.RiskCellHourOfDay):
+        db.execute(delete(model))
+
+    now = db.execute(select(func.localtimestamp())).scalar()
+    first_hour = now - risk.HOURS_KEPT
+    cells = defaultdict(lambda: [0, 0.0])
+    hours = defaultdict(int)
+    hours_of_day = defaultdict(lambda: [0, 0.0])
+    for kind, model in (("sos", models.SOS), ("report", models.TicketReport)):
+        rows = db.execute(
+            select(model.lat, model.long, model.created_at).execution_options(yield_per=10_000)
+        )
+        for lat, lon, created_at in rows:
+            key = (risk.encode(lat, lon), kind)
+            cells[key][0] += 1
+            if created_at is None:
+                continue
+            weight = risk.decay(now - created_at)
+            cells[key][1] += weight
+            if created_at >= first_hour:
+                hours[key + (created_at.replace(minute=0, second=0, microsecond=0),)] += 1
+            by_hour = hours_of_day[key + (created_at.hour,)]
+            by_hour[0] += 1
+            by_hour[1] += weight
+
+    def insert_all(model, rows):
+        rows = list(rows)
+        for start in range(0, len(rows), 5000):
+            db.execute(insert(model), rows[start : start + 5000])
+
+    insert_all(
+        models.RiskCell,
+        (
+            {
+                "cell": cell,
+                "kind": kind,
+                "lat": lat,
+                "long": lon,
+                "count": count,
+                "decayed": decayed,
+                "decayed_at": now,
+            }
+            for (cell, kind), (count, decayed) in cells.items()
+            for lat, lon in [risk.center(cell)]
+        ),
+    )
+    insert_all(
+        models.RiskCellHour,
+        (
+            {"cell": cell, "kind": kind, "hour": hour, "count": count}
+            for (cell, kind, hour), count in hours.items()
+        ),
+    )
+    insert_all(
+        models.RiskCellHourOfDay,
+        (
+            {
+                "cell": cell,
+                "kind": kind,
+                "hour_of_day": hour,
+                "count": count,
+                "decayed": decayed,
+                "decayed_at": now,
+            }
+            for (cell, kind, hour), (count, decayed) in hours_of_day.items()
+        ),
+    )
+    return len(cells)
+
+
+def prune_risk_hours(db: Session):
+    # Hourly rows older than the longest window are never read again
+    db.execute(
+        delete(models.RiskCellHour).where(
+            models.RiskCellHour.hour < func.localtimestamp() - risk.HOURS_KEPT
+        )
+    )
+    db.commit()
+
+
+def risk_cells_query(
+    min_lat: float,
+    min_long: float,
+    max_lat: float,
+    max_long: float,
+    precision: int = 6,
+    window: str | None = None,
+    hours_of_day: list[int] | None = None,
+    kinds=risk.KINDS,
+    limit: int = 1000,
+):
+    # (cell, count, score) per cell of `precision` inside the box, highest
+    # score first. Only the aggregate rows of cells in the box are read.
+    cells = models.RiskCell
+    in_box = and_(
+        cells.lat.between(min_lat, max_lat),
+        cells.long.between(min_long, max_long),
+        cells.kind.in_(kinds),
+    )
+    prefix = func.substr(cells.cell, 1, precision).label("cell")
+    half_life = risk.HALF_LIFE.total_seconds()
+
+    def decay(since):
+        # risk.decay(now - since)
+        halvings = func.date_part("epoch", func.localtimestamp() - since) / half_life
+        return func.power(2.0, -func.least(func.greatest(halvings, 0.0), risk.MAX_HALVINGS))
+
+    if window is not None:
+        hour = models.RiskCellHour
+        query = (
+            select(
+                prefix,
+                func.sum(hour.count).label("count"),
+                func.sum(hour.count * decay(hour.hour)).label("score"),
+            )
+            .join(hour, and_(hour.cell == cells.cell, hour.kind == cells.kind))
+            .where(
+                in_box,
+                hour.hour >= func.date_trunc("hour", func.localtimestamp() - risk.WINDOWS[window]),
+            )
+        )
+        if hours_of_day is not None:
+            query = query.where(func.date_part("hour", hour.hour).in_(hours_of_day))
+    elif hours_of_day is not None:
+        by_hour = models.RiskCellHourOfDay
+        query = (
+            select(
+                prefix,
+                func.sum(by_hour.count).label("count"),
+                func.sum(by_hour.decayed * decay(by_hour.decayed_at)).label("score"),
+            )
+            .join(by_hour, and_(by_hour.cell == cells.cell, by_hour.kind == cells.kind))
+            .where(in_box, by_hour.hour_of_day.in_(hours_of_day))
+        )
+    else:
+        query = select(
+            prefix,
+            func.sum(cells.count).label("count"),
+            func.sum(cells.decayed * decay(cells.decayed_at)).label("score"),
+        ).where(in_box)
+
+    return query.group_by(prefix).order_by(text("score DESC")).limit(limit)
+
+
+def get_risk_cells(db: Session, *args, **kwargs):
+    return db.execute(risk_cells_query(*args, **kwargs)).all()
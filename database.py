@@ -1,18 +1,174 @@
+import getpass
 import os
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from metrics import Gauge, Histogram
+
+
+def env_flag(name, default="0"):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
 
 role = os.environ.get("DATABASE_ROLE")
 password = os.environ.get("DATABASE_PASSWORD")
 host = os.environ.get("DATABASE_HOST")
 name = os.environ.get("DATABASE_NAME")
 if host is None or password is None or role is None or name is None:
-    user = os.getlogin()
+    # getlogin() needs a controlling terminal, which serverless and
+    # containers do not have
+    user = getpass.getuser()
     SQLALCHEMY_DATABASE_URL = f"postgresql://{user}@localhost/womenProtection"
 else:
     SQLALCHEMY_DATABASE_URL = f"postgresql://{role}:{password}@{host}/{name}"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+
+# Pooling, all from the environment:
+#   DATABASE_POOL_MODE     "queue" (default) keeps a pool in each process,
+#                          "external" opens a connection per checkout for use
+#                          behind PgBouncer / the Neon pooled endpoint
+#   DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT,
+#   DATABASE_POOL_RECYCLE, DATABASE_POOL_PRE_PING
+#   DATABASE_ECHO          log every statement (off by default)
+#   DATABASE_POOL_METRICS  time pool checkouts (on by default)
+POOL_MODE = os.environ.get("DATABASE_POOL_MODE", "queue")
+POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.environ.get("DATABASE_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.environ.get("DATABASE_POOL_TIMEOUT", "30"))
+# Neon closes idle connections, recycle before it does
+POOL_RECYCLE = int(os.environ.get("DATABASE_POOL_RECYCLE", "300"))
+POOL_PRE_PING = env_flag("DATABASE_POOL_PRE_PING", "1")
+ECHO = env_flag("DATABASE_ECHO")
+POOL_METRICS = env_flag("DATABASE_POOL_METRICS", "1")
+# Connections reserved for /sos/create, so chat, login or chatbot traffic
+# draining the main pool never makes an SOS wait. Behind PgBouncer the
+# reservation has to be made there instead.
+SOS_POOL_SIZE = int(os.environ.get("DATABASE_SOS_POOL_SIZE", "2"))
+SOS_MAX_OVERFLOW = int(os.environ.get("DATABASE_SOS_MAX_OVERFLOW", "2"))
+
+checkout_wait = Histogram(
+    "safeher_db_pool_checkout_seconds",
+    "Time spent waiting for a pooled database connection",
+    labels=("engine",),
+)
+
+
+class TimedQueuePool(QueuePool):
+    engine_name = "sync"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            checkout_wait.observe(time.perf_counter() - start, engine=self.engine_name)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    engine_name = "async"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            checkout_wait.observe(time.perf_counter() - start, engine=self.engine_name)
+
+
+class TimedSosQueuePool(TimedQueuePool):
+    engine_name = "sos"
+
+
+class TimedAsyncSosQueuePool(TimedAsyncQueuePool):
+    engine_name = "sos_async"
+
+
+def engine_options(is_async=False, sos=False):
+    if POOL_MODE == "external":
+        options = {"poolclass": NullPool}
+        if is_async:
+            # PgBouncer in transaction mode cannot keep prepared statements
+            options["connect_args"] = {"statement_cache_size": 0}
+        return {"echo": ECHO, **options}
+
+    options = {
+        "echo": ECHO,
+        "pool_size": SOS_POOL_SIZE if sos else POOL_SIZE,
+        "max_overflow": SOS_MAX_OVERFLOW if sos else MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+    if POOL_METRICS:
+        if sos:
+            options["poolclass"] = TimedAsyncSosQueuePool if is_async else TimedSosQueuePool
+        else:
+            options["poolclass"] = TimedAsyncQueuePool if is_async else TimedQueuePool
+    return options
+
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+sos_engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(sos=True))
+SosSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sos_engine)
+
+# Optional asyncpg engine for the async endpoints, enabled with DATABASE_ASYNC=1
+ASYNC_DATABASE = env_flag("DATABASE_ASYNC")
+SQLALCHEMY_ASYNC_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace(
+    "postgresql://", "postgresql+asyncpg://", 1
+)
+if POOL_MODE == "external":
+    SQLALCHEMY_ASYNC_DATABASE_URL += "?prepared_statement_cache_size=0"
+if ASYNC_DATABASE:
+    async_engine = create_async_engine(
+        SQLALCHEMY_ASYNC_DATABASE_URL, **engine_options(is_async=True)
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False
+    )
+    async_sos_engine = create_async_engine(
+        SQLALCHEMY_ASYNC_DATABASE_URL, **engine_options(is_async=True, sos=True)
+    )
+    AsyncSosSessionLocal = async_sessionmaker(
+        async_sos_engine, autoflush=False, expire_on_commit=False
+    )
+else:
+    async_engine = None
+    AsyncSessionLocal = None
+    async_sos_engine = None
+    AsyncSosSessionLocal = None
+
+
+def _pool_gauge(attribute):
+    def read():
+        values = {}
+        engines = [("sync", engine), ("sos", sos_engine)]
+        if async_engine is not None:
+            engines.append(("async", async_engine.sync_engine))
+            engines.append(("sos_async", async_sos_engine.sync_engine))
+        for label, bound in engines:
+            pool = bound.pool
+            if isinstance(pool, QueuePool):
+                values[label] = getattr(pool, attribute)()
+        return values
+
+    return read
+
+
+Gauge(
+    "safeher_db_pool_checked_out",
+    "Database connections currently checked out",
+    labels=("engine",),
+    function=_pool_gauge("checkedout"),
+)
+Gauge(
+    "safeher_db_pool_idle",
+    "Idle database connections kept in the pool",
+    labels=("engine",),
+    function=_pool_gauge("checkedin"),
+)
 
 Base = declarative_base()
@@ -0,0 +1,87 @@
+import orjson
+from fastapi import Response
+
+# Response bodies of the bulk endpoints, picked from the Accept header:
+#
+#   application/json (default)  the documented JSON, written with orjson
+#   application/msgpack         the same document as MessagePack
+#   COLUMNS                     MessagePack of {"count": n, "columns": {...},
+#                               "types": {...}}: one array per field, and
+#                               numeric fields as packed little-endian
+#                               numbers whose numpy dtype is in "types"
+#
+# msgpack is optional; without it every client gets JSON.
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+COLUMNS = "application/vnd.safeher.columns+msgpack"
+
+_ALIASES = {"application/x-msgpack": MSGPACK}
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def negotiate(accept: str | None, columnar=True):
+    # The client's most preferred of the encodings this endpoint has,
+    # JSON when it names none of them
+    offered = [JSON]
+    if _msgpack() is not None:
+        offered += [MSGPACK, COLUMNS] if columnar else [MSGPACK]
+
+    best, best_q = JSON, 0.0
+    for part in (accept or "").split(","):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        media_type = _ALIASES.get(media_type.lower(), media_type.lower())
+        if media_type not in offered:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def pack_columns(columns: dict):
+    # columns: name -> list, or (dtype, list) for a packed numeric column
+    import numpy as np
+
+    packed, types, count = {}, {}, 0
+    for name, column in columns.items():
+        if isinstance(column, tuple):
+            dtype, values = column
+            packed[name] = np.asarray(values, dtype=dtype).tobytes()
+            types[name] = dtype
+        else:
+            values = packed[name] = column
+        count = len(values)
+    return {"count": count, "columns": packed, "types": types}
+
+
+def encode(media_type: str, document, columns=None):
+    # document() and columns() build the body for the chosen encoding only
+    if media_type == COLUMNS:
+        return _msgpack().packb(pack_columns(columns()))
+    if media_type == MSGPACK:
+        return _msgpack().packb(document())
+    return orjson.dumps(document())
+
+
+def respond(request, document, columns=None, headers=None):
+    media_type = negotiate(request.headers.get("accept"), columns is not None)
+    return Response(
+        encode(media_type, document, columns),
+        media_type=media_type,
+        headers={"Vary": "Accept", **(headers or {})},
+    )
@@ -0,0 +1,190 @@
+import json
+from math import asin, cos, degrees, floor, radians, sin
+
+from utils import distance
+
+R = 6371.0  # radius of the Earth in kilometers
+
+
+class PointGrid:
+    """Keyed points bucketed in a uniform lat/long grid for radius queries.
+
+    A query only looks at the cells a circle of the given radius can touch,
+    so its cost depends on how crowded the area is, not on the total count.
+    """
+
+    def __init__(self, cell_km=5.0):
+        self.cell = degrees(cell_km / R)
+        # Columns tile the full circle exactly so wrapping at +-180 stays consistent
+        self.columns = max(1, floor(360 / self.cell))
+        self.lon_cell = 360 / self.columns
+        self.points: dict = {}
+        self._cells: dict[tuple[int, int], set] = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, key):
+        return key in self.points
+
+    def _key(self, lat, lon):
+        return floor(lat / self.cell), floor((lon + 180) / self.lon_cell) % self.columns
+
+    def add(self, key, lat, lon):
+        self.remove(key)
+        self.points[key] = (lat, lon)
+        self._cells.setdefault(self._key(lat, lon), set()).add(key)
+
+    def remove(self, key):
+        point = self.points.pop(key, None)
+        if point is None:
+            return None
+        cell_key = self._key(*point)
+        cell = self._cells[cell_key]
+        cell.discard(key)
+        if not cell:
+            del self._cells[cell_key]
+        return point
+
+    def _columns(self, lat, lon, radius_km):
+        # Widest longitude span of a spherical cap of this radius around lat
+        ratio = sin(radius_km / R) / max(cos(radians(lat)), 1e-12)
+        if ratio >= 1:
+            return range(self.columns)
+        span = degrees(asin(ratio))
+        col_lo = floor((lon - span + 180) / self.lon_cell)
+        col_hi = floor((lon + span + 180) / self.lon_cell)
+        if col_hi - col_lo + 1 >= self.columns:
+            return range(self.columns)
+        return [col % self.columns for col in range(col_lo, col_hi + 1)]
+
+    def near(self, lat, lon, radius_km):
+        # Yields (key, distance in km) for every point within radius_km
+        span = degrees(radius_km / R)
+        columns = self._columns(lat, lon, radius_km)
+        for row in range(floor((lat - span) / self.cell), floor((lat + span) / self.cell) + 1):
+            for col in columns:
+                for key in self._cells.get((row, col), ()):
+                    p_lat, p_lon = self.points[key]
+                    d = distance(lat, lon, p_lat, p_lon)
+                    if d <= radius_km:
+                        yield key, d
+
+
+class CircleGrid(PointGrid):
+    """Keyed circles, filed under every grid cell they overlap.
+
+    The reverse of ``PointGrid.near``: ``covering`` finds the circles that
+    contain a point by looking in that point's cell only.
+    """
+
+    def __init__(self, cell_km=5.0):
+        super().__init__(cell_km)
+        self.radius: dict = {}
+        self._cells_of: dict = {}
+
+    def add(self, key, lat, lon, radius_km):
+        self.remove(key)
+        span = degrees(radius_km / R)
+        cells = [
+            (row, col)
+            for row in range(floor((lat - span) / self.cell), floor((lat + span) / self.cell) + 1)
+            for col in self._columns(lat, lon, radius_km)
+        ]
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(key)
+        self.points[key] = (lat, lon)
+        self.radius[key] = radius_km
+        self._cells_of[key] = cells
+
+    def remove(self, key):
+        point = self.points.pop(key, None)
+        if point is None:
+            return None
+        del self.radius[key]
+        for cell_key in self._cells_of.pop(key):
+            cell = self._cells[cell_key]
+            cell.discard(key)
+            if not cell:
+                del self._cells[cell_key]
+        return point
+
+    def covering(self, lat, lon):
+        for key in self._cells.get(self._key(lat, lon), ()):
+            c_lat, c_lon = self.points[key]
+            if distance(lat, lon, c_lat, c_lon) <= self.radius[key]:
+                yield key
+
+
+class SOSFeed:
+    """Open SOS rows and the clients watching an area for them.
+
+    Every SOS open/close is published to the hub's SOS room and comes back
+    to ``route`` on each worker, which updates that worker's index of open
+    SOS and picks the room members whose watch circle contains the SOS, so
+    a client only hears about emergencies near it.
+
+    ``load`` fills it from the open rows, at startup or before the first
+    client watches; until then ``ready`` is False.
+    """
+
+    def __init__(self, cell_km=5.0, max_radius_km=50.0):
+        self.max_radius_km = max_radius_km
+        self.open = PointGrid(cell_km)
+        # sos_id -> its sos_opened event; a user can have several open
+        self.events: dict[int, dict] = {}
+        self.watchers = CircleGrid(cell_km)
+        self.ready = False
+
+    def load(self, rows):
+        for row in rows:
+            self._opened(self.opened_event(row))
+        self.ready = True
+
+    def opened_event(self, sos):
+        return {
+            "event": "sos_opened",
+            "sos_id": int(sos.sos_id),
+            "user_id": int(sos.user_id),
+            "lat": float(sos.lat),
+            "long": float(sos.long),
+        }
+
+    def closed_event(self, sos):
+        return {**self.opened_event(sos), "event": "sos_closed"}
+
+    def _opened(self, event):
+        sos_id = event["sos_id"]
+        self.open.add(sos_id, event["lat"], event["long"])
+        self.events[sos_id] = event
+
+    def _closed(self, event):
+        self.events.pop(event["sos_id"], None)
+        return self.open.remove(event["sos_id"])
+
+    def watch(self, websocket, lat: float, lon: float, radius_km: float):
+        radius_km = min(max(radius_km, 0.0), self.max_radius_km)
+        self.watchers.add(websocket, lat, lon, radius_km)
+        return [self.events[sos_id] for sos_id, _ in self.open.near(lat, lon, radius_km)]
+
+    def unwatch(self, websocket):
+        self.watchers.remove(websocket)
+
+    def route(self, text: str, members: dict):
+        event = json.loads(text)
+        if event["event"] == "sos_opened":
+            self._opened(event)
+            location = event["lat"], event["long"]
+        else:
+            location = self._closed(event)
+            if location is None:
+                return []
+
+        return [
+            members[websocket]
+            for websocket in self.watchers.covering(*location)
+            if websocket in members
+        ]
+
+
+sos_feed = SOSFeed()
@@ -0,0 +1,134 @@
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import Counter, Histogram
+
+# Per-request timing on /metrics: latency by route, and how many queries
+# each request ran and how long they took, so N+1 patterns show up as a
+# route whose query count grows with its data.
+
+request_seconds = Histogram(
+    "safeher_http_request_seconds",
+    "Time to send the complete response, by route template",
+    labels=("method", "route"),
+)
+requests_total = Counter(
+    "safeher_http_requests_total",
+    "HTTP requests by route template and status",
+    labels=("method", "route", "status"),
+)
+request_queries = Histogram(
+    "safeher_http_request_db_queries",
+    "Database statements run while serving one request",
+    labels=("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500),
+)
+request_db_seconds = Histogram(
+    "safeher_http_request_db_seconds",
+    "Time one request spent waiting on database statements",
+    labels=("method", "route"),
+)
+# Its _count is the number of statements run
+query_seconds = Histogram(
+    "safeher_db_query_seconds",
+    "Time from sending a statement to its result, any engine",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0),
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Set by the middleware for the request being served. The threadpool copies
+# the context, so sync endpoints and async_crud.call add to the same object.
+current_request: ContextVar[RequestStats | None] = ContextVar(
+    "current_request", default=None
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._safeher_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._safeher_started
+    query_seconds.observe(elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+class RequestMetricsMiddleware:
+    """Plain ASGI middleware, cheaper than BaseHTTPMiddleware and does not
+    buffer streaming responses. Time is taken when the last body chunk is
+    sent, so background tasks are not counted against the route.
+    WebSockets pass straight through; broadcast has their metrics.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def route_name(self, scope):
+        # The route template, e.g. /tickets/messages/{ticket_id}, so ids do
+        # not each become a label value
+        if self._routes is None:
+            self._routes = {
+                route.endpoint: route.path
+                for route in scope["app"].router.routes
+                if hasattr(route, "endpoint")
+            }
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        def record():
+            method = scope["method"]
+            route = self.route_name(scope)
+            request_seconds.observe(time.perf_counter() - started, method=method, route=route)
+            requests_total.inc(method=method, route=route, status=status)
+            request_queries.observe(stats.queries, method=method, route=route)
+            request_db_seconds.observe(stats.db_seconds, method=method, route=route)
+
+        recorded = False
+
+        async def send_wrapper(message):
+            nonlocal status, recorded
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                recorded = True
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            if not recorded:
+                record()
+
+
+def install(app):
+    # Statement hooks on every engine, sync and async, plus the middleware
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    app.add_middleware(RequestMetricsMiddleware)
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+from array import array
+from datetime import datetime, timezone
+
+from broadcast import Hub, hub, location_room
+from metrics import Counter, Gauge, Histogram
+
+updates_received = Counter(
+    "safeher_location_updates_total",
+    "Location updates received from SOS senders",
+)
+rows_written = Counter(
+    "safeher_location_rows_written_total",
+    "Location rows written to the database after coalescing",
+)
+flush_seconds = Histogram(
+    "safeher_location_flush_seconds",
+    "Time to write one batch of location rows",
+)
+
+
+class Trail:
+    """The last ``capacity`` points of one SOS in a flat float64 ring buffer.
+
+    Three doubles per point (lat, long, unix time), 24 bytes each instead of
+    a tuple of floats per point.
+    """
+
+    __slots__ = ("capacity", "data", "start", "count")
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.data = array("d", bytes(24 * capacity))
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, lat, lon, t):
+        if self.count < self.capacity:
+            slot = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            slot = self.start
+            self.start = (self.start + 1) % self.capacity
+        i = 3 * slot
+        self.data[i] = lat
+        self.data[i + 1] = lon
+        self.data[i + 2] = t
+
+    def points(self, limit=None):
+        # Oldest first, as [lat, long, t] lists
+        count = self.count if limit is None else min(limit, self.count)
+        first = self.start + self.count - count
+        return [
+            self.data[3 * (i % self.capacity) : 3 * (i % self.capacity) + 3].tolist()
+            for i in range(first, first + count)
+        ]
+
+
+class LocationStream:
+    """Live location of every SOS being shared from this worker.
+
+    ``update`` only touches memory: the point goes on the SOS's trail and
+    replaces any point of the same SOS still waiting to be saved or sent.
+    Every ``flush_interval`` the waiting points are written in one batch,
+    and every ``fanout_interval`` the newest point of each moving SOS is
+    published to its location room, so watchers get a capped rate however
+    often the phone reports.
+    """
+
+    def __init__(self, hub: Hub, flush_interval=1.0, fanout_interval=0.5, trail_size=256):
+        self.hub = hub
+        self.flush_interval = flush_interval
+        self.fanout_interval = fanout_interval
+        self.trail_size = trail_size
+        self.trails: dict[int, Trail] = {}
+        self._unsaved: dict[int, tuple] = {}
+        self._unsent: dict[int, tuple] = {}
+        self._save = None
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, save):
+        # save(rows) writes a list of sos_locations rows
+        self._save = save
+        self._tasks = [
+            asyncio.create_task(self._every(self.flush_interval, self.flush)),
+            asyncio.create_task(self._every(self.fanout_interval, self.fanout)),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._save is not None:
+            await self.flush()
+
+    async def _every(self, interval, step):
+        while True:
+            await asyncio.sleep(interval)
+            result = step()
+            if asyncio.iscoroutine(result):
+                await result
+
+    def update(self, sos_id: int, lat: float, lon: float, t=None):
+        point = (lat, lon, time.time() if t is None else t)
+        trail = self.trails.get(sos_id)
+        if trail is None:
+            trail = self.trails[sos_id] = Trail(self.trail_size)
+        trail.append(*point)
+        self._unsaved[sos_id] = point
+        self._unsent[sos_id] = point
+        updates_received.inc()
+
+    def trail(self, sos_id: int, limit=None):
+        trail = self.trails.get(sos_id)
+        return None if trail is None else trail.points(limit)
+
+    def end(self, sos_id: int):
+        # SOS closed; a point still waiting to be saved is kept for the next flush
+        self.trails.pop(sos_id, None)
+        self._unsent.pop(sos_id, None)
+
+    async def flush(self):
+        if not self._unsaved:
+            return
+        batch, self._unsaved = self._unsaved, {}
+        rows = [
+            {
+                "sos_id": sos_id,
+                "lat": lat,
+                "long": lon,
+                "recorded_at": datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None),
+            }
+            for sos_id, (lat, lon, t) in batch.items()
+        ]
+        started = time.perf_counter()
+        try:
+            await self._save(rows)
+        except Exception as exc:
+            print(exc)
+            # Retry with the next batch unless a newer point replaced it
+            for sos_id, point in batch.items():
+                self._unsaved.setdefault(sos_id, point)
+            return
+        flush_seconds.observe(time.perf_counter() - started)
+        rows_written.inc(len(rows))
+
+    def fanout(self):
+        batch, self._unsent = self._unsent, {}
+        for sos_id, (lat, lon, t) in batch.items():
+            self.hub.publish(
+                location_room(sos_id),
+                {"event": "location", "sos_id": sos_id, "lat": lat, "long": lon, "t": t},
+            )
+
+
+def stored_points(rows):
+    # get_sos_locations rows in the same [lat, long, t] form as Trail.points
+    return [
+        [lat, lon, recorded_at.replace(tzinfo=timezone.utc).timestamp()]
+        for lat, lon, recorded_at in rows
+    ]
+
+
+location_stream = LocationStream(
+    hub,
+    flush_interval=float(os.environ.get("LOCATION_FLUSH_INTERVAL", "1.0")),
+    fanout_interval=float(os.environ.get("LOCATION_FANOUT_INTERVAL", "0.5")),
+)
+
+Gauge(
+    "safeher_location_active_trails",
+    "SOS whose location is being shared through this worker",
+    function=lambda: len(location_stream.trails),
+)
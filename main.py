@@ -1,25 +1,80 @@
-from typing import Dict, Set
-import uvicorn
-import bcrypt
+import asyncio
+import json
+import os
+import threading
+import time
+from anyio import from_thread
 from fastapi import (
     FastAPI,
+    BackgroundTasks,
+    Body,
     HTTPException,
+    Query,
+    Request,
+    Response,
     WebSocket,
     Depends,
     status,
 )
 from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import models, schemas, crud, chatBot, mapMarkers
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+import models, schemas, crud, async_crud, encoding, instrumentation, mapMarkers, metrics, passwords, risk
 
 from schemas import *
 
-from database import SessionLocal, engine
-import utils
+from database import SQLALCHEMY_DATABASE_URL, SessionLocal, env_flag
+from areas import hot_areas
+from chat_writer import chat_writer
+from backplane import create_backplane
+from broadcast import AREAS_ROOM, COMMUNITY_ROOM, SOS_ROOM, hub, location_room, ticket_room
+from geostream import sos_feed
+from location_sharing import location_stream, stored_points
+from ticket_history import ticket_history
+from metrics import Counter, Gauge, Histogram
+
+app = FastAPI(
+    swagger_ui_parameters={"syntaxHighlight": True},
+    default_response_class=ORJSONResponse,
+)
+
+# Most tickets accepted by one /tickets/import/ call
+IMPORT_BATCH_SIZE = 5000
+
+# Most missed messages replayed to a ticket chat client that reconnects
+MAX_REPLAY = 500
 
-models.Base.metadata.create_all(bind=engine)
+# Longest chat message taken from a WebSocket, in characters. With the
+# sender's name it has to fit in one backplane message, and Postgres NOTIFY
+# stops at 8000 bytes.
+MAX_MESSAGE_LENGTH = int(os.environ.get("MAX_MESSAGE_LENGTH", "1000"))
 
-app = FastAPI(swagger_ui_parameters={"syntaxHighlight": True})
+# Target time for /sos/create to acknowledge an SOS
+SOS_ACK_SLO = float(os.environ.get("SOS_ACK_SLO_SECONDS", "0.25"))
+
+sos_ack_seconds = Histogram(
+    "safeher_sos_ack_seconds",
+    "Time from an SOS request being read to its acknowledgement",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+sos_broadcast_seconds = Histogram(
+    "safeher_sos_broadcast_seconds",
+    "Time from an SOS request being read to its alert reaching the chat hub",
+)
+sos_slo_breaches = Counter(
+    "safeher_sos_slo_breaches_total",
+    "SOS acknowledgements slower than safeher_sos_ack_slo_seconds",
+)
+sos_failures = Counter(
+    "safeher_sos_failures_total",
+    "SOS requests that could not be stored",
+)
+Gauge(
+    "safeher_sos_ack_slo_seconds",
+    "Target acknowledgement time for an SOS",
+    function=lambda: SOS_ACK_SLO,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +84,144 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
+# Route latency and per-request query counts on /metrics, REQUEST_METRICS=0
+# to turn off
+if env_flag("REQUEST_METRICS", "1"):
+    instrumentation.install(app)
+
+
+@app.on_event("startup")
+async def start_broadcast():
+    await hub.start(
+        create_backplane(
+            os.environ.get("BROADCAST_BACKPLANE"), SQLALCHEMY_DATABASE_URL
+        )
+    )
+
+
+hub.route(SOS_ROOM, sos_feed.route)
+hub.listen(ticket_history.deliver)
+hub.listen_close(ticket_history.room_closed)
+
+
+@app.on_event("startup")
+async def share_hot_areas():
+    # Points added by any worker reach every worker's /areas/. Additions come
+    # from crud in threadpool threads, the hub is only used from the loop.
+    loop = asyncio.get_running_loop()
+    hot_areas.publish = lambda points: loop.call_soon_threadsafe(
+        hub.publish, AREAS_ROOM, {"points": points}
+    )
+
+
+def hot_area_points(room: str, text: str):
+    if room == AREAS_ROOM:
+        hot_areas.apply(json.loads(text)["points"])
+
+
+hub.listen(hot_area_points)
+
+
+@app.on_event("shutdown")
+async def stop_broadcast():
+    hot_areas.publish = None
+    await hub.stop()
+
+
+async def save_locations(rows):
+    await async_crud.call(crud.create_sos_locations, rows)
+
+
+@app.on_event("startup")
+async def start_location_stream():
+    await location_stream.start(save_locations)
+
+
+@app.on_event("shutdown")
+async def stop_location_stream():
+    # Writes whatever is still waiting
+    await location_stream.stop()
+
+
+async def save_chat_messages(community, ticket):
+    await async_crud.call(crud.create_chat_messages, community, ticket)
+
+
+async def reserve_message_ids(table, count):
+    return await async_crud.call(crud.reserve_message_ids, table, count)
+
+
+@app.on_event("startup")
+async def start_chat_writer():
+    # Opt-in: chat messages are broadcast first and written in batches after
+    if env_flag("CHAT_WRITE_BEHIND"):
+        await chat_writer.start(save_chat_messages, reserve_message_ids)
+
+
+@app.on_event("shutdown")
+async def stop_chat_writer():
+    await chat_writer.stop()
+
+
+_chatbot = None
+_chatbot_lock = threading.Lock()
+
+
+def get_chatbot():
+    # langchain and pinecone take seconds to import, so the chatbot is only
+    # loaded when it is first used (or warmed) instead of on every cold start.
+    # Blocks while it loads: async callers go through a threadpool.
+    global _chatbot
+    if _chatbot is None:
+        with _chatbot_lock:
+            if _chatbot is None:
+                import chatBot
+
+                _chatbot = chatBot
+    return _chatbot
+
+
+@app.on_event("startup")
+def warm_chatbot():
+    # Off on serverless, where a cold start should serve the request that
+    # woke it and nothing else
+    if env_flag("CHATBOT_WARM", "1"):
+        threading.Thread(target=lambda: get_chatbot().warm(), daemon=True).start()
+
+
+async def prune_risk_hours():
+    while True:
+        try:
+            await async_crud.call(crud.prune_risk_hours)
+        except Exception as exc:
+            print(exc)
+        await asyncio.sleep(3600)
+
+
+@app.on_event("startup")
+async def start_risk_pruning():
+    app.state.risk_pruner = asyncio.create_task(prune_risk_hours())
+
+
+@app.on_event("shutdown")
+async def stop_risk_pruning():
+    app.state.risk_pruner.cancel()
+
+
+@app.on_event("startup")
+def warm_geo():
+    # Reads every SOS and report coordinate and every open SOS. Off on
+    # serverless like CHATBOT_WARM: /areas/ then builds the clusters and
+    # /ws/sos the feed on first use.
+    if not env_flag("GEO_WARM", "1"):
+        return
+    db = SessionLocal()
+    try:
+        hot_areas.rebuild(crud.get_all_coords(db))
+        sos_feed.load(crud.get_sos(db))
+    finally:
+        db.close()
+
 
 # Dependency
 def get_db():
@@ -39,57 +232,137 @@ def get_db():
         db.close()
 
 
-# List to store connected websocket clients
-clients: list[WebSocket] = []
+async def async_fill_history(ticket_id: int):
+    # ticket_history.fill for the async endpoints; the query runs off the loop
+    if ticket_history.page(ticket_id, limit=1) is not None:
+        return
+    messages = await async_crud.call(
+        crud.get_ticket_messages, ticket_id, limit=ticket_history.size
+    )
+    # Sent through this worker but not written yet
+    messages += chat_writer.waiting(ticket_id)
+    ticket_history.fill(ticket_id, lambda: messages)
+
+
+def message_payload(message, user):
+    return {
+        "user": {
+            "user_id": str(message.user_id),
+            "name": str(user.name),
+        },
+        "message_id": str(message.message_id),
+        "message_text": str(message.message_text),
+        "created_at": str(message.created_at),
+    }
 
 
 @app.websocket("/ws/community_chat/{user_id}")
-async def community_chat_endpoint(
-    websocket: WebSocket, user_id: int, db: Session = Depends(get_db)
-):
+async def community_chat_endpoint(websocket: WebSocket, user_id: int):
     # Check if user exists
-    user = crud.get_user(db, user_id)
+    user = await async_crud.call(crud.get_user, user_id)
     if not user:
         return
 
     await websocket.accept()
-    clients.append(websocket)
+    hub.join(COMMUNITY_ROOM, websocket)
 
     try:
         while True:
             message = await websocket.receive_text()
-            chat_message, user = crud.create_community_chat_message(
-                db=db,
-                message=schemas.CommunityChatMessageCreate(
-                    message_text=message, user_id=user_id
-                ),
-            )
-
-            for client in clients:
-                await client.send_json(
-                    {
-                        "user": {
-                            "user_id": str(chat_message.user_id),
-                            "name": str(user.name),
-                        },
-                        "message_id": str(chat_message.message_id),
-                        "message_text": str(chat_message.message_text),
-                        "created_at": str(chat_message.created_at),
-                    }
+            if len(message) > MAX_MESSAGE_LENGTH:
+                await websocket.close(code=status.WS_1009_MESSAGE_TOO_BIG)
+                break
+            if chat_writer.running:
+                chat_message = await chat_writer.add(user_id, message, user.name)
+            else:
+                chat_message, user = await async_crud.call(
+                    crud.create_community_chat_message,
+                    message=schemas.CommunityChatMessageCreate(
+                        message_text=message, user_id=user_id
+                    ),
                 )
+            hub.publish(COMMUNITY_ROOM, message_payload(chat_message, user))
 
     except Exception:
-        clients.remove(websocket)
+        pass
+    finally:
+        await hub.leave(COMMUNITY_ROOM, websocket)
 
 
-ticket_chats: Dict[int, Set[WebSocket]] = {}
+@app.websocket("/ws/sos/{user_id}")
+async def sos_feed_endpoint(websocket: WebSocket, user_id: int):
+    # Live open/close events for SOS near the client. Every message from the
+    # client sets where it is watching: {"lat": .., "long": .., "radius_km": ..};
+    # each one is answered with the SOS already open in that circle.
+    # Declared before the ticket chat route, which would also match its path.
+    user = await async_crud.call(crud.get_user, user_id)
+    if not user:
+        return
+    if not sos_feed.ready:
+        sos_feed.load(await async_crud.call(crud.get_sos))
+
+    await websocket.accept()
+    connection = hub.join(SOS_ROOM, websocket)
+
+    try:
+        while True:
+            area = await websocket.receive_json()
+            nearby = sos_feed.watch(
+                websocket,
+                float(area["lat"]),
+                float(area["long"]),
+                float(area.get("radius_km", 5)),
+            )
+            connection.offer(
+                json.dumps({"event": "sos_snapshot", "sos": nearby}, separators=(",", ":"))
+            )
+    except Exception:
+        pass
+    finally:
+        sos_feed.unwatch(websocket)
+        await hub.leave(SOS_ROOM, websocket)
+
+
+@app.websocket("/ws/location/{sos_id}/{user_id}")
+async def location_endpoint(websocket: WebSocket, sos_id: int, user_id: int):
+    # The owner of an open SOS streams {"lat": .., "long": ..} as often as the
+    # phone reports; every other user connected here watches. Both get the
+    # recent trail on joining, then the newest point at a capped rate.
+    sos = await async_crud.call(crud.get_open_sos, sos_id)
+    if sos is None:
+        return
+    user = await async_crud.call(crud.get_user, user_id)
+    if not user:
+        return
+    sharing = int(str(sos.user_id)) == user_id
+
+    await websocket.accept()
+    # Trails live on the worker the owner is connected to
+    points = location_stream.trail(sos_id)
+    if points is None:
+        points = stored_points(await async_crud.call(crud.get_sos_locations, sos_id))
+    room = location_room(sos_id)
+    connection = hub.join(room, websocket)
+    connection.offer(
+        json.dumps({"event": "trail", "sos_id": sos_id, "points": points}, separators=(",", ":"))
+    )
+
+    try:
+        while True:
+            location = await websocket.receive_json()
+            if sharing:
+                location_stream.update(sos_id, float(location["lat"]), float(location["long"]))
+    except Exception:
+        pass
+    finally:
+        await hub.leave(room, websocket)
 
 
 @app.websocket("/ws/{ticket_id}/{user_id}")
 async def ticket_chat_endpoint(
-    websocket: WebSocket, ticket_id: int, user_id: int, db: Session = Depends(get_db)
+    websocket: WebSocket, ticket_id: int, user_id: int, since: int | None = None
 ):
-    ticket = crud.get_ticket(db, ticket_id)
+    ticket = await async_crud.call(crud.get_ticket, ticket_id)
     # If ticket is closed or not available then just do nothing
     if ticket is None or bool(ticket.is_open) == False:
         return
@@ -99,56 +372,83 @@ async def ticket_chat_endpoint(
     if int(str(ticket.user_id)) != user_id and int(str(ticket.teacher_id)) != user_id:
         return
 
+    # ?since=<message_id> replays what the client missed, from memory when
+    # the ticket's history buffer covers it. FastAPI closes the socket with
+    # 1008 (policy violation) when it is not a number.
+    if since is not None:
+        await async_fill_history(ticket_id)
+        missed = ticket_history.page(ticket_id, after=since, limit=MAX_REPLAY)
+        if missed is None:
+            missed = await async_crud.call(
+                crud.get_ticket_messages, ticket_id, after=since, limit=MAX_REPLAY
+            )
+
+    if chat_writer.running:
+        # Looked up once here instead of with every message
+        user = await async_crud.call(crud.get_user, user_id)
+
+    room = ticket_room(ticket_id)
     await websocket.accept()
-    ticket_chats.setdefault(ticket_id, set()).add(websocket)
+    connection = hub.join(room, websocket)
+    if since is not None:
+        # Anything delivered since the page was read is on its way already
+        missed = ticket_history.page(ticket_id, after=since, limit=MAX_REPLAY) or missed
+        for message in missed:
+            connection.offer(
+                json.dumps(
+                    message_payload(message, message),
+                    separators=(",", ":"),
+                    ensure_ascii=False,
+                )
+            )
 
     try:
         while True:
             message = await websocket.receive_text()
-            ticket_message, user = crud.create_ticket_message(
-                db=db,
-                message=schemas.TicketChatMessageCreate(
-                    ticket_id=ticket_id, message_text=message, user_id=user_id
-                ),
-            )
-            for client in ticket_chats[ticket_id]:
-                await client.send_json(
-                    {
-                        "user": {
-                            "user_id": str(ticket_message.user_id),
-                            "name": str(user.name),
-                        },
-                        "message_id": str(ticket_message.message_id),
-                        "message_text": str(ticket_message.message_text),
-                        "created_at": str(ticket_message.created_at),
-                    }
+            if len(message) > MAX_MESSAGE_LENGTH:
+                await websocket.close(code=status.WS_1009_MESSAGE_TOO_BIG)
+                break
+            if chat_writer.running:
+                ticket_message = await chat_writer.add(
+                    user_id, message, user.name, ticket_id=ticket_id
+                )
+            else:
+                ticket_message, user = await async_crud.call(
+                    crud.create_ticket_message,
+                    message=schemas.TicketChatMessageCreate(
+                        ticket_id=ticket_id, message_text=message, user_id=user_id
+                    ),
                 )
+            hub.publish(room, message_payload(ticket_message, user))
     except Exception:
-        ticket_chats[ticket_id].remove(websocket)
+        pass
+    finally:
+        await hub.leave(room, websocket)
 
 
 @app.post("/auth/register/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def create_user(user: schemas.UserCreate):
+    db_user = await async_crud.call(crud.get_user_by_email, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="User already registered")
 
     if len(user.phone_number) != 10:
         raise HTTPException(status_code=400, detail="Phone Number invalid")
 
-    return crud.create_user(db=db, user=user)
+    hashed_password = await passwords.hash_password(user.password)
+    return await async_crud.call(
+        crud.create_user, user=user, hashed_password=hashed_password
+    )
 
 
 @app.post("/auth/login/", response_model=schemas.User)
-def login_user(user: schemas.UserLogin, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def login_user(user: schemas.UserLogin):
+    db_user = await async_crud.call(crud.get_user_by_email, email=user.email)
     if not db_user:
         raise HTTPException(status_code=400, detail="User is not registered")
 
     # check if password matches
-    if not bcrypt.checkpw(
-        user.password.encode("utf-8"), str(db_user.hashed_password).encode("utf-8")
-    ):
+    if not await passwords.verify_password(user.password, str(db_user.hashed_password)):
         raise HTTPException(status_code=400, detail="User credentials invalid")
 
     return db_user
@@ -156,7 +456,7 @@ def login_user(user: schemas.UserLogin, db: Session = Depends(get_db)):
 
 @app.post("/tickets/create/", response_model=schemas.Ticket)
 def create_ticket(ticket: schemas.TicketCreate, db: Session = Depends(get_db)):
-    teacher_id = crud.get_user_with_min_open_tickets(db)
+    teacher_id = crud.assign_teacher(db)
     if teacher_id:
         return crud.create_ticket(db, ticket, teacher_id)
 
@@ -166,9 +466,25 @@ def create_ticket(ticket: schemas.TicketCreate, db: Session = Depends(get_db)):
     )
 
 
+@app.post("/tickets/import/", response_model=list[schemas.Ticket])
+def import_tickets(
+    tickets: list[schemas.TicketCreate] = Body(..., max_length=IMPORT_BATCH_SIZE),
+    db: Session = Depends(get_db),
+):
+    if not tickets:
+        return []
+
+    created = crud.import_tickets(db, tickets)
+    if created is None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="No teacher found to open ticket with",
+        )
+    return created
+
+
 @app.patch("/tickets/close/{ticket_id}")
 def close_ticket(ticket_id: int, db: Session = Depends(get_db)):
-    # Remove the ticket_id from ticket_chats as well
     ticket = crud.get_ticket(db, ticket_id)
     if not ticket:
         raise HTTPException(
@@ -176,19 +492,45 @@ def close_ticket(ticket_id: int, db: Session = Depends(get_db)):
             detail="Ticket not found",
         )
 
-    ticket_chats.pop(ticket_id, None)
+    # Disconnect anyone still in the ticket's chat room
+    from_thread.run(hub.close_room, ticket_room(ticket_id))
     return crud.close_ticket(db, ticket_id)
 
 
-@app.get("/tickets/messages/{ticket_id}")
-def get_ticket_messages(ticket_id: int, db: Session = Depends(get_db)):
+@app.get("/tickets/messages/{ticket_id}", response_model=list[schemas.TicketChatMessage])
+def get_ticket_messages(
+    ticket_id: int,
+    before: int | None = None,
+    after: int | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    # Paged like the community history. Open tickets are answered from
+    # ticket_history when the page is recent enough.
+    messages = ticket_history.page(ticket_id, before=before, after=after, limit=limit)
+    if messages is not None:
+        return messages
+
     ticket = crud.get_ticket(db, ticket_id)
     if ticket is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="TicketID invalid"
         )
 
-    return crud.get_ticket_messages(db, ticket_id)
+    if chat_writer.running:
+        # Pages from the database include what this worker has not written yet
+        from_thread.run(chat_writer.flush)
+
+    if ticket.is_open:
+        ticket_history.fill(
+            ticket_id,
+            lambda: crud.get_ticket_messages(db, ticket_id, limit=ticket_history.size),
+        )
+        messages = ticket_history.page(ticket_id, before=before, after=after, limit=limit)
+        if messages is not None:
+            return messages
+
+    return crud.get_ticket_messages(db, ticket_id, before=before, after=after, limit=limit)
 
 
 @app.get("/tickets/{user_id}")
@@ -203,26 +545,70 @@ def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
 
 
 @app.get("/community_chat/messages/", response_model=List[schemas.ChatMessageSchema])
-def get_community_chat_messages(db: Session = Depends(get_db)):
-    return crud.get_community_chat_messages(db)
+def get_community_chat_messages(
+    request: Request,
+    before: int | None = None,
+    after: int | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    # Pass the oldest message_id seen as `before` to page back, or the newest
+    # as `after` to catch up
+    if chat_writer.running:
+        from_thread.run(chat_writer.flush)
+    chats = crud.get_community_chat_rows(db, before=before, after=after, limit=limit)
+    return encoding.respond(
+        request,
+        lambda: [crud.community_chat_message(chat) for chat in chats],
+        lambda: community_chat_columns(chats),
+    )
+
+
+def community_chat_columns(chats):
+    return {
+        "message_id": ("<i8", [chat.message_id for chat in chats]),
+        "user_id": ("<i8", [chat.user_id for chat in chats]),
+        "name": [chat.name for chat in chats],
+        "message_text": [chat.message_text for chat in chats],
+        "created_at": [str(chat.created_at) for chat in chats],
+    }
 
 
 @app.post("/chatbot/", response_model=ChatbotResponse)
 def chat_with_bot(request: ChatbotRequest):
-    response_message = chatBot.get_answer(request.message)
+    response_message = get_chatbot().get_answer(request.message)
     return {"response": response_message}
 
 
-@app.post("/sos/create")
-async def create_sos(request: schemas.SOSRequest, db: Session = Depends(get_db)):
-    user = crud.get_user(db, user_id=request.user_id)
-    try:
-        if user:
-            name = str(user.name)
-            phone_number = str(user.phone_number)
-            map_link = f"https://www.google.com/maps/search/?api=1&query={request.lat},{request.long}"
+@app.post("/chatbot/stream")
+async def stream_chat_with_bot(request: ChatbotRequest):
+    # Server-Sent Events: one `data: {"token": ...}` per chunk, then `event: done`,
+    # or `event: error` with a `detail` if the answer failed
+    chatbot = _chatbot or await run_in_threadpool(get_chatbot)
+
+    async def events():
+        try:
+            async for token in chatbot.stream_answer(request.message):
+                yield f"data: {json.dumps({'token': token})}\n\n"
+        except Exception as exc:
+            # The status line is long gone, the client learns it from the stream
+            print(exc)
+            yield f"event: error\ndata: {json.dumps({'detail': str(exc)})}\n\n"
+            return
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
-            message = f"""
+def sos_message(request: schemas.SOSRequest):
+    map_link = f"https://www.google.com/maps/search/?api=1&query={request.lat},{request.long}"
+
+    def text(user):
+        return f"""
 Urgent! Need Help Now 🆘
 
 Hey everyone,
@@ -234,51 +620,231 @@ I'm in a tough spot and need assistance ASAP.
 If anyone's nearby, please come to help.
 
 Thanks,
-{name}
-{phone_number}
+{user.name}
+{user.phone_number}
     """
 
-            chat_message, _ = crud.create_community_chat_message(
-                db,
-                message=schemas.CommunityChatMessageCreate(
-                    message_text=message, user_id=request.user_id
-                ),
-            )
+    return text
+
+
+async def broadcast_sos(sos, chat_message, user, received):
+    # Runs after the SOS has been acknowledged. Async so that Starlette runs
+    # it on the event loop: the hub's queues are not thread-safe.
+    hub.publish(COMMUNITY_ROOM, message_payload(chat_message, user))
+    hub.publish(SOS_ROOM, sos_feed.opened_event(sos))
+    sos_broadcast_seconds.observe(time.perf_counter() - received)
 
-            # Send Message to any connected clients to room
-            for client in clients:
-                await client.send_json(
-                    {
-                        "user": {
-                            "user_id": str(chat_message.user_id),
-                            "name": str(user.name),
-                        },
-                        "message_id": str(chat_message.message_id),
-                        "message_text": str(chat_message.message_text),
-                        "created_at": str(chat_message.created_at),
-                    }
-                )
 
-            return crud.create_sos(db, request)
+@app.post("/sos/create")
+async def create_sos(request: schemas.SOSRequest, background_tasks: BackgroundTasks):
+    # Priority lane: reserved connections and threads (async_crud.call_sos),
+    # one transaction for the SOS and its alert, and the reply goes out as
+    # soon as that is committed. The chat broadcast happens afterwards.
+    received = time.perf_counter()
+    try:
+        created = await async_crud.call_sos(
+            crud.create_sos_alert, request, sos_message(request)
+        )
     except Exception as exc:
+        sos_failures.inc()
         raise HTTPException(status_code=500, detail=f"some error happened: {exc}")
+    if created is None:
+        return None
+
+    sos, chat_message, user = created
+    background_tasks.add_task(broadcast_sos, sos, chat_message, user, received)
+
+    elapsed = time.perf_counter() - received
+    sos_ack_seconds.observe(elapsed)
+    if elapsed > SOS_ACK_SLO:
+        sos_slo_breaches.inc()
+    return sos._asdict()
 
 
 @app.patch("/sos/close/{user_id}")
 def close_sos(user_id: int, db: Session = Depends(get_db)):
-    id = crud.close_sos(db, user_id)
-    return {"respone": f"success, updated id ${id}"}
+    closed = crud.close_sos(db, user_id)
+    from_thread.run(sos_closed, closed)
+    return {"respone": f"success, updated id ${len(closed)}"}
+
+
+async def sos_closed(rows):
+    for sos in rows:
+        hub.publish(SOS_ROOM, sos_feed.closed_event(sos))
+        await hub.close_room(location_room(sos.sos_id))
+
+
+def end_location_stream(room: str, text: str):
+    # Every worker drops the live trail of a closed SOS, not only the one
+    # that served the close
+    if room == SOS_ROOM:
+        event = json.loads(text)
+        if event["event"] == "sos_closed":
+            location_stream.end(event["sos_id"])
+
+
+hub.listen(end_location_stream)
 
 
 @app.get("/sos/")
-def get_sos(db: Session = Depends(get_db)):
-    return crud.get_sos(db)
+def get_sos(request: Request, db: Session = Depends(get_db)):
+    rows = crud.get_sos_rows(db)
+    return encoding.respond(request, lambda: sos_document(rows), lambda: sos_columns(rows))
+
+
+def sos_document(rows):
+    return [
+        {
+            "sos_id": row.sos_id,
+            "user_id": row.user_id,
+            "lat": row.lat,
+            "long": row.long,
+            "is_open": row.is_open,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        }
+        for row in rows
+    ]
+
+
+def sos_columns(rows):
+    return {
+        "sos_id": ("<i8", [row.sos_id for row in rows]),
+        "user_id": ("<i8", [row.user_id for row in rows]),
+        "lat": ("<f8", [row.lat for row in rows]),
+        "long": ("<f8", [row.long for row in rows]),
+        "is_open": [row.is_open for row in rows],
+        "created_at": [row.created_at.isoformat() if row.created_at else None for row in rows],
+    }
+
+
+def area_columns(markers):
+    return {
+        "latitude": ("<f8", [marker["center"]["latitude"] for marker in markers]),
+        "longitude": ("<f8", [marker["center"]["longitude"] for marker in markers]),
+        "radius": ("<i4", [marker["radius"] for marker in markers]),
+    }
+
+
+# Encoded bodies of whole /areas/ zoom levels by (zoom, media type), each
+# with the ETag it was built for
+area_bodies = {}
 
 
 @app.get("/areas/", response_model=Markers)
-async def get_areas(db: Session = Depends(get_db)):
-    coords = crud.get_all_coords(db)
-    return {"markers": utils.group_points(coords)}
+def get_areas(
+    request: Request,
+    min_lat: float | None = Query(None, ge=-90, le=90),
+    min_long: float | None = Query(None, ge=-180, le=180),
+    max_lat: float | None = Query(None, ge=-90, le=90),
+    max_long: float | None = Query(None, ge=-180, le=180),
+    zoom: int | None = Query(None, ge=0, le=22),
+    db: Session = Depends(get_db),
+):
+    # Clusters for one map zoom level (the finest by default), optionally
+    # only those centered in the bounding box. Served from memory; if
+    # startup did not build it, a box reads just its own rows.
+    box = (min_lat, min_long, max_lat, max_long)
+    if None in box:
+        if any(value is not None for value in box):
+            raise HTTPException(status_code=400, detail="min_lat, min_long, max_lat and max_long go together")
+        box = None
+    elif min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat is above max_lat")
+
+    if not hot_areas.ready:
+        if box is not None:
+            markers = hot_areas.cluster(crud.get_coords_in_box(db, *box), zoom)
+            return encoding.respond(request, lambda: {"markers": markers}, lambda: area_columns(markers))
+        hot_areas.rebuild(crud.get_all_coords(db))
+
+    if box is None:
+        etag, markers = hot_areas.snapshot(zoom)
+    else:
+        etag, markers = hot_areas.view(box, zoom)
+    media_type = encoding.negotiate(request.headers.get("accept"))
+    if media_type != encoding.JSON:
+        # Each encoding is its own representation
+        etag = f'{etag[:-1]}-{media_type.rsplit("/", 1)[1]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    document = lambda: {"markers": markers}
+    columns = lambda: area_columns(markers)
+    if box is None:
+        key = (zoom, media_type)
+        cached = area_bodies.get(key)
+        if cached is None or cached[0] != etag:
+            cached = area_bodies[key] = (etag, encoding.encode(media_type, document, columns))
+        body = cached[1]
+    else:
+        body = encoding.encode(media_type, document, columns)
+    return Response(
+        body,
+        media_type=media_type,
+        headers={"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"},
+    )
+
+
+@app.post("/areas/rebuild")
+def rebuild_areas(db: Session = Depends(get_db)):
+    hot_areas.rebuild(crud.get_all_coords(db))
+    return {"version": hot_areas.version}
+
+
+@app.get("/risk/cells", response_model=schemas.RiskMap)
+def get_risk_cells(
+    min_lat: float = Query(ge=-90, le=90),
+    min_long: float = Query(ge=-180, le=180),
+    max_lat: float = Query(ge=-90, le=90),
+    max_long: float = Query(ge=-180, le=180),
+    precision: int = Query(6, ge=risk.MIN_PRECISION, le=risk.PRECISION),
+    window: str = Query("all", pattern="^(all|24h|7d|30d)$"),
+    hour_from: int | None = Query(None, ge=0, le=23),
+    hour_to: int | None = Query(None, ge=0, le=23),
+    kinds: str = "sos,report",
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    # Risk heatmap: geohash cells of `precision` in the box, highest decayed
+    # score first, from the pre-aggregated risk tables. window limits it to
+    # recent events; hour_from..hour_to (wrapping past midnight, e.g. 22..5)
+    # to the hours of the day they happened in.
+    kinds = kinds.split(",")
+    if not set(kinds) <= set(risk.KINDS):
+        raise HTTPException(status_code=400, detail=f"kinds must be among {', '.join(risk.KINDS)}")
+    if (hour_from is None) != (hour_to is None):
+        raise HTTPException(status_code=400, detail="hour_from and hour_to go together")
+    hours_of_day = None
+    if hour_from is not None:
+        hours_of_day = [(hour_from + i) % 24 for i in range((hour_to - hour_from) % 24 + 1)]
+
+    rows = crud.get_risk_cells(
+        db,
+        min_lat,
+        min_long,
+        max_lat,
+        max_long,
+        precision=precision,
+        window=None if window == "all" else window,
+        hours_of_day=hours_of_day,
+        kinds=kinds,
+        limit=limit,
+    )
+    cells = []
+    for cell, count, score in rows:
+        lat, lon = risk.center(cell)
+        cells.append(
+            {"cell": cell, "latitude": lat, "longitude": lon, "count": count, "score": score}
+        )
+    return {"window": window, "precision": precision, "cells": cells}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 
 if __name__ == "__main__":
     try:
@@ -286,4 +852,6 @@ if __name__ == "__main__":
         port = int(port)
     except ValueError:
         port = 5000
+    import uvicorn
+
     uvicorn.run("main:app", host='0.0.0.0', port=port, log_level="info")
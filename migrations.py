@@ -0,0 +1,251 @@
+"""Schema migrations, run once per deploy rather than on app import.
+
+    python migrations.py upgrade   # create missing tables, apply pending migrations
+    python migrations.py status    # list applied and pending migrations
+    python migrations.py explain   # EXPLAIN the hot queries, fail if one seq-scans
+    python migrations.py rebuild-risk  # recompute the risk heatmap aggregates
+
+Run explain against a copy of production or a seeded database; on nearly
+empty tables the planner can pick one index where a real load uses several.
+tests/test_migrations.py runs the same check on TEST_DATABASE_URL.
+
+Migrations are plain Postgres statements applied in order, each in its own
+transaction together with its row in schema_migrations. They are written to
+be no-ops on a database created from the current models. A step can also be
+a function of the connection, for data that SQL alone cannot compute.
+"""
+import json
+import sys
+
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+import crud, models
+from database import SessionLocal, engine
+
+
+def rebuild_risk_cells(connection):
+    # The session works in a savepoint of the migration's transaction
+    with Session(bind=connection, join_transaction_mode="create_savepoint") as db:
+        crud.rebuild_risk_cells(db)
+        db.commit()
+
+
+MIGRATIONS = [
+    (
+        "0001_teacher_load_counter",
+        [
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS open_ticket_count integer NOT NULL DEFAULT 0",
+            """UPDATE users SET open_ticket_count = (
+                SELECT count(*) FROM tickets
+                WHERE tickets.teacher_id = users.user_id AND tickets.is_open
+            )""",
+            "CREATE INDEX IF NOT EXISTS ix_users_teacher_load ON users (open_ticket_count, user_id) WHERE is_teacher",
+        ],
+    ),
+    (
+        "0002_hot_path_indexes",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_sos_open_user ON sos (user_id) WHERE is_open",
+            "CREATE INDEX IF NOT EXISTS ix_tickets_open_user ON tickets (user_id) WHERE is_open",
+            "CREATE INDEX IF NOT EXISTS ix_tickets_open_teacher ON tickets (teacher_id) WHERE is_open",
+            "CREATE INDEX IF NOT EXISTS ix_ticket_chat_messages_ticket ON ticket_chat_messages (ticket_id, message_id)",
+            "CREATE INDEX IF NOT EXISTS ix_community_chat_messages_created_at ON community_chat_messages (created_at)",
+        ],
+    ),
+    (
+        "0003_risk_heatmap",
+        [
+            # Existing rows keep NULL: their time is unknown
+            "ALTER TABLE sos ADD COLUMN IF NOT EXISTS created_at timestamp",
+            "ALTER TABLE sos ALTER COLUMN created_at SET DEFAULT now()",
+            "ALTER TABLE ticket_reports ADD COLUMN IF NOT EXISTS created_at timestamp",
+            "ALTER TABLE ticket_reports ALTER COLUMN created_at SET DEFAULT now()",
+            # except reports, whose ticket's first message was written with them
+            """UPDATE ticket_reports SET created_at = first.created_at
+            FROM (
+                SELECT ticket_id, min(created_at) AS created_at
+                FROM ticket_chat_messages GROUP BY ticket_id
+            ) AS first
+            WHERE first.ticket_id = ticket_reports.ticket_id
+                AND ticket_reports.created_at IS NULL""",
+            # The risk tables themselves are created from the models
+            rebuild_risk_cells,
+        ],
+    ),
+    (
+        "0004_area_bbox_indexes",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_sos_lat_long ON sos (lat, long)",
+            "CREATE INDEX IF NOT EXISTS ix_ticket_reports_lat_long ON ticket_reports (lat, long)",
+        ],
+    ),
+]
+
+# Any number, only has to be the same for every deploy
+LOCK_ID = 7_420_211
+
+
+def applied(connection):
+    connection.execute(
+        text(
+            """CREATE TABLE IF NOT EXISTS schema_migrations (
+                id text PRIMARY KEY,
+                applied_at timestamp NOT NULL DEFAULT now()
+            )"""
+        )
+    )
+    return {row.id for row in connection.execute(text("SELECT id FROM schema_migrations"))}
+
+
+def upgrade(bind=engine):
+    models.Base.metadata.create_all(bind=bind)
+
+    with bind.begin() as connection:
+        # Two deploys starting at once wait for each other
+        connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": LOCK_ID})
+        done = applied(connection)
+        for migration_id, statements in MIGRATIONS:
+            if migration_id in done:
+                continue
+            with connection.begin_nested():
+                for statement in statements:
+                    if callable(statement):
+                        statement(connection)
+                    else:
+                        connection.execute(text(statement))
+                connection.execute(
+                    text("INSERT INTO schema_migrations (id) VALUES (:id)"),
+                    {"id": migration_id},
+                )
+            print(f"applied {migration_id}")
+
+
+def status():
+    with engine.begin() as connection:
+        done = applied(connection)
+    for migration_id, _ in MIGRATIONS:
+        print(f"{'applied' if migration_id in done else 'pending'}  {migration_id}")
+
+
+# crud call to replay, and an index its first statement must be able to use
+EXPLAIN_CASES = [
+    ("get_sos", lambda db: crud.get_sos(db), ["ix_sos_open_user"]),
+    ("close_sos", lambda db: crud.close_sos(db, 0), ["ix_sos_open_user"]),
+    (
+        "get_open_user_tickets",
+        lambda db: crud.get_open_user_tickets(db, 0),
+        ["ix_tickets_open_user", "ix_tickets_open_teacher"],
+    ),
+    ("assign_teacher", crud.assign_teacher, ["ix_users_teacher_load"]),
+    (
+        "get_ticket_messages",
+        lambda db: crud.get_ticket_messages(db, 0),
+        ["ix_ticket_chat_messages_ticket"],
+    ),
+    (
+        "get_sos_locations",
+        lambda db: crud.get_sos_locations(db, 0),
+        ["ix_sos_locations_sos"],
+    ),
+    (
+        "get_coords_in_box",
+        lambda db: crud.get_coords_in_box(db, 28.7, 77.4, 28.9, 77.6),
+        ["ix_sos_lat_long"],
+    ),
+    (
+        "get_risk_cells",
+        lambda db: crud.get_risk_cells(db, 28.7, 77.4, 28.9, 77.6, window="7d"),
+        ["ix_risk_cells_lat_long", "risk_cell_hours_pkey"],
+    ),
+    (
+        "get_community_chat_messages",
+        lambda db: crud.get_community_chat_messages(db, before=1),
+        ["community_chat_messages_pkey"],
+    ),
+]
+
+
+def rebuild_risk():
+    with SessionLocal() as db:
+        cells = crud.rebuild_risk_cells(db)
+        db.commit()
+    print(f"rebuilt {cells} risk cells")
+
+
+def resync_loads():
+    # Tickets opened or closed outside the app leave users.open_ticket_count,
+    # which assign_teacher picks by, out of date
+    with SessionLocal() as db:
+        crud.resync_teacher_loads(db)
+    print("resynced teacher ticket loads")
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def plan_indexes(call, sessions=SessionLocal):
+    # Indexes and seq-scanned tables in the plan of the first statement
+    # call(db) runs
+    db = sessions()
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    connection = db.connection()
+    # Planner has to use an index whenever one fits, even on tiny tables
+    connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    event.listen(connection, "before_cursor_execute", capture)
+    try:
+        call(db)
+    except HTTPException:
+        pass
+    finally:
+        event.remove(connection, "before_cursor_execute", capture)
+
+    statement, parameters = captured[0]
+    result = connection.exec_driver_sql(
+        "EXPLAIN (FORMAT JSON) " + statement, parameters
+    ).scalar()
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]["Plan"]
+    db.rollback()
+    db.close()
+
+    nodes = list(plan_nodes(plan))
+    indexes = {node["Index Name"] for node in nodes if "Index Name" in node}
+    seq_scans = {node["Relation Name"] for node in nodes if node["Node Type"] == "Seq Scan"}
+    return indexes, seq_scans
+
+
+def explain():
+    failures = 0
+    for name, call, expected in EXPLAIN_CASES:
+        indexes, seq_scans = plan_indexes(call)
+        ok = not seq_scans and all(index in indexes for index in expected)
+        failures += not ok
+        detail = ", ".join(sorted(indexes)) or "no index"
+        if seq_scans:
+            detail += f"; seq scan on {', '.join(sorted(seq_scans))}"
+        print(f"{'ok  ' if ok else 'FAIL'}  {name}: {detail}")
+    return failures
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        upgrade()
+    elif command == "status":
+        status()
+    elif command == "explain":
+        sys.exit(1 if explain() else 0)
+    elif command == "rebuild-risk":
+        rebuild_risk()
+    elif command == "resync-loads":
+        resync_loads()
+    else:
+        sys.exit(f"unknown command: {command}")
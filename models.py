@@ -8,6 +8,7 @@ from sqlalchemy import (
     Text,
     func,
     BOOLEAN,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from database import Base
@@ -22,6 +23,17 @@ class User(Base):
     hashed_password = Column(Text, nullable=False)
     is_teacher = Column(BOOLEAN, default=False, nullable=False)
     phone_number = Column(String, nullable=False)
+    # Open tickets assigned to this teacher, kept by crud.assign_teacher / close_ticket
+    open_ticket_count = Column(Integer, default=0, server_default="0", nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_users_teacher_load",
+            "open_ticket_count",
+            "user_id",
+            postgresql_where=is_teacher,
+        ),
+    )
 
     community_messages = relationship(
         "CommunityChatMessage",
@@ -44,7 +56,7 @@ class CommunityChatMessage(Base):
     message_id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     message_text = Column(Text, nullable=False)
-    created_at = Column("created_at", TIMESTAMP, server_default=func.now())
+    created_at = Column("created_at", TIMESTAMP, server_default=func.now(), index=True)
 
 
 class SOS(Base):
@@ -54,6 +66,28 @@ class SOS(Base):
     lat = Column(Float(precision=53), nullable=False)
     long = Column(Float(precision=53), nullable=False)
     is_open = Column(BOOLEAN, default=True, nullable=False)
+    # NULL for rows from before migration 0003
+    created_at = Column("created_at", TIMESTAMP, server_default=func.now())
+
+    # get_sos and close_sos only ever look at open rows
+    __table_args__ = (
+        Index("ix_sos_open_user", "user_id", postgresql_where=is_open),
+        # Bounding box reads for /areas/
+        Index("ix_sos_lat_long", "lat", "long"),
+    )
+
+
+class SOSLocation(Base):
+    # Trail of an open SOS, written in batches by location_sharing.LocationStream
+    __tablename__ = "sos_locations"
+
+    location_id = Column(Integer, primary_key=True)
+    sos_id = Column(Integer, ForeignKey("sos.sos_id"), nullable=False)
+    lat = Column(Float(precision=53), nullable=False)
+    long = Column(Float(precision=53), nullable=False)
+    recorded_at = Column(TIMESTAMP, nullable=False)
+
+    __table_args__ = (Index("ix_sos_locations_sos", "sos_id", "recorded_at"),)
 
 
 class Ticket(Base):
@@ -66,6 +100,11 @@ class Ticket(Base):
     is_anonymous = Column(BOOLEAN, default=False, nullable=False)
     ticket_chat_messages = relationship("TicketChatMessage", backref="ticket")
 
+    __table_args__ = (
+        Index("ix_tickets_open_user", "user_id", postgresql_where=is_open),
+        Index("ix_tickets_open_teacher", "teacher_id", postgresql_where=is_open),
+    )
+
     reports = relationship(
         "TicketReport", backref="ticket", foreign_keys="[TicketReport.ticket_id]"
     )
@@ -79,6 +118,9 @@ class TicketReport(Base):
     report_content = Column(Text, nullable=False)
     lat = Column(Float(precision=53), nullable=False)
     long = Column(Float(precision=53), nullable=False)
+    created_at = Column("created_at", TIMESTAMP, server_default=func.now())
+
+    __table_args__ = (Index("ix_ticket_reports_lat_long", "lat", "long"),)
 
 
 class TicketChatMessage(Base):
@@ -89,3 +131,50 @@ class TicketChatMessage(Base):
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     message_text = Column(Text, nullable=False)
     created_at = Column("created_at", TIMESTAMP, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_ticket_chat_messages_ticket", "ticket_id", "message_id"),
+    )
+
+
+# Risk heatmap aggregates, one row per geohash cell (risk.PRECISION) and kind
+# of event ("sos" or "report"), kept by crud.record_risk
+class RiskCell(Base):
+    __tablename__ = "risk_cells"
+
+    cell = Column(String(12), primary_key=True)
+    kind = Column(String(8), primary_key=True)
+    # Cell center, for bounding box queries
+    lat = Column(Float(precision=53), nullable=False)
+    long = Column(Float(precision=53), nullable=False)
+    count = Column(Integer, nullable=False)
+    # Sum of risk.decay(decayed_at - created_at) over the cell's events
+    decayed = Column(Float(precision=53), nullable=False)
+    decayed_at = Column(TIMESTAMP, nullable=False)
+
+    __table_args__ = (Index("ix_risk_cells_lat_long", "lat", "long"),)
+
+
+class RiskCellHour(Base):
+    # Events per cell and hour, for the 24h / 7d / 30d windows; older hours
+    # are pruned
+    __tablename__ = "risk_cell_hours"
+
+    cell = Column(String(12), primary_key=True)
+    kind = Column(String(8), primary_key=True)
+    hour = Column(TIMESTAMP, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (Index("ix_risk_cell_hours_hour", "hour"),)
+
+
+class RiskCellHourOfDay(Base):
+    # All-time events per cell and hour of the day (0-23)
+    __tablename__ = "risk_cell_hours_of_day"
+
+    cell = Column(String(12), primary_key=True)
+    kind = Column(String(8), primary_key=True)
+    hour_of_day = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+    decayed = Column(Float(precision=53), nullable=False)
+    decayed_at = Column(TIMESTAMP, nullable=False)
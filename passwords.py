@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException, status
+
+from metrics import Counter, Gauge, Histogram
+
+# bcrypt releases the GIL while hashing, so a thread pool gets real parallelism
+# without the pickling and startup cost of a process pool
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+POOL_SIZE = int(os.environ.get("PASSWORD_POOL_SIZE", str(os.cpu_count() or 2)))
+# Hash requests allowed to wait for a worker before new ones get a 503
+MAX_PENDING = int(os.environ.get("PASSWORD_MAX_PENDING", str(POOL_SIZE * 8)))
+
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="bcrypt")
+_pending = 0
+
+queue_depth = Gauge(
+    "safeher_password_queue_depth",
+    "Password hash/verify calls waiting for a pool worker",
+)
+in_flight = Gauge(
+    "safeher_password_in_flight",
+    "Password hash/verify calls admitted to the pool, waiting or running",
+    function=lambda: _pending,
+)
+hash_seconds = Histogram(
+    "safeher_password_hash_seconds",
+    "Time spent in bcrypt per call",
+    labels=("op",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+wait_seconds = Histogram(
+    "safeher_password_queue_wait_seconds",
+    "Time a password call waited for a pool worker",
+)
+rejected = Counter(
+    "safeher_password_rejected_total",
+    "Password calls refused because the pool queue was full",
+)
+
+
+def _timed(op, fn, submitted, *args):
+    started = time.perf_counter()
+    queue_depth.dec()
+    wait_seconds.observe(started - submitted)
+    try:
+        return fn(*args)
+    finally:
+        hash_seconds.observe(time.perf_counter() - started, op=op)
+
+
+def _dequeued_unstarted(future):
+    # A call cancelled while still queued (its request went away) never
+    # reaches _timed, which is what takes the others off queue_depth
+    if future.cancelled():
+        queue_depth.dec()
+
+
+async def _run(op, fn, *args):
+    global _pending
+    if _pending >= MAX_PENDING:
+        rejected.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, try again",
+            headers={"Retry-After": "1"},
+        )
+
+    _pending += 1
+    queue_depth.inc()
+    try:
+        future = _executor.submit(_timed, op, fn, time.perf_counter(), *args)
+        future.add_done_callback(_dequeued_unstarted)
+        return await asyncio.wrap_future(future)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str):
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    hashed = await _run("hash", bcrypt.hashpw, password.encode("utf-8"), salt)
+    return hashed.decode("utf-8")
+
+
+async def verify_password(password: str, hashed_password: str):
+    return await _run(
+        "verify",
+        bcrypt.checkpw,
+        password.encode("utf-8"),
+        hashed_password.encode("utf-8"),
+    )
@@ -0,0 +1,89 @@
+import os
+from datetime import timedelta
+
+# Risk heatmap from SOS and ticket report history, served from per-geohash
+# cell aggregates (models.RiskCell and friends) that crud keeps current in
+# the same transaction as every insert.
+#
+# Scores decay exponentially with RISK_HALF_LIFE_DAYS. A cell stores its
+# score as of decayed_at; an update decays it to now before adding, and a
+# query decays it from decayed_at to now. Scores never exceed the event
+# count, so no half-life can overflow them. Changing the half-life needs
+# `python migrations.py rebuild-risk`.
+
+HALF_LIFE = timedelta(days=float(os.environ.get("RISK_HALF_LIFE_DAYS", "30")))
+
+# Cells are stored at precision 7 (about 150 m) and rolled up to coarser
+# precisions by prefix at query time
+PRECISION = 7
+MIN_PRECISION = 3
+
+WINDOWS = {
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+}
+# Decay factors are clamped at 2 ** -MAX_HALVINGS (about 1e-301), where
+# Postgres would raise an underflow error instead of returning 0
+MAX_HALVINGS = 1000
+
+# Hourly rows are only kept as long as the longest window needs them
+HOURS_KEPT = max(WINDOWS.values())
+
+KINDS = ("sos", "report")
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {c: i for i, c in enumerate(_BASE32)}
+
+
+def encode(lat: float, lon: float, precision=PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    cell = []
+    bits = 0
+    value = 0
+    even = True
+    while len(cell) < precision:
+        span, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (span[0] + span[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            span[0] = middle
+        else:
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            cell.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(cell)
+
+
+def bounds(cell: str):
+    # (min_lat, min_lon, max_lat, max_lon) of a cell
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for c in cell:
+        value = _DECODE[c]
+        for shift in range(4, -1, -1):
+            span = lon_range if even else lat_range
+            middle = (span[0] + span[1]) / 2
+            if value >> shift & 1:
+                span[0] = middle
+            else:
+                span[1] = middle
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def center(cell: str):
+    min_lat, min_lon, max_lat, max_lon = bounds(cell)
+    return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+
+def decay(age: timedelta):
+    # What one event is worth `age` after it happened
+    return 2.0 ** -min(max(age / HALF_LIFE, 0.0), MAX_HALVINGS)
@@ -60,6 +60,7 @@ class TicketChatMessageCreate(TickerChatMessageBase):
 
 class TicketChatMessage(TickerChatMessageBase):
     message_id: int
+    ticket_id: int
     created_at: datetime
 
     class Config:
@@ -124,3 +125,17 @@ class ChatMessageSchema(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class RiskCell(BaseModel):
+    cell: str
+    latitude: float
+    longitude: float
+    count: int
+    score: float
+
+
+class RiskMap(BaseModel):
+    window: str
+    precision: int
+    cells: List[RiskCell]
@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+
+import numpy as np
+import pytest
+
+import chatBot
+
+
+class FakeEmbeddings:
+    # Bag of words: the same words in any order give the same vector
+    def __init__(self):
+        self.texts = []
+
+    def embed_query(self, text):
+        self.texts.append(text)
+        vector = np.zeros(64, dtype=np.float32)
+        for word in chatBot.normalize(text).split():
+            vector[hashlib.md5(word.encode()).digest()[0] % 64] += 1
+        return vector.tolist()
+
+
+class FakeChain:
+    def __init__(self, tokens=("Call ", "campus ", "security.")):
+        self.tokens = tokens
+        self.calls = []
+
+    def run(self, input_documents, question, max_tokens):
+        self.calls.append((input_documents, question))
+        return "".join(self.tokens)
+
+    async def arun(self, input_documents, question, max_tokens, callbacks):
+        self.calls.append((input_documents, question))
+        (handler,) = callbacks
+        for token in self.tokens:
+            await handler.on_llm_new_token(token)
+        await handler.on_llm_end(None)
+        return "".join(self.tokens)
+
+
+class FailingChain(FakeChain):
+    # Fails after `after` tokens; 0 is before the LLM would have started
+    def __init__(self, after=0):
+        super().__init__()
+        self.after = after
+
+    async def arun(self, input_documents, question, max_tokens, callbacks):
+        (handler,) = callbacks
+        for token in self.tokens[: self.after]:
+            await handler.on_llm_new_token(token)
+        raise RuntimeError("retriever unavailable")
+
+
+class FakeIndex:
+    def __init__(self):
+        self.vectors = []
+
+    def similarity_search_by_vector_with_score(self, vector, k):
+        self.vectors.append(vector)
+        return [("doc", 0.9)]
+
+
+@pytest.fixture
+def pipeline():
+    fake = chatBot.Pipeline(FakeEmbeddings(), FakeChain(), FakeIndex())
+    chatBot.set_pipeline(fake)
+    yield fake
+    chatBot.set_pipeline(None)
+
+
+def lookups(result):
+    return chatBot.cache_lookups.values.get((result,), 0)
+
+
+def stream(question, received=None):
+    async def collect():
+        async for token in chatBot.stream_answer(question):
+            received.append(token)
+        return received
+
+    received = [] if received is None else received
+    return asyncio.run(asyncio.wait_for(collect(), 5))
+
+
+def test_miss_then_exact_hit(pipeline):
+    misses, exact = lookups("miss"), lookups("exact")
+
+    assert chatBot.get_answer("How do I call campus security?") == "Call campus security."
+    assert chatBot.get_answer("how do i call  CAMPUS security") == "Call campus security."
+
+    assert len(pipeline.qa_chain.calls) == 1
+    assert lookups("miss") == misses + 1
+    assert lookups("exact") == exact + 1
+
+
+def test_semantic_hit(pipeline):
+    chatBot.get_answer("How do I call campus security?")
+    semantic = lookups("semantic")
+
+    assert chatBot.get_answer("Campus security, how do I call?") == "Call campus security."
+
+    assert len(pipeline.qa_chain.calls) == 1
+    assert lookups("semantic") == semantic + 1
+
+
+def test_expired_answer_is_a_miss(pipeline, monkeypatch):
+    monkeypatch.setattr(chatBot.answer_cache, "ttl", 0.0)
+
+    chatBot.get_answer("How do I call campus security?")
+    chatBot.get_answer("How do I call campus security?")
+
+    assert len(pipeline.qa_chain.calls) == 2
+    assert len(chatBot.answer_cache) == 1
+
+
+def test_set_pipeline_invalidates(pipeline):
+    chatBot.get_answer("How do I call campus security?")
+
+    other = chatBot.Pipeline(FakeEmbeddings(), FakeChain(("Dial 100.",)), FakeIndex())
+    chatBot.set_pipeline(other)
+
+    assert chatBot.get_answer("How do I call campus security?") == "Dial 100."
+    assert len(other.qa_chain.calls) == 1
+
+
+def test_stream_miss_then_hit(pipeline):
+    assert stream("How do I call campus security?") == ["Call ", "campus ", "security."]
+    # Cached whole once the stream finished
+    assert stream("How do I call campus security?") == ["Call campus security."]
+
+    assert len(pipeline.qa_chain.calls) == 1
+
+
+def test_retrieves_with_the_prompt_by_default(pipeline):
+    chatBot.get_answer("How do I call campus security?")
+
+    query = chatBot.make_query("How do I call campus security?")
+    assert pipeline.embeddings.texts == ["How do I call campus security?", query]
+    assert pipeline.docsearch.vectors == [pipeline.embeddings.embed_query(query)]
+    assert pipeline.qa_chain.calls == [(["doc"], query)]
+
+
+def test_retrieve_question_reuses_the_cache_embedding(pipeline, monkeypatch):
+    monkeypatch.setattr(chatBot, "retrieve_question", True)
+
+    chatBot.get_answer("How do I call campus security?")
+
+    assert pipeline.embeddings.texts == ["How do I call campus security?"]
+    assert pipeline.docsearch.vectors == [
+        pipeline.embeddings.embed_query("How do I call campus security?")
+    ]
+
+
+def test_stream_uses_the_streaming_chain(pipeline):
+    streaming = FakeChain(("Dial ", "100."))
+    chatBot.set_pipeline(
+        chatBot.Pipeline(pipeline.embeddings, pipeline.qa_chain, pipeline.docsearch, streaming)
+    )
+
+    assert stream("How do I call campus security?") == ["Dial ", "100."]
+    assert chatBot.get_answer("Who do I call at night?") == "Call campus security."
+    assert len(streaming.calls) == 1
+    assert len(pipeline.qa_chain.calls) == 1
+
+
+@pytest.mark.parametrize("after", [0, 2])
+def test_stream_raises_when_the_chain_fails(pipeline, after):
+    # Before the LLM starts its end callback never runs; that must not hang
+    chatBot.set_pipeline(
+        chatBot.Pipeline(FakeEmbeddings(), FailingChain(after), FakeIndex())
+    )
+    received = []
+
+    with pytest.raises(RuntimeError, match="retriever unavailable"):
+        stream("How do I call campus security?", received)
+
+    assert received == ["Call ", "campus "][:after]
+    assert len(chatBot.answer_cache) == 0
+
+
+def test_sse_reports_errors(pipeline, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    chatBot.set_pipeline(
+        chatBot.Pipeline(FakeEmbeddings(), FailingChain(1), FakeIndex())
+    )
+    monkeypatch.setattr(main, "_chatbot", chatBot)
+
+    response = TestClient(main.app).post("/chatbot/stream", json={"message": "help"})
+
+    assert response.text == (
+        'data: {"token": "Call "}\n\n'
+        'event: error\ndata: {"detail": "retriever unavailable"}\n\n'
+    )
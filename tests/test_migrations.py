@@ -0,0 +1,32 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import migrations
+
+# A scratch Postgres database; upgrade() is run against it
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+@pytest.fixture(scope="module")
+def sessions():
+    engine = create_engine(DATABASE_URL)
+    migrations.upgrade(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.mark.parametrize(
+    "call, expected",
+    [case[1:] for case in migrations.EXPLAIN_CASES],
+    ids=[case[0] for case in migrations.EXPLAIN_CASES],
+)
+def test_hot_query_uses_its_index(sessions, call, expected):
+    indexes, seq_scans = migrations.plan_indexes(call, sessions)
+
+    assert not seq_scans
+    assert set(expected) <= indexes
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
+from operator import attrgetter
+
+# One ticket chat message, with the sender's name for the WebSocket payload
+TicketMessage = namedtuple(
+    "TicketMessage", "message_id ticket_id user_id message_text created_at name"
+)
+
+
+class _Buffer:
+    __slots__ = ("messages", "complete", "loaded")
+
+    def __init__(self, size):
+        self.messages: deque[TicketMessage] = deque(maxlen=size)
+        # True while the buffer still holds the ticket's whole history
+        self.complete = False
+        self.loaded = False
+
+
+class TicketHistory:
+    """Ring buffer of the newest messages of each open ticket.
+
+    Filled from the database the first time a ticket's history is asked for,
+    then kept current by ``deliver``, which the hub calls for every message
+    in a ticket room on every worker. Pages that fall inside the buffer are
+    served from memory; ``page`` returns None for anything older.
+
+    At most ``tickets`` buffers are kept, least recently used first out, and
+    a ticket's buffer is dropped when its room is closed, through
+    ``room_closed``.
+    """
+
+    def __init__(self, size=100, tickets=1000):
+        self.size = size
+        self.tickets = tickets
+        self._lock = threading.Lock()
+        self._buffers: OrderedDict[int, _Buffer] = OrderedDict()
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def deliver(self, room: str, text: str):
+        # Hub listener; ticket rooms are named "ticket:<id>"
+        if not room.startswith("ticket:"):
+            return
+        ticket_id = int(room.split(":", 1)[1])
+        with self._lock:
+            buffer = self._buffers.get(ticket_id)
+            if buffer is None:
+                return
+            payload = json.loads(text)
+            self._append(
+                buffer,
+                TicketMessage(
+                    int(payload["message_id"]),
+                    ticket_id,
+                    int(payload["user"]["user_id"]),
+                    payload["message_text"],
+                    datetime.fromisoformat(payload["created_at"]),
+                    payload["user"]["name"],
+                ),
+            )
+
+    def _append(self, buffer, message):
+        messages = buffer.messages
+        if not messages or messages[-1].message_id < message.message_id:
+            if len(messages) == self.size:
+                buffer.complete = False
+            messages.append(message)
+            return
+        # Out of order, e.g. an id from another worker's chat_writer block
+        i = bisect_left(messages, message.message_id, key=attrgetter("message_id"))
+        if i < len(messages) and messages[i].message_id == message.message_id:
+            return
+        if len(messages) == self.size:
+            if i == 0:
+                return
+            messages.popleft()
+            buffer.complete = False
+            i -= 1
+        messages.insert(i, message)
+
+    def fill(self, ticket_id: int, load):
+        # load() returns the newest `size` messages, oldest first. Messages
+        # delivered while it runs are kept, so none fall in the gap.
+        with self._lock:
+            buffer = self._buffers.get(ticket_id)
+            if buffer is not None and buffer.loaded:
+                return
+            if buffer is None:
+                buffer = self._buffers[ticket_id] = _Buffer(self.size)
+                while len(self._buffers) > self.tickets:
+                    self._buffers.popitem(last=False)
+
+        messages = [TicketMessage(*row) for row in load()]
+
+        with self._lock:
+            if self._buffers.get(ticket_id) is not buffer:
+                return
+            live = list(buffer.messages)
+            buffer.messages.clear()
+            buffer.complete = len(messages) < self.size
+            for message in messages + live:
+                self._append(buffer, message)
+            buffer.loaded = True
+
+    def page(self, ticket_id: int, before=None, after=None, limit=100):
+        # Same paging as the database query, or None if the buffer cannot
+        # answer it
+        with self._lock:
+            buffer = self._buffers.get(ticket_id)
+            if buffer is None or not buffer.loaded:
+                return None
+            self._buffers.move_to_end(ticket_id)
+            messages = list(buffer.messages)
+            complete = buffer.complete
+
+        if after is not None:
+            if not complete and (not messages or after < messages[0].message_id):
+                return None
+            return [m for m in messages if m.message_id > after][:limit]
+
+        if before is not None:
+            messages = [m for m in messages if m.message_id < before]
+        if len(messages) < limit and not complete:
+            return None
+        return messages[-limit:]
+
+    def room_closed(self, room: str):
+        # Hub close listener, so every worker drops a closed ticket
+        if room.startswith("ticket:"):
+            self.evict(int(room.split(":", 1)[1]))
+
+    def evict(self, ticket_id: int):
+        with self._lock:
+            self._buffers.pop(ticket_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+
+
+ticket_history = TicketHistory(
+    size=int(os.environ.get("TICKET_HISTORY_SIZE", "100")),
+    tickets=int(os.environ.get("TICKET_HISTORY_TICKETS", "1000")),
+)
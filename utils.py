@@ -1,5 +1,7 @@
 from math import radians, sin, cos, sqrt, atan2
 
+from clustering import ClusterIndex
+
 
 def distance(lat1, lon1, lat2, lon2):
     # Calculate the Haversine distance between two points on the earth
@@ -18,38 +20,9 @@ def distance(lat1, lon1, lat2, lon2):
 
 
 def group_points(points, threshold=0.2):  # Reduced threshold
-    groups = []
-
-    for point in points:
-        added_to_group = False
-        for group in groups:
-            center = group["center"]
-            if (
-                distance(
-                    point["latitude"],
-                    point["longitude"],
-                    center["latitude"],
-                    center["longitude"],
-                )
-                <= threshold
-            ):
-                group["points"].append(point)
-                group["center"]["latitude"] = sum(
-                    p["latitude"] for p in group["points"]
-                ) / len(group["points"])
-                group["center"]["longitude"] = sum(
-                    p["longitude"] for p in group["points"]
-                ) / len(group["points"])
-                added_to_group = True
-                break
-
-        if not added_to_group:
-            groups.append({"center": point.copy(), "points": [point]})
-
-    return [
-        {"center": group["center"], "radius": min(2 * len(group["points"]), 40)}
-        for group in groups
-    ]
+    index = ClusterIndex(threshold)
+    index.extend(points)
+    return index.markers()
 
 
 points = [
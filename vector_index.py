@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+from langchain.schema import Document
+
+
+class LocalIndex:
+    """FAQ embeddings searched in process instead of on Pinecone.
+
+    ``<path>.npy`` holds one L2-normalized float32 row per chunk and is
+    memory-mapped, ``<path>.json`` holds the matching chunk texts and
+    metadata. Both are written by build_faq_index.py.
+    """
+
+    def __init__(self, path: str):
+        self.vectors = np.load(f"{path}.npy", mmap_mode="r")
+        with open(f"{path}.json") as f:
+            self.documents = [
+                Document(page_content=item["page_content"], metadata=item["metadata"])
+                for item in json.load(f)
+            ]
+
+    def search(self, queries, k=4):
+        # Cosine top-k for a batch of query vectors: (scores, indices), best first
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        scores = queries @ self.vectors.T
+
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return (
+            np.take_along_axis(top_scores, order, axis=1),
+            np.take_along_axis(top, order, axis=1),
+        )
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        scores, indices = self.search(embedding, k)
+        return [
+            (self.documents[i], float(score))
+            for i, score in zip(indices[0], scores[0])
+        ]
+
+
+def save(path: str, vectors, documents):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.save(f"{path}.npy", vectors)
+    with open(f"{path}.json", "w") as f:
+        json.dump(
+            [
+                {"page_content": doc.page_content, "metadata": doc.metadata}
+                for doc in documents
+            ],
+            f,
+        )